@@ -110,6 +110,76 @@ WHERE
 	cursor.close()
 
 
+def assign_likelihood_ratios_array(connection, coinc_def_id, offset_vectors, vetoseglists, events_func, veto_func, ln_likelihood_ratio_array_func, likelihood_params_func, verbose = False, params_func_extra_args = (), blocksize = 1 << 16):
+	"""
+	Assigns likelihood ratio values to coincidences, evaluating them
+	in blocks.  Identical to assign_likelihood_ratios() except that
+	ln_likelihood_ratio_array_func is called with a list of (up to
+	blocksize) parameter dictionaries, any of which may be None, and
+	must return a sequence of the natural logarithms of their
+	likelihood ratios with NaN in place of the None entries (e.g., the
+	.array() method of a snglcoinc.LnLikelihoodRatio instance).  The
+	results are written back with one executemany() per block instead
+	of an SQL function call per coinc.
+	"""
+	#
+	# Convert offset vector keys to strings so that we can use the
+	# dictionary inside an SQL query (they might be
+	# glue.ligolw.ilwd_char objects)
+	#
+
+	offset_vectors = dict((unicode(time_slide_id), offset_vector) for time_slide_id, offset_vector in offset_vectors.items())
+
+	#
+	# Retrieve the coincs to process.  events_func() is allowed to
+	# reuse the cursor so the IDs must be fetched in full first
+	#
+
+	cursor = connection.cursor()
+	coincs = cursor.execute("""
+SELECT
+	coinc_event_id,
+	time_slide_id
+FROM
+	coinc_event
+WHERE
+	coinc_def_id == ?
+	""", (unicode(coinc_def_id),)).fetchall()
+
+	#
+	# Iterate over the coincs in blocks, assigning likelihood ratios.
+	#
+
+	if verbose:
+		progressbar = ProgressBar("computing likelihood ratios", max = len(coincs))
+	else:
+		progressbar = None
+
+	for start in xrange(0, len(coincs), blocksize):
+		block = coincs[start : start + blocksize]
+		params_seq = [likelihood_params_func([event for event in events_func(cursor, coinc_event_id) if veto_func(event, vetoseglists)], offset_vectors[time_slide_id], *params_func_extra_args) for coinc_event_id, time_slide_id in block]
+		ln_likelihood_ratios = ln_likelihood_ratio_array_func(params_seq)
+		cursor.executemany("""
+UPDATE
+	coinc_event
+SET
+	likelihood = ?
+WHERE
+	coinc_event_id == ?
+		""", ((float(ln_likelihood_ratio) if params is not None else None, coinc_event_id) for (coinc_event_id, time_slide_id), params, ln_likelihood_ratio in zip(block, params_seq, ln_likelihood_ratios)))
+		if progressbar is not None:
+			progressbar.increment(delta = len(block))
+
+	del progressbar
+
+	#
+	# Done
+	#
+
+	connection.commit()
+	cursor.close()
+
+
 def assign_likelihood_ratios_xml(xmldoc, coinc_def_id, offset_vectors, vetoseglists, events_func, veto_func, ln_likelihood_ratio_func, likelihood_params_func, verbose = False, params_func_extra_args = ()):
 	"""
 	Assigns likelihood ratio values to coincidences (XML version).
@@ -167,27 +237,36 @@ def sngl_burst_veto_func(event, vetoseglists):
 	return event.ifo not in vetoseglists or event.peak not in vetoseglists[event.ifo]
 
 
-def ligolw_burca2(database, ln_likelihood_ratio, params_func, verbose = False, params_func_extra_args = ()):
+def ligolw_burca2(database, ln_likelihood_ratio, params_func, verbose = False, params_func_extra_args = (), vectorize = False):
 	"""
 	Assigns likelihood ratio values to excess power coincidences.
 	database is pylal.SnglBurstUtils.CoincDatabase instance, and
-	ln_likelihood_ratio is a LnLikelihoodRatio class instance.
+	ln_likelihood_ratio is a LnLikelihoodRatio class instance.  If
+	vectorize is True the likelihood ratios are computed in blocks
+	using ln_likelihood_ratio.array() (see
+	assign_likelihood_ratios_array()).
 	"""
 	#
 	# Run core function
 	#
 
-	assign_likelihood_ratios(
+	if vectorize:
+		assign_func = assign_likelihood_ratios_array
+		ln_likelihood_ratio_kwargs = {"ln_likelihood_ratio_array_func": ln_likelihood_ratio.array}
+	else:
+		assign_func = assign_likelihood_ratios
+		ln_likelihood_ratio_kwargs = {"ln_likelihood_ratio_func": ln_likelihood_ratio}
+	assign_func(
 		connection = database.connection,
 		coinc_def_id = database.bb_definer_id,
 		offset_vectors = database.time_slide_table.as_dict(),
 		vetoseglists = database.vetoseglists,
 		events_func = lambda cursor, coinc_event_id: sngl_burst_events_func(cursor, coinc_event_id, database.sngl_burst_table.row_from_cols),
 		veto_func = sngl_burst_veto_func,
-		ln_likelihood_ratio_func = ln_likelihood_ratio,
 		likelihood_params_func = params_func,
 		verbose = verbose,
-		params_func_extra_args = params_func_extra_args
+		params_func_extra_args = params_func_extra_args,
+		**ln_likelihood_ratio_kwargs
 	)
 
 	#
@@ -40,6 +40,7 @@ from glue.ligolw.utils import search_summary as ligolw_search_summary
 from glue import offsetvector
 from pylal import git_version
 from pylal import snglcoinc
+from pylal.ligolw_thinca import EThincaCache
 from pylal.xlal import tools as xlaltools
 from pylal.xlal.datatypes.ligotimegps import LIGOTimeGPS
 from pylal.xlal.datatypes import snglinspiraltable
@@ -370,7 +371,53 @@ class InspiralEventList(snglcoinc.EventList):
 		# a subset of the full list)
 		#
 
-		return [event_b for event_b in self[bisect.bisect_left(self, end - self.dt) : bisect.bisect_right(self, end + self.dt)] if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, threshold)]
+		window = self[bisect.bisect_left(self, end - self.dt) : bisect.bisect_right(self, end + self.dt)]
+		self.last_window = len(window)
+		return [event_b for event_b in window if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, threshold)]
+
+
+class ExactMatchInspiralEventList(InspiralEventList):
+	"""
+	A customization of the InspiralEventList class for exact-match
+	coincidence.  In addition to the time-ordered list of events, a
+	secondary index maps each template, as identified by
+	inspiral_template_key(), to a time-ordered list of that
+	template's events.  When the comparison function is one of the
+	exact-match functions only the events from the same template as
+	event_a are considered, any other comparison function is applied
+	to all events in the time window as usual.
+	"""
+	def make_index(self):
+		super(ExactMatchInspiralEventList, self).make_index()
+		# self is in time order, so each template's list is too
+		self.template_index = {}
+		for event in self:
+			self.template_index.setdefault(inspiral_template_key(event), []).append(event)
+
+	def get_coincs(self, event_a, offset_a, light_travel_time, threshold, comparefunc):
+		if comparefunc is not inspiral_coinc_compare_exact and comparefunc is not inspiral_coinc_compare_exact_dt:
+			return super(ExactMatchInspiralEventList, self).get_coincs(event_a, offset_a, light_travel_time, threshold, comparefunc)
+
+		#
+		# the events from event_a's template
+		#
+
+		try:
+			events = self.template_index[inspiral_template_key(event_a)]
+		except KeyError:
+			self.last_window = 0
+			return []
+
+		#
+		# event_a's end time, with time shift applied, and the
+		# subset of the template's events in the time window that
+		# pass coincidence with event_a
+		#
+
+		end = event_a.get_end() + offset_a - self.offset
+		window = events[bisect.bisect_left(events, end - self.dt) : bisect.bisect_right(events, end + self.dt)]
+		self.last_window = len(window)
+		return [event_b for event_b in window if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, threshold)]
 
 
 #
@@ -382,16 +429,21 @@ class InspiralEventList(snglcoinc.EventList):
 #
 
 
-def inspiral_max_dt(events, e_thinca_parameter):
+def inspiral_max_dt(events, e_thinca_parameter, cache = None):
 	"""
 	Given an e-thinca parameter and a list of sngl_inspiral events,
 	return the greatest \Delta t that can separate two events and they
-	still be considered coincident.
+	still be considered coincident.  If cache is not None it is an
+	EThincaCache from which to obtain the events' time errors.
 	"""
+	if cache is None:
+		time_error = lambda event: xlaltools.XLALSnglInspiralTimeError(event, e_thinca_parameter)
+	else:
+		time_error = lambda event: cache.time_error(event, e_thinca_parameter)
 	# for each instrument present in the event list, compute the
 	# largest \Delta t interval for the events from that instrument,
 	# and return the sum of the largest two such \Delta t's.
-	return sum(sorted(max(xlaltools.XLALSnglInspiralTimeError(event, e_thinca_parameter) for event in events if event.ifo == instrument) for instrument in set(event.ifo for event in events))[-2:]) + 2. * lal.REARTH_SI / lal.C_SI
+	return sum(sorted(max(time_error(event) for event in events if event.ifo == instrument) for instrument in set(event.ifo for event in events))[-2:]) + 2. * lal.REARTH_SI / lal.C_SI
 
 
 def inspiral_max_dt_exact(events, e_thinca_parameter):
@@ -413,17 +465,15 @@ def inspiral_coinc_compare(a, offseta, b, offsetb, light_travel_time, e_thinca_p
 	thinca test. Otherwise return True.
         light_travel_time if given in units of seconds.
 	"""
-	if offseta: a.set_end(a.get_end() + offseta)
-	if offsetb: b.set_end(b.get_end() + offsetb)
+	# the offsets are applied to copies of the rows inside the C
+	# code, the rows are not modified
 	try:
 		# FIXME:  should it be "<" or "<="?
-		coincident = xlaltools.XLALCalculateEThincaParameter(a, b) <= e_thinca_parameter
+		coincident = xlaltools.XLALCalculateEThincaParameter(a, b, float(offseta), float(offsetb)) <= e_thinca_parameter
 	except ValueError:
 		# ethinca test failed to converge == events are not
 		# coincident
 		coincident = False
-	if offseta: a.set_end(a.get_end() - offseta)
-	if offsetb: b.set_end(b.get_end() - offsetb)
 	return not coincident
 
 
@@ -453,30 +503,28 @@ def inspiral_coinc_compare_exact_dt(a, offseta, b, offsetb, light_travel_time, d
 	else:
 		return True
 
-def inspiral_compare_masses_spins(a, b):
+def inspiral_template_key(event):
 	"""
-	Returns True if a and b have identical masses and spins. Returns False
-	if a and b have differing masses and spins.
+	Return a tuple of the template parameters of an event:  two events
+	have identical masses and spins if and only if their keys are
+	equal.
 	"""
-	# define mchirp, eta tuple
-	a_masses = (a.mchirp, a.eta)
-	b_masses = (b.mchirp, b.eta)
-	if (a_masses != b_masses):
-		return False
-
 	try:
 		# check for spin columns (from events in sngl_inspiral table)
-		a_spins = (a.spin1x, a.spin1y, a.spin1z, a.spin2x, a.spin2y, a.spin2z)
-		b_spins = (b.spin1x, b.spin1y, b.spin1z, b.spin2x, b.spin2y, b.spin2z)
-	except:
+		spins = (event.spin1x, event.spin1y, event.spin1z, event.spin2x, event.spin2y, event.spin2z)
+	except AttributeError:
 		# use spin correction terms for older templates
-		a_spins = (a.beta, a.chi)
-		b_spins = (b.beta, b.chi)
+		spins = (event.beta, event.chi)
+	return (event.mchirp, event.eta) + spins
+
+
+def inspiral_compare_masses_spins(a, b):
+	"""
+	Returns True if a and b have identical masses and spins. Returns False
+	if a and b have differing masses and spins.
+	"""
+	return inspiral_template_key(a) == inspiral_template_key(b)
 
-	if (a_spins == b_spins):
-		return True
-	else:
-		return False
 
 #
 # =============================================================================
@@ -546,12 +594,58 @@ def ligolw_thinca(
 	likelihood_func = None,
 	likelihood_params_func = None,
 	verbose = False,
-	max_dt_func = None
+	max_dt_func = None,
+	nproc = 1,
+	ethinca_cache = None,
+	EventListType = None,
+	instrumentation_summary = None
 ):
+	"""
+	Search the sngl_inspiral table in xmldoc for coincidences and
+	record them in the coinc tables.  If nproc is greater than 1, the
+	two-instrument coincidences for the time slides are constructed in
+	parallel by that many worker processes.  If ethinca_cache is an
+	EThincaCache, it is used in place of inspiral_coinc_compare() if
+	that is the event_comparefunc, and by inspiral_max_dt() if that is
+	the max_dt_func.  EventListType is the EventList subclass with
+	which to index the triggers.  If it is None, the default,
+	ExactMatchInspiralEventList is used with the exact-match
+	comparison functions and InspiralEventList otherwise.  If
+	instrumentation_summary is not None it is a file object to which a
+	JSON summary of the coincidence engine's instrumentation is written
+	when done (see snglcoinc.Instrumentation).  Instrumentation is
+	turned on for the duration of the call if it is not already on.
+	"""
 	if not max_dt_func:
 		err_msg = "Must supply max_dt_func keyword argument to "
 		err_msg += "ligolw_thinca function."
 		raise ValueError(err_msg)
+	if instrumentation_summary is not None:
+		# run the search with instrumentation turned on, then
+		# write the summary
+		with snglcoinc.enable_instrumentation() as registry:
+			ligolw_thinca(
+				xmldoc, process_id, coinc_definer_row, event_comparefunc, thresholds,
+				ntuple_comparefunc = ntuple_comparefunc,
+				magic_number = magic_number,
+				veto_segments = veto_segments,
+				trigger_program = trigger_program,
+				likelihood_func = likelihood_func,
+				likelihood_params_func = likelihood_params_func,
+				verbose = verbose,
+				max_dt_func = max_dt_func,
+				nproc = nproc,
+				ethinca_cache = ethinca_cache,
+				EventListType = EventListType,
+				instrumentation_summary = None
+			)
+		registry.write_json(instrumentation_summary)
+		return xmldoc
+	if ethinca_cache is not None:
+		if event_comparefunc is inspiral_coinc_compare:
+			event_comparefunc = ethinca_cache.compare
+		if max_dt_func is inspiral_max_dt:
+			max_dt_func = lambda events, e_thinca_parameter: inspiral_max_dt(events, e_thinca_parameter, cache = ethinca_cache)
 	#
 	# prepare the coincidence table interface.
 	#
@@ -580,10 +674,16 @@ def ligolw_thinca(
 	# removing events from the lists that fall in vetoed segments
 	#
 
-	eventlists = snglcoinc.make_eventlists(xmldoc, InspiralEventList, lsctables.SnglInspiralTable.tableName)
+	if EventListType is None:
+		if event_comparefunc in (inspiral_coinc_compare_exact, inspiral_coinc_compare_exact_dt):
+			EventListType = ExactMatchInspiralEventList
+		else:
+			EventListType = InspiralEventList
+	eventlists = snglcoinc.make_eventlists(xmldoc, EventListType, lsctables.SnglInspiralTable.tableName)
 	if veto_segments is not None:
 		for eventlist in eventlists.values():
 			iterutils.inplace_filter((lambda event: event.ifo not in veto_segments or event.get_end() not in veto_segments[event.ifo]), eventlist)
+			eventlist.make_index()
 
 	#
 	# set the \Delta t parameter on all the event lists
@@ -610,10 +710,11 @@ def ligolw_thinca(
 
 	#
 	# retrieve all coincidences, apply the final n-tuple compare func
-	# and record the survivors
+	# and record the survivors.  the graph is not needed afterwards so
+	# the component coincs are discarded as soon as possible
 	#
 
-	for node, coinc in time_slide_graph.get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose):
+	for node, coinc in time_slide_graph.get_coincs(eventlists, event_comparefunc, thresholds, nproc = nproc, stream = True, verbose = verbose):
 		ntuple = tuple(sngl_index[id] for id in coinc)
 		if not ntuple_comparefunc(ntuple, node.offset_vector):
 			coinc_tables.append_coinc(
@@ -629,6 +730,8 @@ def ligolw_thinca(
 	#
 
         del eventlists.offsetvector
+	if verbose and ethinca_cache is not None:
+		print >>sys.stderr, "e-thinca cache:  %d templates, hit ratio %.3g, %d templates using the comparison function" % (len(ethinca_cache), ethinca_cache.hit_ratio, ethinca_cache.fallbacks)
 
 	#
 	# done
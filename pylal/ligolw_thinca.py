@@ -25,13 +25,19 @@
 
 
 import bisect
+import collections
+import itertools
 import math
+import numpy
+import operator
 import sys
+import warnings
 
 
 from glue import iterutils
 from glue.ligolw import ligolw
 from glue.ligolw import lsctables
+from glue.ligolw import utils as ligolw_utils
 from glue.ligolw.utils import search_summary as ligolw_search_summary
 from glue.ligolw.utils import coincs as ligolw_coincs
 from glue import offsetvector
@@ -235,6 +241,155 @@ class InspiralCoincTables(snglcoinc.CoincTables):
 
 		return coinc
 
+	def append_coincs(self, process_id, time_slide_id, coinc_def_id, coincs, effective_snr_factor):
+		"""
+		Bulk version of .append_coinc().  coincs is a sequence of
+		tuples of events, all from the time slide identified by
+		time_slide_id.  The rows added to the coinc_event,
+		coinc_event_map and coinc_inspiral tables are the same as
+		would be added by calling .append_coinc() for each coinc in
+		turn, but the masses, effective SNRs and end times are
+		computed for all the coincs at once, and the instruments
+		that were on at the times of the coincs are found with a
+		single sweep of each instrument's segment list.  The
+		likelihood ratio, if one is being assigned, is still
+		computed one coinc at a time.  Returns a list of the new
+		coinc_event rows, in the order of coincs.
+		"""
+		coincs = [tuple(events) for events in coincs]
+		if not coincs:
+			return []
+
+		#
+		# populate the coinc_event and coinc_event_map tables
+		#
+
+		coinc_rows = snglcoinc.CoincTables.append_coincs(self, process_id, time_slide_id, coinc_def_id, coincs)
+		offsetvector = self.time_slide_index[time_slide_id]
+
+		#
+		# flatten the events into arrays.  owner is the index of the
+		# coinc to which each event belongs, and each coinc's
+		# events are contiguous starting at starts
+		#
+
+		events = [event for coinc in coincs for event in coinc]
+		sizes = numpy.fromiter((len(coinc) for coinc in coincs), dtype = "intp", count = len(coincs))
+		starts = sizes.cumsum() - sizes
+		owner = numpy.repeat(numpy.arange(len(coincs)), sizes)
+		def column(func, dtype = "double"):
+			return numpy.fromiter((func(event) for event in events), dtype = dtype, count = len(events))
+
+		#
+		# each instrument is assigned a bit so that sets of
+		# instruments can be manipulated as integers
+		#
+
+		instruments = sorted(set(event.ifo for event in events) | set(self.seglists))
+		bits = dict((instrument, 1 << n) for n, instrument in enumerate(instruments))
+		ifo_bits = column(lambda event: bits[event.ifo], dtype = "int64")
+
+		#
+		# - mass is average of total masses
+		# - mchirp is average of mchirps
+		# - snr is root-sum-square of effective SNRs, or None if
+		#   any event is missing a \chi^{2} value
+		#
+
+		mass = (numpy.bincount(owner, weights = column(lambda event: event.mass1 + event.mass2), minlength = len(coincs)) / sizes).tolist()
+		mchirp = (numpy.bincount(owner, weights = column(operator.attrgetter("mchirp")), minlength = len(coincs)) / sizes).tolist()
+		snr = column(operator.attrgetter("snr"))
+		chisq = column(operator.attrgetter("chisq"))
+		chisq_dof = column(operator.attrgetter("chisq_dof"))
+		with numpy.errstate(divide = "ignore", invalid = "ignore"):
+			effective_snr = snr / (1 + snr**2 / effective_snr_factor)**0.25 / (chisq / (2 * chisq_dof - 2))**0.25
+			effective_snr[chisq == 0] = 0.
+		have_chisq = (numpy.bincount(owner, weights = (chisq == 0), minlength = len(coincs)) == 0).tolist()
+		network_snr = numpy.sqrt(numpy.bincount(owner, weights = effective_snr**2, minlength = len(coincs))).tolist()
+
+		#
+		# end time is the end time of the first trigger in
+		# alphabetical order by instrument, time-shifted according
+		# to the coinc's offset vector (see
+		# coinc_inspiral_end_time()).  computed in integer
+		# nanoseconds
+		#
+
+		offset_ns = dict((instrument, LIGOTimeGPS(offset).ns()) for instrument, offset in offsetvector.items())
+		first = numpy.lexsort((ifo_bits, owner))[starts]
+		end_ns = column(lambda event: event.end_time * 1000000000 + event.end_time_ns + offset_ns[event.ifo], dtype = "int64")[first]
+
+		#
+		# the instruments that were on at the time of each coinc.
+		# the start time of the coinc must be unslid to compare with
+		# the instrument segment lists.  the segments are half-open
+		# so a time is in a segment list if an odd number of
+		# boundaries are at or before it
+		#
+
+		ifos_mask = numpy.bitwise_or.reduceat(ifo_bits, starts)
+		instruments_mask = ifos_mask.copy()
+		for instrument, segs in self.seglists.items():
+			on = _segmentlist_ns(segs).searchsorted(end_ns - offset_ns[instrument], side = "right") & 1
+			instruments_mask[on.astype("bool")] |= bits[instrument]
+		instrument_sets = {}
+		def instrument_set(mask):
+			try:
+				return instrument_sets[mask]
+			except KeyError:
+				return instrument_sets.setdefault(mask, frozenset(instrument for instrument in instruments if mask & bits[instrument]))
+
+		#
+		# populate the coinc_inspiral table and finish the
+		# coinc_event rows
+		#
+
+		coinc_inspiral_rows = []
+		for n, (coinc, events, t, ifos, on_instruments) in enumerate(itertools.izip(coinc_rows, coincs, end_ns.tolist(), ifos_mask.tolist(), instruments_mask.tolist())):
+			coinc_inspiral = self.coinc_inspiral_table.RowType()
+			coinc_inspiral.coinc_event_id = coinc.coinc_event_id
+			coinc_inspiral.mass = mass[n]
+			coinc_inspiral.mchirp = mchirp[n]
+			coinc_inspiral.snr = network_snr[n] if have_chisq[n] else None
+			coinc_inspiral.false_alarm_rate = None
+			coinc_inspiral.combined_far = None
+			coinc_inspiral.minimum_duration = None
+			coinc_inspiral.end_time, coinc_inspiral.end_time_ns = divmod(t, 1000000000)
+			coinc_inspiral.instruments = instrument_set(ifos)
+			coinc_inspiral_rows.append(coinc_inspiral)
+
+			coinc.set_instruments(instrument_set(on_instruments))
+
+			if self.likelihood_func is not None:
+				coinc.likelihood = self.likelihood_func(self.likelihood_params_func(events, offsetvector))
+
+			#
+			# save memory by re-using strings
+			#
+
+			coinc.instruments = self.uniquifier.setdefault(coinc.instruments, coinc.instruments)
+			coinc_inspiral.ifos = self.uniquifier.setdefault(coinc_inspiral.ifos, coinc_inspiral.ifos)
+		self.coinc_inspiral_table.extend(coinc_inspiral_rows)
+
+		#
+		# done
+		#
+
+		return coinc_rows
+
+
+def _segmentlist_ns(seglist):
+	"""
+	Return the boundaries of the segments in seglist, which must be
+	coalesced, as a sorted array of integer nanoseconds.  Infinite
+	boundaries are mapped to the extremes of the integer range.
+	"""
+	def ns(t):
+		if isinstance(t, float) and math.isinf(t):
+			return numpy.iinfo("int64").max if t > 0 else numpy.iinfo("int64").min
+		return LIGOTimeGPS(t).ns()
+	return numpy.array([ns(t) for seg in seglist for t in seg], dtype = "int64")
+
 #
 # Custom function to compute the coinc_inspiral.end_time
 #
@@ -275,6 +430,27 @@ class InspiralEventList(snglcoinc.EventList):
 		"""
 		self.sort(lambda a, b: cmp(a.end_time, b.end_time) or cmp(a.end_time_ns, b.end_time_ns))
 
+	def merge(self, events):
+		"""
+		Add events to the list, merging them into end time order
+		without re-sorting the events already in the list.  The
+		result is the same as extending the list and calling
+		.make_index().
+		"""
+		if type(self).make_index.__func__ is not InspiralEventList.make_index.__func__:
+			# subclass maintains an index of its own
+			super(InspiralEventList, self).merge(events)
+			return
+		key = lambda event: (event.end_time, event.end_time_ns)
+		events = sorted(events, key = key)
+		if not events:
+			return
+		# events already in the list that end at or before the
+		# first new event stay where they are.  the sort is stable,
+		# so new events go after old events with the same end time
+		start = bisect.bisect_right(self, events[0].get_end())
+		self[start:] = sorted(self[start:] + events, key = key)
+
 	def set_dt(self, dt):
 		"""
 		If an event's end time differs by more than this many
@@ -299,7 +475,40 @@ class InspiralEventList(snglcoinc.EventList):
 		# a subset of the full list)
 		#
 
-		return [event_b for event_b in self[bisect.bisect_left(self, end - self.dt) : bisect.bisect_right(self, end + self.dt)] if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, e_thinca_parameter)]
+		window = self[bisect.bisect_left(self, end - self.dt) : bisect.bisect_right(self, end + self.dt)]
+		self.last_window = len(window)
+		return [event_b for event_b in window if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, e_thinca_parameter)]
+
+
+class InspiralColumnarEventList(snglcoinc.ColumnarEventList):
+	"""
+	A customization of the ColumnarEventList class for use with the
+	inspiral search.  Candidate pairs are identified with vectorized
+	searches of the end time arrays.  The test masses are recorded in
+	the "mass1" and "mass2" columns for use by the vectorized
+	counterpart of inspiral_coinc_compare_exact().
+	"""
+	@staticmethod
+	def event_time_ns(event):
+		return event.end_time * 1000000000 + event.end_time_ns
+
+	def event_columns(self, events = None):
+		if events is None:
+			events = self
+		return {
+			"mass1": numpy.fromiter((event.mass1 for event in events), dtype = "double", count = len(events)),
+			"mass2": numpy.fromiter((event.mass2 for event in events), dtype = "double", count = len(events))
+		}
+
+	def set_dt(self, dt):
+		"""
+		If an event's end time differs by more than this many
+		seconds from the end time of another event then it is
+		*impossible* for them to be coincident.
+		"""
+		# add 1% for safety, and round to integer nanoseconds the
+		# same way InspiralEventList does
+		self.dt = LIGOTimeGPS(dt * 1.01).ns()
 
 
 #
@@ -311,16 +520,21 @@ class InspiralEventList(snglcoinc.EventList):
 #
 
 
-def inspiral_max_dt(events, e_thinca_parameter):
+def inspiral_max_dt(events, e_thinca_parameter, cache = None):
 	"""
 	Given an e-thinca parameter and a list of sngl_inspiral events,
 	return the greatest \Delta t that can separate two events and they
-	still be considered coincident.
+	still be considered coincident.  If cache is not None it is an
+	EThincaCache from which to obtain the events' time errors.
 	"""
+	if cache is None:
+		time_error = lambda event: xlaltools.XLALSnglInspiralTimeError(event, e_thinca_parameter)
+	else:
+		time_error = lambda event: cache.time_error(event, e_thinca_parameter)
 	# for each instrument present in the event list, compute the
 	# largest \Delta t interval for the events from that instrument,
 	# and return the sum of the largest two such \Delta t's.
-	return sum(sorted(max(xlaltools.XLALSnglInspiralTimeError(event, e_thinca_parameter) for event in events if event.ifo == instrument) for instrument in set(event.ifo for event in events))[-2:]) + 2. * lal.REARTH_SI / lal.C_SI
+	return sum(sorted(max(time_error(event) for event in events if event.ifo == instrument) for instrument in set(event.ifo for event in events))[-2:]) + 2. * lal.REARTH_SI / lal.C_SI
 
 
 def inspiral_coinc_compare(a, offseta, b, offsetb, light_travel_time, e_thinca_parameter):
@@ -328,17 +542,15 @@ def inspiral_coinc_compare(a, offseta, b, offsetb, light_travel_time, e_thinca_p
 	Returns False (a & b are coincident) if they pass the ellipsoidal
 	thinca test.
 	"""
-	if offseta: a.set_end(a.get_end() + offseta)
-	if offsetb: b.set_end(b.get_end() + offsetb)
+	# the offsets are applied to copies of the rows inside the C
+	# code, the rows are not modified
 	try:
 		# FIXME:  should it be "<" or "<="?
-		coincident = xlaltools.XLALCalculateEThincaParameter(a, b) <= e_thinca_parameter
+		coincident = xlaltools.XLALCalculateEThincaParameter(a, b, float(offseta), float(offsetb)) <= e_thinca_parameter
 	except ValueError:
 		# ethinca test failed to converge == events are not
 		# coincident
 		coincident = False
-	if offseta: a.set_end(a.get_end() - offseta)
-	if offsetb: b.set_end(b.get_end() - offsetb)
 	return not coincident
 
 
@@ -350,6 +562,264 @@ def inspiral_coinc_compare_exact(a, offseta, b, offsetb, light_travel_time, e_th
 	return (a.mass1 != b.mass1) or (a.mass2 != b.mass2) or inspiral_coinc_compare(a, offseta, b, offsetb, light_travel_time, e_thinca_parameter)
 
 
+def _mass_columns(eventlist, indexes):
+	"""
+	Return the (mass1, mass2) arrays for the events in a
+	ColumnarEventList at the given indexes, from the list's columns if
+	it records them.  For internal use only.
+	"""
+	try:
+		return eventlist.columns["mass1"][indexes], eventlist.columns["mass2"][indexes]
+	except KeyError:
+		events = [eventlist[i] for i in indexes.tolist()]
+		return numpy.array([event.mass1 for event in events], dtype = "double"), numpy.array([event.mass2 for event in events], dtype = "double")
+
+
+def inspiral_coinc_compare_exact_array(eventlist_a, eventlist_b, ia, ib, light_travel_time, e_thinca_parameter, comparefunc = inspiral_coinc_compare):
+	"""
+	Vectorized counterpart of inspiral_coinc_compare_exact() for use
+	with ColumnarEventList (see snglcoinc.ArrayComparefunc).  The test
+	mass comparison is done for all candidate pairs at once, and
+	comparefunc, the e-thinca test, is then applied to the pairs of
+	events with equal test masses one pair at a time.
+	"""
+	mass1_a, mass2_a = _mass_columns(eventlist_a, ia)
+	mass1_b, mass2_b = _mass_columns(eventlist_b, ib)
+	coincident = (mass1_a == mass1_b) & (mass2_a == mass2_b)
+	survivors, = coincident.nonzero()
+	coincident[survivors] = eventlist_b.compare_candidates(eventlist_a, ia[survivors], ib[survivors], light_travel_time, e_thinca_parameter, comparefunc)
+	return coincident
+
+
+inspiral_coinc_compare_exact.compare_array = inspiral_coinc_compare_exact_array
+
+
+def _e_thinca(linv_a, cov_b, r, light_travel_time, threshold = None):
+	"""
+	Return the e-thinca parameter of two triggers:  the smallest e for
+	which the ellipsoids x^T Gamma x <= e around the two triggers'
+	(end time, tau0, tau3) positions overlap when the second trigger's
+	end time is allowed to be shifted by up to the light travel time.
+	linv_a is the inverse of the Cholesky factor of the first
+	trigger's covariance matrix (the inverse of its metric), cov_b is
+	the second trigger's covariance matrix, and r is the difference
+	between the triggers' positions.  If threshold is not None the
+	search stops as soon as the e-thinca parameter is known to be
+	above or below it, and the value returned is on the same side of
+	threshold as the e-thinca parameter.  For internal use only.
+
+	The e-thinca parameter is the maximum over 0 <= s <= 1 of the
+	Perram-Wertheim contact function
+
+	F(s) = s (1 - s) r^T [(1 - s) cov_a + s cov_b]^-1 r,
+
+	minimized over the time shift.  It is computed in the basis that
+	diagonalizes both covariance matrices, where the matrix inverse is
+	a sum of three terms.  F(s) minimized over the time shift is
+	concave, so the maximum is found by bisecting on the sign of its
+	derivative, and the tangents at the ends of the bracket bound it
+	from above.
+	"""
+	# cov_a = P P^T and cov_b = P diag(d) P^T with P^-1 = q^T linv_a
+	d, q = numpy.linalg.eigh(numpy.dot(numpy.dot(linv_a, cov_b), linv_a.T))
+	pinv = numpy.dot(q.T, linv_a)
+	# the positions, and the direction of a time shift, in that basis
+	d0, d1, d2 = d.tolist()
+	r0, r1, r2 = numpy.dot(pinv, r).tolist()
+	u0, u1, u2 = pinv[:, 0].tolist()
+
+	def contact(s):
+		# F(s) and its derivative.  the time shift minimizes F at
+		# each s so it does not contribute to the derivative
+		h0, h1, h2 = 1. / (1. - s + s * d0), 1. / (1. - s + s * d1), 1. / (1. - s + s * d2)
+		shift = -(h0 * r0 * u0 + h1 * r1 * u1 + h2 * r2 * u2) / (h0 * u0 * u0 + h1 * u1 * u1 + h2 * u2 * u2)
+		shift = min(max(shift, -light_travel_time), light_travel_time)
+		v0, v1, v2 = (r0 + shift * u0)**2. * h0, (r1 + shift * u1)**2. * h1, (r2 + shift * u2)**2. * h2
+		f = v0 + v1 + v2
+		df = -(v0 * (d0 - 1.) * h0 + v1 * (d1 - 1.) * h1 + v2 * (d2 - 1.) * h2)
+		return s * (1. - s) * f, (1. - 2. * s) * f + s * (1. - s) * df
+
+	lo, (f_lo, df_lo) = 0., contact(0.)
+	hi, (f_hi, df_hi) = 1., contact(1.)
+	if df_lo <= 0. or df_hi >= 0.:
+		# the positions coincide
+		return 0.
+	best = 0.
+	for i in range(100):
+		# the tangents at lo and hi meet above the maximum
+		s = (f_hi - f_lo + df_lo * lo - df_hi * hi) / (df_lo - df_hi)
+		bound = f_lo + df_lo * (s - lo)
+		if threshold is not None and bound <= threshold:
+			break
+		if bound - best <= 1e-9 * bound:
+			break
+		s = (lo + hi) / 2.
+		f, df = contact(s)
+		best = max(best, f)
+		if threshold is not None and f > threshold:
+			break
+		if df > 0.:
+			lo, f_lo, df_lo = s, f, df
+		else:
+			hi, f_hi, df_hi = s, f, df
+	return best
+
+
+class EThincaCache(object):
+	"""
+	A per-template cache of the e-thinca error ellipsoids.  A template
+	bank contains far fewer distinct metrics than there are triggers,
+	so the error ellipsoid of each distinct (Gamma0, ..., Gamma9,
+	e-thinca threshold) combination in (end time, tau0, tau3)
+	co-ordinates is computed once, and the comparisons read it from
+	the cache.  Each entry records the time error bound computed by
+	XLALSnglInspiralTimeError(), the tau0 and tau3 half-widths of the
+	ellipsoid's bounding box, and the ellipsoid's covariance matrix
+	(the inverse of the metric) and the inverse of its Cholesky
+	factor.
+
+	The .compare() and .compare_exact() methods are drop-in
+	replacements for inspiral_coinc_compare() and
+	inspiral_coinc_compare_exact().  Pairs of triggers whose bounding
+	boxes do not overlap (after allowing for the light travel time
+	between the instruments) are rejected, and for the rest the
+	overlap of the ellipsoids is computed from the cached matrices,
+	without calling XLALCalculateEThincaParameter().  The result is
+	the same except for pairs whose e-thinca parameter is within the
+	numerical tolerance of LAL's minimizers of the threshold, and
+	pairs for which LAL's minimizers fail to converge, which LAL
+	reports as not coincident.
+
+	The metric is used only if it is positive definite and reproduces
+	the time error computed by LAL.  Otherwise a warning is emitted,
+	the template is counted in the .fallbacks attribute, and pairs of
+	triggers involving that template are given to the e-thinca
+	comparison function passed to the constructor.
+
+	The .hits, .misses and .hit_ratio attributes count the look-ups
+	made in this process.  When the two-instrument coincidences are
+	constructed by a pool of worker processes (nproc > 1) the
+	comparisons are made in the workers, whose look-ups are not
+	counted.  When ligolw_thinca() computes max_dt with the cache,
+	the entries for all templates are created in the calling process
+	before the workers are started, so the workers do not repeat that
+	work.
+
+	Example:
+
+	>>> cache = EThincaCache()
+	>>> ligolw_thinca(xmldoc, ..., event_comparefunc = inspiral_coinc_compare, ethinca_cache = cache)
+	>>> print cache.hit_ratio
+	"""
+	# the columns identifying a template's metric
+	template_key = staticmethod(operator.attrgetter(*("Gamma%d" % i for i in range(10))))
+
+	def __init__(self, comparefunc = inspiral_coinc_compare):
+		"""
+		comparefunc is the e-thinca comparison function to apply to
+		pairs of triggers whose templates' metrics cannot be used.
+		"""
+		self.comparefunc = comparefunc
+		self.entries = {}
+		self.hits = 0
+		self.misses = 0
+		self.fallbacks = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	@property
+	def hit_ratio(self):
+		"""
+		Fraction of look-ups satisfied from the cache.
+		"""
+		lookups = self.hits + self.misses
+		return float(self.hits) / lookups if lookups else 0.
+
+	def lookup(self, event, e_thinca_parameter):
+		"""
+		Return the cache entry for the event's template at the
+		given e-thinca threshold, a tuple of the bounding box
+		half-widths (dt, dtau0, dtau3), the covariance matrix and
+		the inverse of its Cholesky factor.  All but dt are None if
+		the metric cannot be used.
+		"""
+		key = self.template_key(event), e_thinca_parameter
+		try:
+			entry = self.entries[key]
+		except KeyError:
+			self.misses += 1
+			entry = self.entries[key] = self.make_entry(event, e_thinca_parameter)
+			if entry[3] is None:
+				self.fallbacks += 1
+				warnings.warn("e-thinca cache:  metric %s is not positive definite or does not reproduce the time error computed by LAL, using the comparison function for this template" % repr(key[0][:6]))
+		else:
+			self.hits += 1
+		return entry
+
+	@staticmethod
+	def make_entry(event, e_thinca_parameter):
+		time_error = xlaltools.XLALSnglInspiralTimeError(event, e_thinca_parameter)
+		# the metric in (t, tau0, tau3) co-ordinates.  the
+		# half-widths of the ellipsoid's bounding box are the
+		# square roots of the diagonal of the metric's inverse
+		# scaled by the threshold
+		metric = numpy.array([
+			[event.Gamma0, event.Gamma1, event.Gamma2],
+			[event.Gamma1, event.Gamma3, event.Gamma4],
+			[event.Gamma2, event.Gamma4, event.Gamma5]
+		], dtype = "double")
+		try:
+			covariance = numpy.linalg.inv(metric)
+			linv = numpy.linalg.inv(numpy.linalg.cholesky(covariance))
+		except numpy.linalg.LinAlgError:
+			return time_error, None, None, None, None
+		variances = e_thinca_parameter * numpy.diag(covariance)
+		# only use the metric if it reproduces the time error
+		# computed by LAL
+		if not (numpy.isfinite(linv).all() and abs(math.sqrt(variances[0]) - time_error) <= 1e-8 * time_error):
+			return time_error, None, None, None, None
+		return time_error, math.sqrt(variances[1]), math.sqrt(variances[2]), covariance, linv
+
+	def time_error(self, event, e_thinca_parameter):
+		"""
+		Equivalent to XLALSnglInspiralTimeError(event,
+		e_thinca_parameter).
+		"""
+		return self.lookup(event, e_thinca_parameter)[0]
+
+	def compare(self, a, offseta, b, offsetb, light_travel_time, e_thinca_parameter):
+		"""
+		Equivalent to inspiral_coinc_compare().
+		"""
+		dt_a, dtau0_a, dtau3_a, cov_a, linv_a = self.lookup(a, e_thinca_parameter)
+		dt_b, dtau0_b, dtau3_b, cov_b, linv_b = self.lookup(b, e_thinca_parameter)
+		delta_t = (b.end_time - a.end_time) + 1e-9 * (b.end_time_ns - a.end_time_ns) + float(offsetb) - float(offseta)
+		if abs(delta_t) > dt_a + dt_b + light_travel_time:
+			return True
+		if cov_a is None or cov_b is None:
+			return self.comparefunc(a, offseta, b, offsetb, light_travel_time, e_thinca_parameter)
+		delta_tau0 = b.tau0 - a.tau0
+		delta_tau3 = b.tau3 - a.tau3
+		if abs(delta_tau0) > dtau0_a + dtau0_b or abs(delta_tau3) > dtau3_a + dtau3_b:
+			return True
+		return _e_thinca(linv_a, cov_b, numpy.array((delta_t, delta_tau0, delta_tau3)), light_travel_time, threshold = e_thinca_parameter) > e_thinca_parameter
+
+	def _compare_exact(self, a, offseta, b, offsetb, light_travel_time, e_thinca_parameter):
+		return (a.mass1 != b.mass1) or (a.mass2 != b.mass2) or self.compare(a, offseta, b, offsetb, light_travel_time, e_thinca_parameter)
+
+	def _compare_exact_array(self, eventlist_a, eventlist_b, ia, ib, light_travel_time, e_thinca_parameter):
+		return inspiral_coinc_compare_exact_array(eventlist_a, eventlist_b, ia, ib, light_travel_time, e_thinca_parameter, comparefunc = self.compare)
+
+	@property
+	def compare_exact(self):
+		"""
+		Equivalent to inspiral_coinc_compare_exact(), including its
+		vectorized counterpart.
+		"""
+		return snglcoinc.ArrayComparefunc(self._compare_exact, self._compare_exact_array)
+
+
 #
 # =============================================================================
 #
@@ -406,8 +876,51 @@ def ligolw_thinca(
 	likelihood_func = None,
 	likelihood_params_func = None,
 	verbose = False,
-	max_dt = None
+	max_dt = None,
+	EventListType = InspiralEventList,
+	nproc = 1,
+	ethinca_cache = None,
+	instrumentation_summary = None
 ):
+	"""
+	Search the sngl_inspiral table in xmldoc for coincidences and
+	record them in the coinc tables.  EventListType is the EventList
+	subclass with which to index the triggers, InspiralEventList or
+	InspiralColumnarEventList, the latter trading memory for speed
+	when the trigger lists are long.  The coincidences found do not
+	depend on the choice.  If nproc is greater than 1, the
+	two-instrument coincidences for the time slides are constructed in
+	parallel by that many worker processes.  If ethinca_cache is an
+	EThincaCache, it is used to compute max_dt (if not given) and in
+	place of inspiral_coinc_compare() and inspiral_coinc_compare_exact()
+	if event_comparefunc is one of those.  If instrumentation_summary
+	is not None it is a file object to which a JSON summary of the
+	coincidence engine's instrumentation is written when done (see
+	snglcoinc.Instrumentation).  Instrumentation is turned on for the
+	duration of the call if it is not already on.
+	"""
+	if instrumentation_summary is not None:
+		# run the search with instrumentation turned on, then
+		# write the summary
+		with snglcoinc.enable_instrumentation() as registry:
+			ligolw_thinca(
+				xmldoc, process_id, coinc_definer_row, event_comparefunc, thresholds,
+				ntuple_comparefunc = ntuple_comparefunc,
+				effective_snr_factor = effective_snr_factor,
+				veto_segments = veto_segments,
+				trigger_program = trigger_program,
+				likelihood_func = likelihood_func,
+				likelihood_params_func = likelihood_params_func,
+				verbose = verbose,
+				max_dt = max_dt,
+				EventListType = EventListType,
+				nproc = nproc,
+				ethinca_cache = ethinca_cache,
+				instrumentation_summary = None
+			)
+		registry.write_json(instrumentation_summary)
+		return xmldoc
+
 	#
 	# prepare the coincidence table interface.
 	#
@@ -424,17 +937,23 @@ def ligolw_thinca(
 	# removing events from the lists that fall in vetoed segments
 	#
 
-	eventlists = snglcoinc.make_eventlists(xmldoc, InspiralEventList, lsctables.SnglInspiralTable.tableName)
+	eventlists = snglcoinc.make_eventlists(xmldoc, EventListType, lsctables.SnglInspiralTable.tableName)
 	if veto_segments is not None:
 		for eventlist in eventlists.values():
 			iterutils.inplace_filter((lambda event: event.ifo not in veto_segments or event.get_end() not in veto_segments[event.ifo]), eventlist)
+			eventlist.make_index()
 
 	#
 	# set the \Delta t parameter on all the event lists
 	#
 
+	if ethinca_cache is not None:
+		event_comparefunc = {
+			inspiral_coinc_compare: ethinca_cache.compare,
+			inspiral_coinc_compare_exact: ethinca_cache.compare_exact
+		}.get(event_comparefunc, event_comparefunc)
 	if max_dt is None:
-		max_dt = inspiral_max_dt(lsctables.SnglInspiralTable.get_table(xmldoc), thresholds)
+		max_dt = inspiral_max_dt(lsctables.SnglInspiralTable.get_table(xmldoc), thresholds, cache = ethinca_cache)
 	if verbose:
 		print >>sys.stderr, "event bisection search window will be %.16g s" % max_dt
 	for eventlist in eventlists.values():
@@ -455,19 +974,23 @@ def ligolw_thinca(
 
 	#
 	# retrieve all coincidences, apply the final n-tuple compare func
-	# and record the survivors
+	# and record the survivors.  the graph is not needed afterwards so
+	# the component coincs are discarded as soon as possible.  the
+	# coincs of each offset vector are generated together, and are
+	# recorded together
 	#
 
-	for node, coinc in time_slide_graph.get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose):
-		coinc = tuple(sngl_index[event_id] for event_id in coinc)
-		if not ntuple_comparefunc(coinc, node.offset_vector):
-			coinc_tables.append_coinc(process_id, node.time_slide_id, coinc_def_id, coinc, effective_snr_factor)
+	for node, coincs in itertools.groupby(time_slide_graph.get_coincs(eventlists, event_comparefunc, thresholds, nproc = nproc, stream = True, verbose = verbose), operator.itemgetter(0)):
+		coincs = (tuple(sngl_index[event_id] for event_id in coinc) for node, coinc in coincs)
+		coinc_tables.append_coincs(process_id, node.time_slide_id, coinc_def_id, [coinc for coinc in coincs if not ntuple_comparefunc(coinc, node.offset_vector)], effective_snr_factor)
 
 	#
 	# remove time offsets from events
 	#
 
 	del eventlists.offsetvector
+	if verbose and ethinca_cache is not None:
+		print >>sys.stderr, "e-thinca cache:  %d templates, hit ratio %.3g, %d templates using the comparison function" % (len(ethinca_cache), ethinca_cache.hit_ratio, ethinca_cache.fallbacks)
 
 	#
 	# done
@@ -476,6 +999,197 @@ def ligolw_thinca(
 	return xmldoc
 
 
+class IncrementalThinca(object):
+	"""
+	Incremental version of ligolw_thinca() for use when triggers arrive
+	in time-ordered chunks.  The sorted event lists and the time slide
+	graph are retained between updates.  New events are merged into
+	the event lists, and each update only searches the events that can
+	participate in the coincs it records:  those no earlier than the
+	earliest coinc not yet recorded, all of which are within one
+	horizon (see below) of the end of the data plus the new chunk.  The
+	cost of an update does not grow with the amount of data that has
+	already been processed.
+
+	The coincidence search for a chunk cannot be finalized until the
+	data that might contribute to it have arrived, so coincs are
+	recorded once every event that could participate in them, or in a
+	higher-order coinc containing them, has been seen.  Coincs whose
+	earliest trigger is within one "horizon" of the end of the data
+	are held back until a later update (or the call to .flush()).  The
+	horizon is the largest (unslid) time separation of two triggers
+	that can be coincident:  the event lists' time window plus the
+	largest difference between two offsets in any offset vector.  Once
+	all data have been added and .flush() has been called, the coincs
+	recorded are the same as would be recorded by ligolw_thinca()
+	processing all the triggers at once (but the coincs' IDs and the
+	order of the rows will differ).
+
+	Example:
+
+	>>> thinca = IncrementalThinca(xmldoc, process_id, InspiralCoincDef, inspiral_coinc_compare, e_thinca_parameter, max_dt)
+	>>> for events in chunks:
+	...	thinca.append(events)
+	...
+	>>> thinca.flush()
+
+	NOTE:  the segment lists used to record the instruments that were
+	on at the time of each coinc are read from the document's
+	search_summary table when this object is created.
+	"""
+	def __init__(self, xmldoc, process_id, coinc_definer_row, event_comparefunc, thresholds, max_dt, ntuple_comparefunc = default_ntuple_comparefunc, effective_snr_factor = 250.0, veto_segments = None, trigger_program = u"inspiral", likelihood_func = None, likelihood_params_func = None, EventListType = InspiralEventList, verbose = False):
+		"""
+		The arguments have the same meanings as the arguments of
+		ligolw_thinca(), except that max_dt, the coincidence window
+		for the event lists, must be provided because the triggers
+		are not all known in advance.  Triggers already in the
+		document's sngl_inspiral table are included in the first
+		update.
+		"""
+		self.process_id = process_id
+		self.event_comparefunc = event_comparefunc
+		self.ntuple_comparefunc = ntuple_comparefunc
+		self.effective_snr_factor = effective_snr_factor
+		self.veto_segments = veto_segments
+		self.EventListType = EventListType
+		self.max_dt = max_dt
+		self.verbose = verbose
+
+		self.coinc_tables = InspiralCoincTables(xmldoc, vetoes = veto_segments, program = trigger_program, likelihood_func = likelihood_func, likelihood_params_func = likelihood_params_func)
+		self.coinc_def_id = ligolw_coincs.get_coinc_def_id(xmldoc, coinc_definer_row.search, coinc_definer_row.search_coinc_type, create_new = True, description = coinc_definer_row.description)
+		self.sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(xmldoc)
+		self.time_slide_graph = snglcoinc.TimeSlideGraph(self.coinc_tables.time_slide_index, verbose = verbose)
+
+		# replicate the ethinca parameter for every possible
+		# instrument pair
+		instruments = set(instrument for offset_vector in self.coinc_tables.time_slide_index.values() for instrument in offset_vector)
+		self.thresholds = replicate_threshold(thresholds, instruments)
+
+		# the horizon, in integer nanoseconds
+		self.horizon = LIGOTimeGPS(max_dt * 1.01).ns() + max(LIGOTimeGPS(max(offset_vector.values()) - min(offset_vector.values())).ns() for offset_vector in self.coinc_tables.time_slide_index.values())
+
+		# the event lists and an index of the events in them by
+		# ID.  events are removed when they can no longer
+		# participate in coincs that have not been recorded
+		self.eventlists = snglcoinc.EventListDict(EventListType, ())
+		self.sngl_index = {}
+
+		# all coincs whose earliest event is before this time (in
+		# integer nanoseconds) have been recorded.  None = -inf
+		self.finalized = None
+		# the latest event time seen so far
+		self.latest = None
+
+		# index the triggers already in the document
+		self.add_events(self.sngl_inspiral_table)
+
+	@staticmethod
+	def event_time_ns(event):
+		return event.end_time * 1000000000 + event.end_time_ns
+
+	def add_events(self, events):
+		"""
+		Add events to the event lists.  Vetoed events are
+		discarded.  The events are not added to the document.
+		"""
+		events = [event for event in events if self.veto_segments is None or event.ifo not in self.veto_segments or event.get_end() not in self.veto_segments[event.ifo]]
+		by_instrument = {}
+		for event in events:
+			by_instrument.setdefault(event.ifo, []).append(event)
+			self.sngl_index[event.event_id] = event
+		for instrument, instrument_events in by_instrument.items():
+			if instrument not in self.eventlists:
+				self.eventlists[instrument] = self.EventListType(instrument)
+				self.eventlists[instrument].set_dt(self.max_dt)
+			self.eventlists[instrument].merge(instrument_events)
+		if events:
+			latest = max(self.event_time_ns(event) for event in events)
+			if self.latest is None or latest > self.latest:
+				self.latest = latest
+
+	def append(self, events, boundary = None):
+		"""
+		Append events, an iterable of sngl_inspiral rows, to the
+		document's sngl_inspiral table, and record the coincs that
+		can now be finalized.  boundary is the time up to which the
+		trigger set is complete:  all events that will be added in
+		future updates will have end times at or after it.  If
+		boundary is None, the latest end time seen so far is used,
+		i.e., the chunks are assumed to be time-ordered.  Returns
+		the number of coincs recorded.
+		"""
+		events = list(events)
+		self.sngl_inspiral_table.extend(events)
+		self.add_events(events)
+		if boundary is not None:
+			boundary = LIGOTimeGPS(boundary).ns()
+		elif self.latest is not None:
+			boundary = self.latest
+		else:
+			return 0
+		return self.update(boundary - self.horizon)
+
+	def flush(self):
+		"""
+		Record all remaining coincs.  Call this once all events
+		have been added.  Returns the number of coincs recorded.
+		"""
+		return self.update(None)
+
+	def update(self, finalize):
+		"""
+		Record the coincs whose earliest event is before the time
+		finalize (in integer nanoseconds, or None for all
+		remaining coincs) and that have not yet been recorded, then
+		discard the events that can no longer participate in new
+		coincs.  Returns the number of coincs recorded.
+		"""
+		if finalize is not None and self.finalized is not None and finalize <= self.finalized:
+			return 0
+		if self.verbose:
+			print >>sys.stderr, "searching %d events ..." % sum(len(eventlist) for eventlist in self.eventlists.values())
+
+		# search the events retained in the event lists.  these are
+		# the events no earlier than self.finalized, which are all
+		# the events that can participate in coincs that have not
+		# been recorded:  the events in a coinc are no earlier than
+		# the one that sets its time
+		count = 0
+		self.time_slide_graph.reset()
+		for node, coincs in itertools.groupby(self.time_slide_graph.get_coincs(self.eventlists, self.event_comparefunc, self.thresholds, stream = True, verbose = self.verbose), operator.itemgetter(0)):
+			selected = []
+			for node, coinc in coincs:
+				coinc = tuple(self.sngl_index[event_id] for event_id in coinc)
+				if finalize is not None and min(self.event_time_ns(event) for event in coinc) >= finalize:
+					# cannot be finalized yet
+					continue
+				if not self.ntuple_comparefunc(coinc, node.offset_vector):
+					selected.append(coinc)
+			self.coinc_tables.append_coincs(self.process_id, node.time_slide_id, self.coinc_def_id, selected, self.effective_snr_factor)
+			count += len(selected)
+		del self.eventlists.offsetvector
+		self.finalized = finalize
+
+		# discard events that can no longer participate in coincs
+		# that have not been recorded
+		if finalize is not None:
+			for eventlist in self.eventlists.values():
+				discard = [event for event in eventlist if self.event_time_ns(event) < finalize]
+				if discard:
+					for event in discard:
+						del self.sngl_index[event.event_id]
+					iterutils.inplace_filter(lambda event: self.event_time_ns(event) >= finalize, eventlist)
+					eventlist.make_index()
+		else:
+			for eventlist in self.eventlists.values():
+				del eventlist[:]
+				eventlist.make_index()
+			self.sngl_index.clear()
+		if self.verbose:
+			print >>sys.stderr, "recorded %d coincs" % count
+		return count
+
+
 #
 # =============================================================================
 #
@@ -527,11 +1241,11 @@ class sngl_inspiral_coincs(object):
 	row objects in the original document.  Modifications to the row
 	objects in the tables returned by this class will affect both the
 	original document and all other documents returned by this class.
-	However, each retrieval constructs a new document from scratch,
-	they are not cached nor re-used, therefore this operation can be
-	time consuming if it needs to be performed repeatedly but the table
-	objects and document trees can be edited without affecting each
-	other.
+	By default, each retrieval constructs a new document from
+	scratch, so this operation can be time consuming if it needs to be
+	performed repeatedly but the table objects and document trees can
+	be edited without affecting each other.  See cache_size below for
+	a mode in which the work is shared between retrievals.
 
 	If the source document is modified after this class has been
 	instantiated, the behaviour is undefined.
@@ -539,12 +1253,36 @@ class sngl_inspiral_coincs(object):
 	To assist with memory clean-up, it is helpful to invoke the
 	.unlink() method on the XML trees returned by this class when they
 	are no longer needed.
+
+	If many coincs are to be extracted the cache_size argument can be
+	used to select a faster mode of operation.  In this mode the
+	process, process_params and search_summary tables are assembled
+	once for each set of process IDs, the time_slide table once for
+	each time slide, and the coinc_definer table once, and each
+	document returned receives its own copies of these tables, which
+	share the row objects but not the table elements.  Additionally,
+	the cache_size most recently requested documents are retained and
+	the same document is returned when one of those coincs is
+	requested again, so a document obtained in this mode must not be
+	modified or unlinked while it might be requested again.  With
+	cache_size = 0 the metadata tables are reused but no documents are
+	retained.  The cached metadata tables are not evicted:  there is
+	one set for each time slide and for each distinct set of process
+	IDs in the source document, holding references to rows the source
+	document holds anyway, so their number is bounded by the size of
+	the source document.  To write many coincs to disk, use
+	.write_coincs().
 	"""
-	def __init__(self, xmldoc):
+	def __init__(self, xmldoc, cache_size = None):
 		"""
 		Initialize an instance of the class.  xmldoc is the source
 		XML document tree from which the
 		sngl_inspiral<-->sngl_inspiral coincs will be extracted.
+		If cache_size is None (the default) a new document is
+		constructed from scratch for each request, otherwise the
+		metadata tables are shared between the documents and the
+		cache_size most recently requested documents are retained
+		(see above).
 		"""
 		#
 		# find all tables
@@ -590,6 +1328,24 @@ class sngl_inspiral_coincs(object):
 			except KeyError:
 				continue
 
+		#
+		# the metadata tables, indexed by set of process IDs, by
+		# time slide ID, and the coinc_definer table, from which
+		# the tables in each document are copied, and the cache of
+		# recently-requested documents.  these tables are never
+		# inserted into a document themselves.  the metadata
+		# caches are not bounded, but can have no more entries than
+		# there are time slides and combinations of processes in
+		# the source document
+		#
+
+		self.cache_size = cache_size
+		if cache_size is not None:
+			self.metadata_cache = {}
+			self.time_slide_cache = {}
+			self.coinc_def_template = self._new_coinc_def_table()
+			self.document_cache = collections.OrderedDict()
+
 	@property
 	def coinc_def_id(self):
 		"""
@@ -611,38 +1367,15 @@ class sngl_inspiral_coincs(object):
 		"""
 		return offsetvector.offsetvector((row.instrument, row.offset) for row in self.time_slide_index[time_slide_id])
 
-	def __getitem__(self, coinc_event_id):
-		"""
-		Construct and return an XML document containing the
-		sngl_inspiral<-->sngl_inspiral coinc carrying the given
-		coinc_event_id.
-		"""
-		newxmldoc = ligolw.Document()
-		newxmldoc.appendChild(ligolw.LIGO_LW())
-
-		# when making these, we can't use table.new_from_template()
-		# because we need to ensure we have a Table subclass, not a
-		# DBTable subclass
-		new_process_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.ProcessTable, self.process_table.columnnames))
-		new_process_params_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.ProcessParamsTable, self.process_params_table.columnnames))
-		new_search_summary_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SearchSummaryTable, self.search_summary_table.columnnames))
-		new_sngl_inspiral_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.SnglInspiralTable, self.sngl_inspiral_table.columnnames))
-		new_coinc_def_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincDefTable, self.coinc_def_table.columnnames))
-		new_coinc_event_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincTable, self.coinc_event_table.columnnames))
-		new_coinc_inspiral_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincInspiralTable, self.coinc_inspiral_table.columnnames))
-		new_coinc_event_map_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.CoincMapTable, self.coinc_event_map_table.columnnames))
-		new_time_slide_table = newxmldoc.childNodes[-1].appendChild(lsctables.New(lsctables.TimeSlideTable, self.time_slide_table.columnnames))
-
-		new_coinc_def_table.append(self.coinc_def)
-		coinc_event = self.coinc_event_index[coinc_event_id]
-		new_coinc_event_table.append(coinc_event)
-		new_coinc_inspiral_table.append(self.coinc_inspiral_index[coinc_event_id])
-		map(new_coinc_event_map_table.append, self.coinc_event_map_index[coinc_event_id])
-		map(new_time_slide_table.append, self.time_slide_index[coinc_event.time_slide_id])
-		for row in new_coinc_event_map_table:
-			new_sngl_inspiral_table.append(self.sngl_inspiral_index[row.event_id])
+	# when making tables, we can't use table.new_from_template()
+	# because we need to ensure we have a Table subclass, not a DBTable
+	# subclass
 
-		for process_id in set(new_sngl_inspiral_table.getColumnByName("process_id")) | set(new_coinc_event_table.getColumnByName("process_id")) | set(new_time_slide_table.getColumnByName("process_id")):
+	def _new_metadata_tables(self, process_ids):
+		new_process_table = lsctables.New(lsctables.ProcessTable, self.process_table.columnnames)
+		new_process_params_table = lsctables.New(lsctables.ProcessParamsTable, self.process_params_table.columnnames)
+		new_search_summary_table = lsctables.New(lsctables.SearchSummaryTable, self.search_summary_table.columnnames)
+		for process_id in process_ids:
 			# process row is required
 			new_process_table.append(self.process_index[process_id])
 			try:
@@ -655,9 +1388,124 @@ class sngl_inspiral_coincs(object):
 			except KeyError:
 				# search_summary rows are optional
 				pass
+		return new_process_table, new_process_params_table, new_search_summary_table
+
+	def _new_time_slide_table(self, time_slide_id):
+		new_time_slide_table = lsctables.New(lsctables.TimeSlideTable, self.time_slide_table.columnnames)
+		map(new_time_slide_table.append, self.time_slide_index[time_slide_id])
+		return new_time_slide_table
+
+	def _new_coinc_def_table(self):
+		new_coinc_def_table = lsctables.New(lsctables.CoincDefTable, self.coinc_def_table.columnnames)
+		new_coinc_def_table.append(self.coinc_def)
+		return new_coinc_def_table
+
+	@staticmethod
+	def _copy_table(table):
+		"""
+		Return a new table element with the same columns as table
+		containing references to the same row objects.
+		"""
+		new = table.copy()
+		new.extend(table)
+		return new
+
+	def _cached(self, cache, key, func, *args):
+		"""
+		Retrieve the table(s) for key from cache, constructing them
+		with func(*args) if needed.
+		"""
+		try:
+			return cache[key]
+		except KeyError:
+			tables = cache[key] = func(*args)
+			return tables
+
+	def new_document(self, coinc_event_id):
+		"""
+		Construct and return a new XML document containing the
+		sngl_inspiral<-->sngl_inspiral coinc carrying the given
+		coinc_event_id.  If the class was initialized with a
+		cache_size, the metadata tables in the document are copied
+		from the cached ones and the document is not added to the
+		cache.
+		"""
+		coinc_event = self.coinc_event_index[coinc_event_id]
+		coinc_event_map_rows = self.coinc_event_map_index[coinc_event_id]
+		sngl_inspiral_rows = [self.sngl_inspiral_index[row.event_id] for row in coinc_event_map_rows]
+		time_slide_rows = self.time_slide_index[coinc_event.time_slide_id]
+		process_ids = set(row.process_id for row in sngl_inspiral_rows) | set([coinc_event.process_id]) | set(row.process_id for row in time_slide_rows)
+
+		if self.cache_size is None:
+			new_process_table, new_process_params_table, new_search_summary_table = self._new_metadata_tables(process_ids)
+			new_time_slide_table = self._new_time_slide_table(coinc_event.time_slide_id)
+			new_coinc_def_table = self._new_coinc_def_table()
+		else:
+			process_ids = frozenset(process_ids)
+			new_process_table, new_process_params_table, new_search_summary_table = map(self._copy_table, self._cached(self.metadata_cache, process_ids, self._new_metadata_tables, process_ids))
+			new_time_slide_table = self._copy_table(self._cached(self.time_slide_cache, coinc_event.time_slide_id, self._new_time_slide_table, coinc_event.time_slide_id))
+			new_coinc_def_table = self._copy_table(self.coinc_def_template)
+
+		new_sngl_inspiral_table = lsctables.New(lsctables.SnglInspiralTable, self.sngl_inspiral_table.columnnames)
+		new_coinc_event_table = lsctables.New(lsctables.CoincTable, self.coinc_event_table.columnnames)
+		new_coinc_inspiral_table = lsctables.New(lsctables.CoincInspiralTable, self.coinc_inspiral_table.columnnames)
+		new_coinc_event_map_table = lsctables.New(lsctables.CoincMapTable, self.coinc_event_map_table.columnnames)
+		new_sngl_inspiral_table.extend(sngl_inspiral_rows)
+		new_coinc_event_table.append(coinc_event)
+		new_coinc_inspiral_table.append(self.coinc_inspiral_index[coinc_event_id])
+		new_coinc_event_map_table.extend(coinc_event_map_rows)
+
+		newxmldoc = ligolw.Document()
+		newxmldoc.appendChild(ligolw.LIGO_LW())
+		for table in (new_process_table, new_process_params_table, new_search_summary_table, new_sngl_inspiral_table, new_coinc_def_table, new_coinc_event_table, new_coinc_inspiral_table, new_coinc_event_map_table, new_time_slide_table):
+			newxmldoc.childNodes[-1].appendChild(table)
 
 		return newxmldoc
 
+	def __getitem__(self, coinc_event_id):
+		"""
+		Construct and return an XML document containing the
+		sngl_inspiral<-->sngl_inspiral coinc carrying the given
+		coinc_event_id, or, if the class was initialized with a
+		cache_size, retrieve it from the cache of recently
+		requested documents.
+		"""
+		if self.cache_size is None:
+			return self.new_document(coinc_event_id)
+		try:
+			newxmldoc = self.document_cache.pop(coinc_event_id)
+		except KeyError:
+			newxmldoc = self.new_document(coinc_event_id)
+			while self.document_cache and len(self.document_cache) >= self.cache_size:
+				self.document_cache.popitem(last = False)
+		if self.cache_size > 0:
+			# (re-)insert as most recently used
+			self.document_cache[coinc_event_id] = newxmldoc
+		return newxmldoc
+
+	def write_coincs(self, filename_func, coinc_event_ids = None, gz = False, verbose = False):
+		"""
+		Write each of the coincs given by coinc_event_ids, or all of
+		the coincs if coinc_event_ids is None, to a file of its own
+		named filename_func(coinc_event_id).  Each document is
+		constructed, written, and unlinked in turn, bypassing the
+		cache of recently requested documents, so the memory
+		required does not depend on the number of coincs.  The
+		files are written before this method returns.  The return
+		value is a list of (coinc_event_id, filename) tuples, one
+		for each file written.
+		"""
+		if coinc_event_ids is None:
+			coinc_event_ids = self.keys()
+		written = []
+		for coinc_event_id in coinc_event_ids:
+			newxmldoc = self.new_document(coinc_event_id)
+			filename = filename_func(coinc_event_id)
+			ligolw_utils.write_filename(newxmldoc, filename, gz = gz, verbose = verbose)
+			newxmldoc.unlink()
+			written.append((coinc_event_id, filename))
+		return written
+
 	def __iter__(self):
 		"""
 		Iterate over the coinc_event_id's in the source document.
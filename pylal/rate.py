@@ -36,6 +36,7 @@ smoothing contour plots.
 
 
 from bisect import bisect_right
+import collections
 try:
 	from fpconst import PosInf, NegInf
 except ImportError:
@@ -44,21 +45,11 @@ except ImportError:
 	PosInf = float("+inf")
 	NegInf = float("-inf")
 import itertools
+import json
 import math
 import numpy
 import random
-import scipy
-numpyver = numpy.__version__.strip().split(".")[:3]
-scipyver = scipy.__version__.strip().split(".")[:3]
-__numpy__version__ = tuple(map(int, numpyver))
-__scipy__version__ = tuple(map(int, scipyver))
-if __scipy__version__ >= (0, 9) and __numpy__version__ >= (1, 7):
-	from scipy.interpolate import interp1d, interp2d, LinearNDInterpolator
-else:
-	# pre scipy/numpy 0.9/1.7 had busted/missing interpolation code.
-	# replacements are provided below
-	pass
-from scipy.signal import signaltools
+import struct
 
 
 from glue import iterutils
@@ -134,7 +125,10 @@ class Bins(object):
 		the index of the bin in which the slice's lower bound
 		falls, and whose upper bound is 1 greater than the index of
 		the bin in which the slice's upper bound falls.  Steps are
-		not supported in slices.
+		not supported in slices.  If a numpy array of co-ordinates
+		is given, an array of the same shape containing the bin
+		indexes is returned;  if any of the co-ordinates has no bin
+		IndexError is raised.
 		"""
 		if isinstance(x, slice):
 			if x.step is not None:
@@ -278,6 +272,8 @@ class IrregularBins(Bins):
 	2
 	>>> x[4:17]
 	slice(0, 3, None)
+	>>> x[numpy.array([1, 13, 15, numpy.inf])]
+	array([0, 1, 2, 2])
 	>>> IrregularBins([0.0, 15.0, 11.0])
 	Traceback (most recent call last):
 		...
@@ -317,6 +313,15 @@ class IrregularBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(IrregularBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			with numpy.errstate(invalid = "ignore"):
+				inrange = (self.min <= x) & (x <= self.max)
+			if not inrange.all():
+				raise IndexError(x[~inrange][0])
+			indexes = numpy.searchsorted(self.boundaries, x, side = "right") - 1
+			# special measure-zero edge case
+			indexes[x == self.max] = len(self.boundaries) - 2
+			return indexes
 		if self.min <= x < self.max:
 			return bisect_right(self.boundaries, x) - 1
 		# special measure-zero edge case
@@ -357,6 +362,12 @@ class LinearBins(Bins):
 	1
 	>>> x[25]
 	2
+	>>> x[numpy.array([1, 10, 25])]
+	array([0, 1, 2])
+	>>> x[numpy.array([10, 26])]
+	Traceback (most recent call last):
+		...
+	IndexError: 26
 	>>> x[0:27]
 	Traceback (most recent call last):
 		...
@@ -379,6 +390,15 @@ class LinearBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(LinearBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			with numpy.errstate(invalid = "ignore"):
+				inrange = (self.min <= x) & (x <= self.max)
+			if not inrange.all():
+				raise IndexError(x[~inrange][0])
+			indexes = numpy.floor((x - self.min) / self.delta).astype("int")
+			# special "measure zero" corner case
+			indexes[x == self.max] = len(self) - 1
+			return indexes
 		if self.min <= x < self.max:
 			return int(math.floor((x - self.min) / self.delta))
 		if x == self.max:
@@ -429,6 +449,8 @@ class LinearPlusOverflowBins(Bins):
 	4
 	>>> x[float("+inf")]
 	4
+	>>> x[numpy.array([-numpy.inf, 1, 10, 25, 100])]
+	array([0, 1, 2, 4, 4])
 	>>> x[float("-inf"):9]
 	slice(0, 3, None)
 	>>> x[9:float("+inf")]
@@ -443,6 +465,16 @@ class LinearPlusOverflowBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(LinearPlusOverflowBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			isnan = numpy.isnan(x)
+			if isnan.any():
+				raise IndexError(x[isnan][0])
+			with numpy.errstate(invalid = "ignore"):
+				indexes = numpy.floor((x - self.min) / self.delta).astype("int") + 1
+			# infinity overflow bins
+			indexes[x >= self.max] = len(self) - 1
+			indexes[x < self.min] = 0
+			return indexes
 		if self.min <= x < self.max:
 			return int(math.floor((x - self.min) / self.delta)) + 1
 		if x >= self.max:
@@ -479,6 +511,8 @@ class LogarithmicBins(Bins):
 	1
 	>>> x[25]
 	2
+	>>> x[numpy.array([1, 5, 25])]
+	array([0, 1, 2])
 	"""
 	def __init__(self, min, max, n):
 		super(LogarithmicBins, self).__init__(min, max, n)
@@ -487,6 +521,15 @@ class LogarithmicBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(LogarithmicBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			with numpy.errstate(invalid = "ignore"):
+				inrange = (self.min <= x) & (x <= self.max)
+			if not inrange.all():
+				raise IndexError(x[~inrange][0])
+			indexes = numpy.floor((numpy.log(x) - math.log(self.min)) / self.delta).astype("int")
+			# special "measure zero" corner case
+			indexes[x == self.max] = len(self) - 1
+			return indexes
 		if self.min <= x < self.max:
 			return int(math.floor((math.log(x) - math.log(self.min)) / self.delta))
 		if x == self.max:
@@ -529,6 +572,8 @@ class LogarithmicPlusOverflowBins(Bins):
 	4
 	>>> x[100]
 	4
+	>>> x[numpy.array([0, 1, 5, 24.999, 25, 100])]
+	array([0, 1, 2, 3, 4, 4])
 	>>> x.lower()
 	array([  0.        ,   1.        ,   2.92401774,   8.54987973,  25.        ])
 	>>> x.upper()
@@ -545,6 +590,17 @@ class LogarithmicPlusOverflowBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(LogarithmicPlusOverflowBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			isnan = numpy.isnan(x)
+			if isnan.any():
+				raise IndexError(x[isnan][0])
+			inrange = (self.min <= x) & (x < self.max)
+			indexes = numpy.zeros(x.shape, dtype = "int")
+			indexes[inrange] = 1 + numpy.floor((numpy.log(x[inrange]) - math.log(self.min)) / self.delta).astype("int")
+			# infinity overflow bin.  the zero overflow bin is
+			# already set
+			indexes[x >= self.max] = len(self) - 1
+			return indexes
 		if self.min <= x < self.max:
 			return 1 + int(math.floor((math.log(x) - math.log(self.min)) / self.delta))
 		if x >= self.max:
@@ -584,6 +640,8 @@ class ATanBins(Bins):
 	5
 	>>> x[float("+inf")]
 	10
+	>>> x[numpy.array([-numpy.inf, 0, numpy.inf])]
+	array([ 0,  5, 10])
 	>>> x.centres()
 	array([-4.42778777, -1.39400285, -0.73469838, -0.40913068, -0.18692843,
 	        0.        ,  0.18692843,  0.40913068,  0.73469838,  1.39400285,
@@ -598,6 +656,17 @@ class ATanBins(Bins):
 	def __getitem__(self, x):
 		if isinstance(x, slice):
 			return super(ATanBins, self).__getitem__(x)
+		if isinstance(x, numpy.ndarray):
+			isnan = numpy.isnan(x)
+			if isnan.any():
+				raise IndexError(x[isnan][0])
+			# map to the domain [0, 1]
+			x = numpy.arctan((x - self.mid) * self.scale) / math.pi + 0.5
+			inside = x < 1.
+			# x == 1, special "measure zero" corner case
+			return numpy.where(inside, numpy.floor(numpy.where(inside, x, 0.) / self.delta), len(self) - 1).astype("int")
+		if math.isnan(x):
+			raise IndexError(x)
 		# map to the domain [0, 1]
 		x = math.atan(float(x - self.mid) * self.scale) / math.pi + 0.5
 		if x < 1.:
@@ -719,6 +788,8 @@ class Categories(Bins):
 	Traceback (most recent call last):
 		...
 	IndexError: -1
+	>>> categories[numpy.array([2, 4, 6])]
+	array([0, 1, 0])
 
 	This last example demonstrates the behaviour when the intersection
 	of the categorys is not the empty set.
@@ -742,8 +813,12 @@ class Categories(Bins):
 		"""
 		Return i if value is contained in i-th container. If value
 		is not contained in any of the containers, raise an
-		IndexError.
+		IndexError.  If value is a numpy array, each of its
+		elements is mapped in turn and an array of indexes is
+		returned.
 		"""
+		if isinstance(value, numpy.ndarray):
+			return numpy.array([self[v] for v in value.flat], dtype = "int").reshape(value.shape)
 		for i, s in enumerate(self.containers):
 			if value in s:
 				return i
@@ -817,12 +892,17 @@ class NDBins(tuple):
 		co-ordinate can be anything the corresponding Bins instance
 		will accept.  Note that the co-ordinates to be converted
 		must be a tuple, even if it is only a 1-dimensional
-		co-ordinate.
+		co-ordinate.  In particular, the co-ordinates can be numpy
+		arrays, in which case the result is a tuple of index arrays
+		suitable for indexing a numpy array.
+
+		>>> x[numpy.array([1, 10]), numpy.array([1, 5])]
+		(array([0, 1]), array([0, 1]))
 		"""
 		if isinstance(coords, tuple):
 			if len(coords) != len(self):
 				raise ValueError("dimension mismatch")
-			return tuple(map(lambda b, c: b[c], self, coords))
+			return tuple(b[c] for b, c in zip(self, coords))
 		else:
 			return tuple.__getitem__(self, coords)
 
@@ -922,31 +1002,66 @@ class NDBins(tuple):
 			"n": "int_4u"
 		}
 
+	#
+	# mapping between the serializable Bins classes and the names used
+	# for them in the XML and binary representations
+	#
+
+	@staticmethod
+	def _type_names():
+		return {
+			LinearBins: "lin",
+			LinearPlusOverflowBins: "linplusoverflow",
+			LogarithmicBins: "log",
+			ATanBins: "atan",
+			ATanLogarithmicBins: "atanlog",
+			LogarithmicPlusOverflowBins: "logplusoverflow"
+		}
+
+	def descriptions(self):
+		"""
+		Return a list of (type name, min, max, n) tuples, one for
+		each dimension, from which the binning can be reconstructed
+		with .from_descriptions().  TypeError is raised if any of
+		the Bins instances is of a type that cannot be serialized
+		(e.g., IrregularBins or Categories).
+		"""
+		type_names = self._type_names()
+		descriptions = []
+		for binning in self:
+			try:
+				type_name = type_names[type(binning)]
+			except KeyError:
+				raise TypeError("cannot serialize %s" % repr(binning))
+			if isinstance(binning, ATanLogarithmicBins):
+				descriptions.append((type_name, binning._real_min, binning._real_max, binning._real_n))
+			else:
+				descriptions.append((type_name, binning.min, binning.max, len(binning)))
+		return descriptions
+
+	@classmethod
+	def from_descriptions(cls, descriptions):
+		"""
+		Construct and return an NDBins object from a sequence of
+		(type name, min, max, n) tuples as returned by
+		.descriptions().
+		"""
+		classes = dict((type_name, bins_class) for bins_class, type_name in cls._type_names().items())
+		return cls(classes[type_name](min, max, int(n)) for type_name, min, max, n in descriptions)
+
 	def to_xml(self):
 		"""
 		Construct a LIGO Light Weight XML table representation of the
 		NDBins instance.
 		"""
 		xml = lsctables.New(self.BinsTable)
-		for order, binning in enumerate(self):
+		for order, (type_name, min, max, n) in enumerate(self.descriptions()):
 			row = xml.RowType()
 			row.order = order
-			row.type = {
-				LinearBins: "lin",
-				LinearPlusOverflowBins: "linplusoverflow",
-				LogarithmicBins: "log",
-				ATanBins: "atan",
-				ATanLogarithmicBins: "atanlog",
-				LogarithmicPlusOverflowBins: "logplusoverflow"
-			}[type(binning)]
-			if isinstance(binning, ATanLogarithmicBins):
-				row.min = binning._real_min
-				row.max = binning._real_max
-				row.n = binning._real_n
-			else:
-				row.min = binning.min
-				row.max = binning.max
-				row.n = len(binning)
+			row.type = type_name
+			row.min = min
+			row.max = max
+			row.n = n
 			xml.append(row)
 		return xml
 
@@ -958,21 +1073,14 @@ class NDBins(tuple):
 		from it.
 		"""
 		xml = cls.BinsTable.get_table(xml)
-		binnings = [None] * (len(xml) and (max(xml.getColumnByName("order")) + 1))
+		descriptions = [None] * (len(xml) and (max(xml.getColumnByName("order")) + 1))
 		for row in xml:
-			if binnings[row.order] is not None:
+			if descriptions[row.order] is not None:
 				raise ValueError("duplicate binning for dimension %d" % row.order)
-			binnings[row.order] = {
-				"lin": LinearBins,
-				"linplusoverflow": LinearPlusOverflowBins,
-				"log": LogarithmicBins,
-				"atan": ATanBins,
-				"atanlog": ATanLogarithmicBins,
-				"logplusoverflow": LogarithmicPlusOverflowBins
-			}[row.type](row.min, row.max, row.n)
-		if None in binnings:
-			raise ValueError("no binning for dimension %d" % binnings.find(None))
-		return cls(binnings)
+			descriptions[row.order] = (row.type, row.min, row.max, row.n)
+		if None in descriptions:
+			raise ValueError("no binning for dimension %d" % descriptions.index(None))
+		return cls.from_descriptions(descriptions)
 
 
 #
@@ -989,7 +1097,10 @@ def bins_spanned(bins, seglist, dtype = "double"):
 	Input is a Bins subclass instance and a glue.segments.segmentlist
 	instance.  The output is an array object the length of the binning,
 	which each element in the array set to the interval in the
-	corresponding bin spanned by the segment list.
+	corresponding bin spanned by the segment list.  Each bin boundary
+	is located in the segment list by a binary search, so the cost is
+	proportional to the number of segments plus the number of bins
+	times the logarithm of the number of segments.
 
 	Example:
 
@@ -1018,10 +1129,33 @@ def bins_spanned(bins, seglist, dtype = "double"):
 	# merely correspond to low and high parameters used to construct the binning
 	# (see, for example, the atan binning)
 	seglist = seglist & segments.segmentlist([segments.segment(lower[0], upper[-1])])
-	array = numpy.zeros((len(bins),), dtype = dtype)
-	for i, (a, b) in enumerate(zip(lower, upper)):
-		array[i] = abs(seglist & segments.segmentlist([segments.segment(a, b)]))
-	return array
+	if not seglist:
+		return numpy.zeros((len(bins),), dtype = dtype)
+	starts = numpy.array([float(seg[0]) for seg in seglist])
+	stops = numpy.array([float(seg[1]) for seg in seglist])
+	if not (numpy.isfinite(starts).all() and numpy.isfinite(stops).all()):
+		# infinite segments (slow path)
+		array = numpy.zeros((len(bins),), dtype = dtype)
+		for i, (a, b) in enumerate(zip(lower, upper)):
+			array[i] = abs(seglist & segments.segmentlist([segments.segment(a, b)]))
+		return array
+	# the segments are disjoint and in order.  the interval spanned
+	# in each bin is the difference of the cumulative coverage of the
+	# segment list, C(x) = abs(seglist & [-inf, x)), at the bin's
+	# boundaries.  the co-ordinates are measured from the start of the
+	# first segment to preserve precision
+	origin = starts[0]
+	starts -= origin
+	stops -= origin
+	cumulative = numpy.hstack(([0.], numpy.cumsum(stops - starts)))
+	def coverage(x):
+		x = x - origin
+		# number of segments wholly below x, and the portion of the
+		# next one below x
+		j = stops.searchsorted(x, side = "right")
+		partial = numpy.where(j < len(starts), x - starts[numpy.minimum(j, len(starts) - 1)], 0.)
+		return cumulative[j] + numpy.maximum(partial, 0.)
+	return (coverage(upper) - coverage(lower)).astype(dtype)
 
 
 #
@@ -1033,6 +1167,102 @@ def bins_spanned(bins, seglist, dtype = "double"):
 #
 
 
+#
+# re-binning.  the mapping from the bins of one binning onto the bins of a
+# coarser one is computed once for each pair of binnings and kept in a
+# small LRU cache, so that repeatedly merging histograms with the same
+# pair of binnings (e.g., when summing the output of many jobs) re-uses
+# it.
+#
+
+
+_rebin_cache = collections.OrderedDict()
+_rebin_cache_size = 64
+
+
+def _bins_key(bins):
+	"""
+	Return a hashable key identifying a Bins instance by value, or None
+	if it can't be identified by value.  For internal use only.
+	"""
+	if isinstance(bins, IrregularBins):
+		return type(bins), bins.boundaries
+	if isinstance(bins, Categories):
+		return None
+	return type(bins), bins.min, bins.max, len(bins)
+
+
+def _rebin_plan(source, target):
+	"""
+	Compute the mapping of the bins of the NDBins source onto the bins
+	of the NDBins target.  The return value is a tuple with one entry
+	per dimension:  None if the bins along that dimension are
+	identical, an integer k if each run of k consecutive bins in
+	source is summed into one bin in target, or a (starts, targets)
+	tuple of arrays for numpy.add.reduceat() if the runs are
+	irregular.  Returns None if the mapping is not monotonic in some
+	dimension, or if a binning's co-ordinates are not numbers.  For
+	internal use only.
+	"""
+	key = tuple(map(_bins_key, source)), tuple(map(_bins_key, target))
+	if None in key[0] or None in key[1]:
+		return None
+	try:
+		plan = _rebin_cache.pop(key)
+	except KeyError:
+		pass
+	else:
+		_rebin_cache[key] = plan
+		return plan
+
+	plan = []
+	for s, t in zip(source, target):
+		index_map = t[numpy.array(s.centres())]
+		n_s, n_t = len(s), len(t)
+		if (index_map[1:] < index_map[:-1]).any():
+			# not monotonic
+			plan = None
+			break
+		if n_s == n_t and (index_map == numpy.arange(n_s)).all():
+			plan.append(None)
+		elif n_s % n_t == 0 and (index_map == numpy.arange(n_s) // (n_s // n_t)).all():
+			plan.append(n_s // n_t)
+		else:
+			starts, = numpy.nonzero(numpy.hstack(([True], index_map[1:] != index_map[:-1])))
+			plan.append((starts, index_map[starts]))
+	if plan is not None:
+		plan = tuple(plan)
+
+	_rebin_cache[key] = plan
+	while len(_rebin_cache) > _rebin_cache_size:
+		_rebin_cache.popitem(last = False)
+	return plan
+
+
+def _rebin(array, plan, shape):
+	"""
+	Apply a re-binning plan computed by _rebin_plan() to array,
+	returning a new array of the given shape.  For internal use only.
+	"""
+	for axis, (step, n) in enumerate(zip(plan, shape)):
+		if step is None:
+			continue
+		if isinstance(step, int):
+			# regular fold:  split the axis in two and sum over
+			# the inner one
+			array = array.reshape(array.shape[:axis] + (n, step) + array.shape[axis + 1:]).sum(axis = axis + 1)
+		else:
+			starts, targets = step
+			reduced = numpy.add.reduceat(array, starts, axis = axis)
+			if len(targets) == n:
+				array = reduced
+			else:
+				# some target bins receive nothing
+				array = numpy.zeros(array.shape[:axis] + (n,) + array.shape[axis + 1:], dtype = reduced.dtype)
+				array[(slice(None),) * axis + (targets,)] = reduced
+	return array
+
+
 class BinnedArray(object):
 	"""
 	A convenience wrapper, using the NDBins class to provide access to
@@ -1079,6 +1309,16 @@ class BinnedArray(object):
 	(0.0, 0.0)
 	>>> x.argmax()
 	(1.0, 1.0)
+
+	Many co-ordinates can be histogrammed at once
+
+	>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5),)))
+	>>> x.add_many((numpy.array([0, 0.5, 3, 9.9]),))
+	>>> x.array
+	array([ 2.,  1.,  0.,  0.,  1.])
+	>>> x.add_many((numpy.array([3, 9.9]),), numpy.array([0.5, 2.]))
+	>>> x.array
+	array([ 2. ,  1.5,  0. ,  0. ,  3. ])
 	"""
 	def __init__(self, bins, array = None, dtype = "double"):
 		self.bins = bins
@@ -1098,12 +1338,39 @@ class BinnedArray(object):
 	def __len__(self):
 		return len(self.array)
 
+	def add_many(self, coords, weights = 1):
+		"""
+		Histogram many co-ordinates at once.  coords is a tuple of
+		co-ordinate arrays, one for each dimension, and weights is
+		a scalar or an array of weights that is broadcast against
+		them.  The weight of each co-ordinate is added to the bin
+		containing it, which is equivalent to, but much faster
+		than, doing self[c] += w for each co-ordinate in turn.
+		IndexError is raised, and no bins are modified, if any
+		co-ordinate is not in the binning.
+		"""
+		indexes = self.bins[tuple(numpy.asarray(c) for c in coords)]
+		indexes = numpy.broadcast_arrays(*(indexes + (numpy.asarray(weights),)))
+		weights = indexes.pop()
+		indexes = numpy.ravel_multi_index(tuple(i.ravel() for i in indexes), self.array.shape)
+		counts = numpy.bincount(indexes, weights = weights.ravel(), minlength = self.array.size)
+		numpy.add(self.array, counts.reshape(self.array.shape), out = self.array, casting = "unsafe")
+
 	def __iadd__(self, other):
 		"""
 		Add the contents of another BinnedArray object to this one.
 		It is not necessary for the binnings to be identical, but
 		an integer number of the bins in other must fit into each
 		bin in self.
+
+		Example:
+
+		>>> x = BinnedArray(NDBins((LinearBins(0, 4, 2),)))
+		>>> y = BinnedArray(NDBins((LinearBins(0, 4, 4),)))
+		>>> y.array[:] = [1, 2, 3, 4]
+		>>> x += y
+		>>> x.array
+		array([ 3.,  7.])
 		"""
 		# identical binning? (fast path)
 		if not cmp(self.bins, other.bins):
@@ -1112,8 +1379,13 @@ class BinnedArray(object):
 		# can other's bins be put into ours?
 		if self.bins.min != other.bins.min or self.bins.max != other.bins.max or False in map(lambda a, b: (b % a) == 0, self.bins.shape, other.bins.shape):
 			raise TypeError("incompatible binning: %s" % repr(other))
-		for coords in iterutils.MultiIter(*other.bins.centres()):
-			self[coords] += other[coords]
+		plan = _rebin_plan(other.bins, self.bins)
+		if plan is None:
+			# no whole-array mapping (slow path)
+			for coords in iterutils.MultiIter(*other.bins.centres()):
+				self[coords] += other[coords]
+			return self
+		self.array += _rebin(other.array, plan, self.array.shape)
 		return self
 
 	def copy(self):
@@ -1203,6 +1475,280 @@ class BinnedArray(object):
 		self.array = ligolw_array.get_array(xml, u"array").array
 		return self
 
+	def to_binary(self, filename, name):
+		"""
+		Write the BinnedArray to a file in the binary format
+		described in save_binary(), with the given name.
+		"""
+		save_binary(filename, {u"%s:pylal_rate_binnedarray" % name: self})
+
+	@classmethod
+	def from_binary(cls, filename, name, mmap_mode = "r"):
+		"""
+		Load the BinnedArray named name from a file written by
+		.to_binary().  See load_binary() for the meaning of
+		mmap_mode.
+		"""
+		objects, metadata = load_binary(filename, mmap_mode = mmap_mode)
+		try:
+			self = objects[u"%s:pylal_rate_binnedarray" % name]
+		except KeyError:
+			raise ValueError("%s does not contain a BinnedArray named '%s'" % (filename, name))
+		if not isinstance(self, cls):
+			self = cls(self.bins, self.array)
+		return self
+
+
+class SparseBinnedArray(object):
+	"""
+	Like BinnedArray, but only the bins whose contents are non-zero are
+	stored, in a dictionary mapping bin index tuples to values.  This
+	allows histograms of high-dimensional binnings in which most bins
+	are empty to be accumulated without allocating the full array.
+
+	The bins are addressed by co-ordinate the same way as with a
+	BinnedArray, and bins that have not been assigned a value contain
+	0.  Only one bin can be addressed at a time, but many can be
+	incremented at once with .add_many().
+
+	This is a standalone container, not a subclass of BinnedArray.
+	It has no .array attribute, and cannot be used in place of a
+	BinnedArray by code that expects one, such as InterpBinnedArray
+	or the histograms of snglcoinc.CoincParamsDistributions.  Use
+	.to_dense() to obtain a BinnedArray.
+
+	Example:
+
+	>>> x = SparseBinnedArray(NDBins((LinearBins(0, 10, 5), LogarithmicBins(1, 1000, 3))))
+	>>> x[1, 5] += 1
+	>>> x[1.5, 6] += 1
+	>>> x[9, 500] = 3
+	>>> x[1, 5]
+	2.0
+	>>> x[5, 5]
+	0.0
+	>>> len(x.cells)
+	2
+	>>> x.add_many((numpy.array([1, 9]), numpy.array([5, 500])), numpy.array([1, 0.5]))
+	>>> x.to_dense().array
+	array([[ 3. ,  0. ,  0. ],
+	       [ 0. ,  0. ,  0. ],
+	       [ 0. ,  0. ,  0. ],
+	       [ 0. ,  0. ,  0. ],
+	       [ 0. ,  0. ,  3.5]])
+	"""
+	def __init__(self, bins, dtype = "double"):
+		self.bins = bins
+		self.dtype = numpy.dtype(dtype)
+		self.cells = {}
+
+	def _index(self, coords):
+		index = self.bins[coords]
+		if False in [isinstance(i, (int, long, numpy.integer)) for i in index]:
+			raise TypeError("only single bins can be addressed: %s" % repr(coords))
+		return index
+
+	def __getitem__(self, coords):
+		return self.dtype.type(self.cells.get(self._index(coords), 0))
+
+	def __setitem__(self, coords, val):
+		index = self._index(coords)
+		if val:
+			self.cells[index] = self.dtype.type(val)
+		else:
+			self.cells.pop(index, None)
+
+	def __len__(self):
+		return self.bins.shape[0]
+
+	def indices_and_values(self):
+		"""
+		Return the contents as a tuple of two arrays:  an (n, d)
+		array of the indexes of the n stored bins in the
+		d-dimensional binning, and an array of their n values.
+		"""
+		indices = numpy.array(self.cells.keys(), dtype = "intp").reshape((len(self.cells), len(self.bins)))
+		values = numpy.fromiter(self.cells.values(), dtype = self.dtype, count = len(self.cells))
+		return indices, values
+
+	def _add_indices(self, indices, values):
+		"""
+		Add values to the bins whose indexes are the rows of
+		indices, summing duplicates.  For internal use only.
+		"""
+		if not len(values):
+			return
+		flat = numpy.ravel_multi_index(tuple(indices.T), self.bins.shape)
+		flat, inverse = numpy.unique(flat, return_inverse = True)
+		values = numpy.bincount(inverse, weights = values)
+		cells = self.cells
+		for index, value in itertools.izip(itertools.izip(*(i.tolist() for i in numpy.unravel_index(flat, self.bins.shape))), values.tolist()):
+			value += cells.get(index, 0)
+			if value:
+				cells[index] = self.dtype.type(value)
+			else:
+				cells.pop(index, None)
+
+	def add_many(self, coords, weights = 1):
+		"""
+		Histogram many co-ordinates at once.  Same as
+		BinnedArray.add_many().  IndexError is raised, and no bins
+		are modified, if any co-ordinate is not in the binning.
+		"""
+		indexes = self.bins[tuple(numpy.asarray(c) for c in coords)]
+		indexes = numpy.broadcast_arrays(*(indexes + (numpy.asarray(weights),)))
+		weights = indexes.pop()
+		self._add_indices(numpy.column_stack([i.ravel() for i in indexes]), weights.ravel().astype("double"))
+
+	def __iadd__(self, other):
+		"""
+		Add the contents of another SparseBinnedArray or a
+		BinnedArray to this one.  As with BinnedArray, it is not
+		necessary for the binnings to be identical, but an integer
+		number of the bins in other must fit into each bin in self.
+
+		Example:
+
+		>>> x = SparseBinnedArray(NDBins((LinearBins(0, 4, 2),)))
+		>>> y = BinnedArray(NDBins((LinearBins(0, 4, 4),)))
+		>>> y.array[:] = [1, 2, 0, 4]
+		>>> x += y
+		>>> sorted(x.cells.items())
+		[((0,), 3.0), ((1,), 4.0)]
+		"""
+		if isinstance(other, SparseBinnedArray):
+			indices, values = other.indices_and_values()
+		else:
+			indices = numpy.transpose(numpy.nonzero(other.array))
+			values = other.array[tuple(indices.T)]
+		# identical binning? (fast path)
+		if not cmp(self.bins, other.bins):
+			self._add_indices(indices, values.astype("double"))
+			return self
+		# can other's bins be put into ours?
+		if self.bins.min != other.bins.min or self.bins.max != other.bins.max or False in map(lambda a, b: (b % a) == 0, self.bins.shape, other.bins.shape):
+			raise TypeError("incompatible binning: %s" % repr(other))
+		# map the centres of other's non-empty bins into ours
+		self.add_many(tuple(centres[i] for centres, i in zip(other.bins.centres(), indices.T)), values.astype("double"))
+		return self
+
+	def copy(self):
+		"""
+		Return a copy of the SparseBinnedArray.  The .bins
+		attribute is shared with the original.
+		"""
+		new = type(self)(self.bins, dtype = self.dtype)
+		new.cells = self.cells.copy()
+		return new
+
+	def centres(self):
+		"""
+		Return a tuple of arrays containing the bin centres for
+		each dimension.
+		"""
+		return self.bins.centres()
+
+	def _volumes(self, indices):
+		"""
+		Return an array of the volumes of the bins whose indexes
+		are the rows of indices.  For internal use only.
+		"""
+		volumes = numpy.ones((len(indices),), dtype = "double")
+		for u, l, i in zip(self.bins.upper(), self.bins.lower(), indices.T):
+			volumes *= (u - l)[i]
+		return volumes
+
+	def _set_values(self, indices, values):
+		"""
+		Replace the contents with the given bins and values.  For
+		internal use only.
+		"""
+		self.cells = dict((index, value) for index, value in itertools.izip(itertools.izip(*(i.tolist() for i in indices.T)), values.astype(self.dtype)) if value)
+
+	def to_density(self):
+		"""
+		Divide each bin's value by the volume of the bin.
+		"""
+		indices, values = self.indices_and_values()
+		self._set_values(indices, values / self._volumes(indices))
+
+	def to_pdf(self):
+		"""
+		Convert into a probability density.
+		"""
+		indices, values = self.indices_and_values()
+		self._set_values(indices, values / values.sum() / self._volumes(indices))
+
+	def to_dense(self):
+		"""
+		Return a BinnedArray containing the same data.  The .bins
+		attribute is shared with the original.
+		"""
+		result = BinnedArray(self.bins, dtype = self.dtype)
+		indices, values = self.indices_and_values()
+		result.array[tuple(indices.T)] = values
+		return result
+
+	@classmethod
+	def from_dense(cls, binnedarray):
+		"""
+		Construct a SparseBinnedArray from the non-zero bins of a
+		BinnedArray.
+		"""
+		self = cls(binnedarray.bins, dtype = binnedarray.array.dtype)
+		indices = numpy.transpose(numpy.nonzero(binnedarray.array))
+		self._set_values(indices, binnedarray.array[tuple(indices.T)])
+		return self
+
+	def to_xml(self, name):
+		"""
+		Return an XML document tree describing a
+		rate.SparseBinnedArray object.
+		"""
+		indices, values = self.indices_and_values()
+		xml = ligolw.LIGO_LW({u"Name": u"%s:pylal_rate_sparsebinnedarray" % name})
+		xml.appendChild(self.bins.to_xml())
+		xml.appendChild(ligolw_array.from_array(u"indices", indices.astype("int64")))
+		xml.appendChild(ligolw_array.from_array(u"values", values))
+		return xml
+
+	@classmethod
+	def from_xml(cls, xml, name):
+		"""
+		Search for the description of a rate.SparseBinnedArray
+		object named "name" in the XML document tree rooted at xml,
+		and construct and return a new rate.SparseBinnedArray
+		object from the data contained therein.
+		"""
+		xml = [elem for elem in xml.getElementsByTagName(ligolw.LIGO_LW.tagName) if elem.hasAttribute(u"Name") and elem.Name == u"%s:pylal_rate_sparsebinnedarray" % name]
+		try:
+			xml, = xml
+		except ValueError:
+			raise ValueError("document must contain exactly 1 SparseBinnedArray named '%s'" % name)
+		values = ligolw_array.get_array(xml, u"values").array
+		self = cls(NDBins.from_xml(xml), dtype = values.dtype)
+		self._set_values(ligolw_array.get_array(xml, u"indices").array.reshape((len(values), len(self.bins))), values)
+		return self
+
+	def to_binary(self, filename, name):
+		"""
+		Write the SparseBinnedArray to a file in the binary format
+		described in save_binary(), with the given name.
+		"""
+		save_binary(filename, {u"%s:pylal_rate_sparsebinnedarray" % name: self})
+
+	@classmethod
+	def from_binary(cls, filename, name):
+		"""
+		Load the SparseBinnedArray named name from a file written
+		by .to_binary().
+		"""
+		objects, metadata = load_binary(filename, mmap_mode = None)
+		try:
+			return objects[u"%s:pylal_rate_sparsebinnedarray" % name]
+		except KeyError:
+			raise ValueError("%s does not contain a SparseBinnedArray named '%s'" % (filename, name))
+
 
 class BinnedRatios(object):
 	"""
@@ -1252,6 +1798,20 @@ class BinnedRatios(object):
 		"""
 		self.denominator[coords] += weight
 
+	def incnumerator_many(self, coords, weights = 1):
+		"""
+		Add weights to the numerator bins at many co-ordinates.
+		See BinnedArray.add_many() for more information.
+		"""
+		self.numerator.add_many(coords, weights)
+
+	def incdenominator_many(self, coords, weights = 1):
+		"""
+		Add weights to the denominator bins at many co-ordinates.
+		See BinnedArray.add_many() for more information.
+		"""
+		self.denominator.add_many(coords, weights)
+
 	def ratio(self):
 		"""
 		Compute and return the array of ratios.
@@ -1325,6 +1885,178 @@ class BinnedRatios(object):
 		self.denominator.bins = self.numerator.bins
 		return self
 
+	def to_binary(self, filename, name):
+		"""
+		Write the BinnedRatios to a file in the binary format
+		described in save_binary(), with the given name.
+		"""
+		save_binary(filename, {u"%s:pylal_rate_binnedratios" % name: self})
+
+	@classmethod
+	def from_binary(cls, filename, name, mmap_mode = "r"):
+		"""
+		Load the BinnedRatios named name from a file written by
+		.to_binary().  See load_binary() for the meaning of
+		mmap_mode.
+		"""
+		objects, metadata = load_binary(filename, mmap_mode = mmap_mode)
+		try:
+			ratios = objects[u"%s:pylal_rate_binnedratios" % name]
+		except KeyError:
+			raise ValueError("%s does not contain a BinnedRatios named '%s'" % (filename, name))
+		self = cls(NDBins())
+		self.numerator = ratios.numerator
+		self.denominator = ratios.denominator
+		return self
+
+
+#
+# =============================================================================
+#
+#                              Binary Persistence
+#
+# =============================================================================
+#
+
+
+#
+# The binary container format is:  the magic string BINARY_MAGIC, the
+# length of the header as a little-endian 64-bit unsigned integer, the
+# header, which is UTF-8 encoded JSON, then the raw array data.  The data
+# section and each array in it begin on a 64-byte boundary so that the
+# arrays can be memory-mapped.  The header records the binnings and array
+# locations of the objects in the file and an optional dictionary of
+# metadata.
+#
+
+
+BINARY_MAGIC = b"pylal.rate:bin01"
+BINARY_ALIGNMENT = 64
+
+
+def _binary_align(n):
+	return (n + BINARY_ALIGNMENT - 1) // BINARY_ALIGNMENT * BINARY_ALIGNMENT
+
+
+def save_binary(filename, objects, metadata = None):
+	"""
+	Write a dictionary of BinnedArray, SparseBinnedArray and
+	BinnedRatios objects to a file in the binary container format.
+	The keys are the objects' names.  metadata, if given, is a
+	dictionary of additional JSON-serializable information to be
+	recorded in the header.  The binnings must be serializable (see
+	NDBins.descriptions()).
+
+	Example:
+
+	>>> import os, tempfile
+	>>> x = BinnedArray(NDBins((LinearBins(0, 10, 5), LogarithmicBins(1, 100, 2))))
+	>>> x.array[:] = numpy.arange(10).reshape((5, 2))
+	>>> fd, filename = tempfile.mkstemp()
+	>>> os.close(fd)
+	>>> save_binary(filename, {"x": x}, metadata = {"comment": "example"})
+	>>> objects, metadata = load_binary(filename)
+	>>> objects["x"].bins == x.bins
+	True
+	>>> objects["x"].array
+	memmap([[ 0.,  1.],
+	        [ 2.,  3.],
+	        [ 4.,  5.],
+	        [ 6.,  7.],
+	        [ 8.,  9.]])
+	>>> metadata
+	{u'comment': u'example'}
+	>>> del objects
+	>>> os.remove(filename)
+	"""
+	arrays = []
+	def add_array(array):
+		array = numpy.ascontiguousarray(array)
+		if array.dtype.hasobject:
+			raise TypeError("cannot serialize arrays of objects")
+		arrays.append(array)
+		return len(arrays) - 1
+	entries = {}
+	for name, obj in objects.items():
+		if isinstance(obj, BinnedArray):
+			entries[name] = {"type": "BinnedArray", "bins": obj.bins.descriptions(), "array": add_array(obj.array)}
+		elif isinstance(obj, SparseBinnedArray):
+			indices, values = obj.indices_and_values()
+			entries[name] = {"type": "SparseBinnedArray", "bins": obj.bins.descriptions(), "indices": add_array(indices.astype("int64")), "values": add_array(values)}
+		elif isinstance(obj, BinnedRatios):
+			entries[name] = {"type": "BinnedRatios", "bins": obj.numerator.bins.descriptions(), "numerator": add_array(obj.numerator.array), "denominator": add_array(obj.denominator.array)}
+		else:
+			raise TypeError(obj)
+	layout = []
+	offset = 0
+	for array in arrays:
+		layout.append({"offset": offset, "dtype": array.dtype.str, "shape": array.shape})
+		offset = _binary_align(offset + array.nbytes)
+	header = json.dumps({"metadata": metadata or {}, "objects": entries, "arrays": layout}, sort_keys = True).encode("utf-8")
+
+	data_start = _binary_align(len(BINARY_MAGIC) + 8 + len(header))
+	with open(filename, "wb") as f:
+		f.write(BINARY_MAGIC)
+		f.write(struct.pack("<Q", len(header)))
+		f.write(header)
+		for array, entry in zip(arrays, layout):
+			f.write(b"\0" * (data_start + entry["offset"] - f.tell()))
+			array.tofile(f)
+
+
+def is_binary(filename):
+	"""
+	Return True if filename names a file in the binary container
+	format, False otherwise.
+	"""
+	with open(filename, "rb") as f:
+		return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def load_binary(filename, mmap_mode = "r"):
+	"""
+	Load the objects from a file in the binary container format.  The
+	return value is a tuple of the dictionary of objects, keyed by
+	name, and the metadata dictionary.  The arrays are memory-mapped
+	with numpy.memmap() using mmap_mode ("r" for read-only, "c" for
+	copy-on-write, "r+" to write modifications back to the file), so
+	only the parts of them that are used are read from disk.  If
+	mmap_mode is None the arrays are read into memory instead.
+	"""
+	with open(filename, "rb") as f:
+		if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+			raise ValueError("%s is not a pylal.rate binary file" % filename)
+		header_length, = struct.unpack("<Q", f.read(8))
+		header = json.loads(f.read(header_length).decode("utf-8"))
+		data_start = _binary_align(len(BINARY_MAGIC) + 8 + header_length)
+
+		def get_array(index):
+			entry = header["arrays"][index]
+			dtype = numpy.dtype(str(entry["dtype"]))
+			shape = tuple(entry["shape"])
+			if mmap_mode is None or not numpy.prod(shape):
+				# numpy.memmap() can't map 0 bytes
+				f.seek(data_start + entry["offset"])
+				return numpy.fromfile(f, dtype = dtype, count = int(numpy.prod(shape))).reshape(shape)
+			return numpy.memmap(filename, dtype = dtype, mode = mmap_mode, offset = data_start + entry["offset"], shape = shape)
+
+		objects = {}
+		for name, entry in header["objects"].items():
+			bins = NDBins.from_descriptions(entry["bins"])
+			if entry["type"] == "BinnedArray":
+				objects[name] = BinnedArray(bins, get_array(entry["array"]))
+			elif entry["type"] == "BinnedRatios":
+				obj = objects[name] = BinnedRatios(NDBins())
+				obj.numerator = BinnedArray(bins, get_array(entry["numerator"]))
+				obj.denominator = BinnedArray(bins, get_array(entry["denominator"]))
+			elif entry["type"] == "SparseBinnedArray":
+				values = get_array(entry["values"])
+				obj = objects[name] = SparseBinnedArray(bins, dtype = values.dtype)
+				obj._set_values(get_array(entry["indices"]), values)
+			else:
+				raise ValueError("%s: unrecognized object type '%s'" % (filename, entry["type"]))
+	return objects, header["metadata"]
+
 
 #
 # =============================================================================
@@ -1335,13 +2067,60 @@ class BinnedRatios(object):
 #
 
 
+def _interp_grid(binnedarray, fill_value):
+	"""
+	For internal use by the interpolators.  Returns a tuple of the
+	per-dimension interpolation co-ordinate arrays and the padded
+	array of sample values.
+	"""
+	# the upper and lower boundaries of the binnings are added as
+	# additional co-ordinates with the array being assumed to equal
+	# fill_value at those points.  this solves the problem of providing
+	# a valid function in the outer halves of the first and last bins.
+
+	# coords[0] = co-ordinates along 1st dimension,
+	# coords[1] = co-ordinates along 2nd dimension,
+	# ...
+	coords = tuple(numpy.hstack((l[0], c, u[-1])) for l, c, u in zip(binnedarray.bins.lower(), binnedarray.bins.centres(), binnedarray.bins.upper()))
+
+	# pad the contents of the binned array with 1 element of fill_value
+	# on each side in each dimension
+	try:
+		z = numpy.pad(binnedarray.array, [(1, 1)] * len(binnedarray.array.shape), mode = "constant", constant_values = [(fill_value, fill_value)] * len(binnedarray.array.shape))
+	except AttributeError:
+		# numpy < 1.7 didn't have pad().  FIXME:  remove when we
+		# can rely on a newer numpy
+		z = numpy.empty(tuple(l + 2 for l in binnedarray.array.shape))
+		z.fill(fill_value)
+		z[(slice(1, -1),) * len(binnedarray.array.shape)] = binnedarray.array
+
+	# if any co-ordinates are infinite, remove them.  also remove
+	# degenerate co-ordinates from ends
+	slices = []
+	for c in coords:
+		finite_indexes, = numpy.isfinite(c).nonzero()
+		assert len(finite_indexes) != 0
+
+		lo, hi = finite_indexes.min(), finite_indexes.max()
+
+		while lo < hi and c[lo + 1] == c[lo]:
+			lo += 1
+		while lo < hi and c[hi - 1] == c[hi]:
+			hi -= 1
+		assert lo < hi
+
+		slices.append(slice(lo, hi + 1))
+	coords = tuple(c[s] for c, s in zip(coords, slices))
+	z = z[tuple(slices)]
+
+	return coords, z
+
+
 def InterpBinnedArray(binnedarray, fill_value = 0.0):
 	"""
-	Wrapper constructing a scipy.interpolate interpolator from the
-	contents of a BinnedArray.  Only piecewise linear interpolators are
-	supported.  In 1 and 2 dimensions, scipy.interpolate.interp1d and
-	.interp2d is used, respectively.  In more than 2 dimensions
-	scipy.interpolate.LinearNDInterpolator is used.
+	Construct a piecewise (multi-)linear interpolator from the contents
+	of a BinnedArray.  The return value is a GridInterpBinnedArray
+	instance;  see that class for more information.
 
 	Example:
 
@@ -1402,120 +2181,168 @@ def InterpBinnedArray(binnedarray, fill_value = 0.0):
 	>>> y(1, 0.75)
 	3.5
 
-	BUGS:  Due to bugs in some versions of scipy and numpy, if an old
-	version of scipy and/or numpy is detected this code falls back to
-	home-grown piece-wise linear interpolator code for 1- and 2
-	dimensions that is slow, and in 3- and higher dimensions the
-	fall-back is to nearest-neighbour "interpolation".
 	"""
-	# the upper and lower boundaries of the binnings are added as
-	# additional co-ordinates with the array being assumed to equal
-	# fill_value at those points.  this solves the problem of providing
-	# a valid function in the outer halves of the first and last bins.
-
-	# coords[0] = co-ordinates along 1st dimension,
-	# coords[1] = co-ordinates along 2nd dimension,
-	# ...
-	coords = tuple(numpy.hstack((l[0], c, u[-1])) for l, c, u in zip(binnedarray.bins.lower(), binnedarray.bins.centres(), binnedarray.bins.upper()))
-
-	# pad the contents of the binned array with 1 element of fill_value
-	# on each side in each dimension
-	try:
-		z = numpy.pad(binnedarray.array, [(1, 1)] * len(binnedarray.array.shape), mode = "constant", constant_values = [(fill_value, fill_value)] * len(binnedarray.array.shape))
-	except AttributeError:
-		# numpy < 1.7 didn't have pad().  FIXME:  remove when we
-		# can rely on a newer numpy
-		z = numpy.empty(tuple(l + 2 for l in binnedarray.array.shape))
-		z.fill(fill_value)
-		z[(slice(1, -1),) * len(binnedarray.array.shape)] = binnedarray.array
+	return GridInterpBinnedArray(binnedarray, fill_value = fill_value)
 
-	# if any co-ordinates are infinite, remove them.  also remove
-	# degenerate co-ordinates from ends
-	slices = []
-	for c in coords:
-		finite_indexes, = numpy.isfinite(c).nonzero()
-		assert len(finite_indexes) != 0
-
-		lo, hi = finite_indexes.min(), finite_indexes.max()
 
-		while lo < hi and c[lo + 1] == c[lo]:
-			lo += 1
-		while lo < hi and c[hi - 1] == c[hi]:
-			hi -= 1
-		assert lo < hi
+class GridInterpBinnedArray(object):
+	"""
+	Piecewise multilinear interpolator for the contents of a
+	BinnedArray.  The array is sampled at the bin centres, and padded
+	with fill_value at the upper and lower boundaries of the binnings
+	exactly as is done by InterpBinnedArray(), but the interpolation
+	is done on the rectilinear grid directly:  the cell containing
+	each point is found with a binary search along each dimension and
+	the result is the weighted sum of the values at the cell's
+	corners.  Points outside the grid, or at which any co-ordinate is
+	NaN, evaluate to fill_value.
+
+	The co-ordinates can be scalars or arrays (which are broadcast
+	against one another), so many points can be evaluated with a
+	single call.  If all co-ordinates are scalars the return value is
+	a float, otherwise it is an array.  Where a cell corner with
+	non-zero weight is infinite the result is that infinity;  this is
+	what allows logarithms of PDFs with empty bins to be interpolated.
+
+	Construction costs O(number of bins), and each point costs
+	O(2^dimensions) plus the cost of locating its cell.  For the
+	binnings whose bin centres are uniformly spaced in some
+	co-ordinate transform (LinearBins, LogarithmicBins, ATanBins and
+	their overflow variants) the cell is computed directly from the
+	transformed co-ordinate, otherwise it is found by binary search.
+	The interpolation weights are always computed in the original
+	co-ordinates.
 
-		slices.append(slice(lo, hi + 1))
-	coords = tuple(c[s] for c, s in zip(coords, slices))
-	z = z[slices]
+	Example:
 
-	# build the interpolator from the co-ordinates and array data.
-	# scipy/numpy interpolators return an array-like thing so we have
-	# to wrap them, in turn, in a float cast
-	if len(coords) == 1:
-		try:
-			interp1d
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			coords0 = coords[0]
-			lo, hi = coords[0][0], coords[0][-1]
-			with numpy.errstate(invalid = "ignore"):
-				dz_over_dcoords0 = (z[1:] - z[:-1]) / (coords0[1:] - coords0[:-1])
-			isinf = math.isinf
-			def interp(x):
-				if not lo < x < hi:
-					return fill_value
-				i = coords0.searchsorted(x) - 1
-				if isinf(z[i]):
-					return z[i]
-				return z[i] + (x - coords0[i]) * dz_over_dcoords0[i]
-			return interp
-		interp = interp1d(coords[0], z, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
-	elif len(coords) == 2:
-		try:
-			interp2d
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			coords0 = coords[0]
-			coords1 = coords[1]
-			lox, hix = coords0[0], coords0[-1]
-			loy, hiy = coords1[0], coords1[-1]
-			dcoords0 = coords0[1:] - coords0[:-1]
-			dcoords1 = coords1[1:] - coords1[:-1]
-			with numpy.errstate(invalid = "ignore"):
-				dz0 = z[1:,:] - z[:-1,:]
-				dz1 = z[:,1:] - z[:,:-1]
-			isinf = math.isinf
-			def interp(x, y):
-				if not (lox < x < hix and loy < y < hiy):
-					return fill_value
-				i = coords0.searchsorted(x) - 1
-				j = coords1.searchsorted(y) - 1
-				dx = (x - coords0[i]) / dcoords0[i]
-				dy = (y - coords1[j]) / dcoords1[j]
-				if dx + dy <= 1.:
-					if isinf(z[i, j]):
-						return z[i, j]
-					return z[i, j] + dx * dz0[i, j] + dy * dz1[i, j]
-				if isinf(z[i + 1, j + 1]):
-					return z[i + 1, j + 1]
-				return z[i + 1, j + 1] + (1. - dx) * -dz0[i, j + 1] + (1. - dy) * -dz1[i + 1, j]
-			return interp
-		interp = interp2d(coords[0], coords[1], z.T, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
-	else:
-		try:
-			LinearNDInterpolator
-		except NameError:
-			# FIXME:  remove when we can rely on a new-enough scipy
-			def interp(*coords):
-				try:
-					return binnedarray[coords]
-				except IndexError:
-					return fill_value
-			return interp
-		interp = LinearNDInterpolator(list(itertools.product(*coords)), z.flat, fill_value = fill_value)
-		return lambda *coords: float(interp(*coords))
+	>>> x = BinnedArray(NDBins((LinearBins(-0.5, 2.5, 3), LinearBins(-0.5, 1.5, 2))))
+	>>> x[0, 0] = 0
+	>>> x[0, 1] = 1
+	>>> x[1, 0] = 2
+	>>> x[1, 1] = 4
+	>>> x[2, 0] = 2
+	>>> x[2, 1] = 4
+	>>> y = GridInterpBinnedArray(x)
+	>>> y(1, 1)
+	4.0
+	>>> y(0.25, 1)
+	1.75
+	>>> y(0.5, 0.5)
+	1.75
+	>>> y([0, 0.75, 1, 5], 0)
+	array([ 0. ,  1.5,  2. ,  0. ])
+	"""
+	def __init__(self, binnedarray, fill_value = 0.0):
+		self.coords, self.z = _interp_grid(binnedarray, fill_value)
+		self.fill_value = fill_value
+		# for each dimension, None or a (transform, origin, delta)
+		# tuple used to compute cell indexes directly
+		self.locators = tuple(self._locator(bins, c) for bins, c in zip(binnedarray.bins, self.coords))
+		# for the scalar code path
+		self._coord_lists = tuple(c.tolist() for c in self.coords)
+		self._corners = tuple(itertools.product((0, 1), repeat = len(self.coords)))
+
+	@staticmethod
+	def _locator(bins, coords):
+		"""
+		For internal use only.
+		"""
+		if isinstance(bins, (LinearBins, LinearPlusOverflowBins)):
+			transform = None
+		elif isinstance(bins, (LogarithmicBins, LogarithmicPlusOverflowBins)):
+			transform = numpy.log
+		elif isinstance(bins, ATanBins):
+			transform = lambda x, mid = bins.mid, scale = bins.scale: numpy.arctan((x - mid) * scale)
+		else:
+			return None
+		# the first and last co-ordinates can be bin boundaries
+		# instead of centres, so they are left out.  the remaining
+		# co-ordinates must be uniformly spaced after the transform
+		if len(coords) < 4:
+			return None
+		interior = coords[1:-1]
+		if transform is not None:
+			interior = transform(interior)
+		delta = (interior[-1] - interior[0]) / (len(interior) - 1)
+		if not (numpy.isfinite(delta) and delta > 0 and (abs(numpy.diff(interior) - delta) <= 1e-8 * delta).all()):
+			return None
+		return transform, interior[0], delta
+
+	def _cells(self, c, locator, x):
+		"""
+		Return the index of the cell in the co-ordinate array c
+		containing each x.  For internal use only.
+		"""
+		if locator is None:
+			return numpy.clip(c.searchsorted(x, side = "right") - 1, 0, len(c) - 2)
+		transform, origin, delta = locator
+		with numpy.errstate(divide = "ignore", invalid = "ignore"):
+			i = numpy.floor(((transform(x) if transform is not None else x) - origin) / delta) + 1.
+			i = numpy.clip(numpy.where(numpy.isnan(i), 0., i), 0., len(c) - 2).astype("int")
+			# correct for round-off in the transform
+			i -= x < c[i]
+			i += x >= c[numpy.minimum(i + 1, len(c) - 1)]
+		return numpy.clip(i, 0, len(c) - 2)
+
+	def __call__(self, *coords):
+		if len(coords) != len(self.coords):
+			raise ValueError("wrong number of co-ordinates:  expected %d, got %d" % (len(self.coords), len(coords)))
+		if all(numpy.isscalar(x) for x in coords):
+			return self._call_scalar(coords)
+		coords = numpy.broadcast_arrays(*(numpy.asarray(x, dtype = "double") for x in coords))
+		shape = coords[0].shape
+
+		# locate the cell containing each point, and the fractional
+		# position of the point within the cell along each dimension
+		inrange = numpy.ones(shape, dtype = "bool")
+		indexes = []
+		fractions = []
+		with numpy.errstate(invalid = "ignore"):
+			for c, locator, x in zip(self.coords, self.locators, coords):
+				i = self._cells(c, locator, x)
+				inrange &= (c[0] <= x) & (x <= c[-1])
+				indexes.append(i)
+				fractions.append((x - c[i]) / (c[i + 1] - c[i]))
+
+			# sum the contributions from the cells' corners.
+			# corners with zero weight are skipped so that
+			# infinities in neighbouring cells don't leak in as
+			# NaNs
+			result = numpy.zeros(shape, dtype = "double")
+			for corner in itertools.product((0, 1), repeat = len(self.coords)):
+				weight = numpy.ones(shape, dtype = "double")
+				for bit, t in zip(corner, fractions):
+					weight *= t if bit else 1. - t
+				value = self.z[tuple(i + bit for bit, i in zip(corner, indexes))]
+				result += numpy.where(weight != 0., weight * value, 0.)
+
+		result[~inrange] = self.fill_value
+		if not shape:
+			return float(result)
+		return result
+
+	def _call_scalar(self, coords):
+		"""
+		Same as .__call__() for a single point, avoiding the
+		overhead of numpy's array operations.  For internal use
+		only.
+		"""
+		indexes = []
+		fractions = []
+		for c, x in zip(self._coord_lists, coords):
+			if not c[0] <= x <= c[-1]:
+				return float(self.fill_value)
+			i = min(bisect_right(c, x) - 1, len(c) - 2)
+			indexes.append(i)
+			fractions.append((x - c[i]) / (c[i + 1] - c[i]))
+		result = 0.
+		for corner in self._corners:
+			weight = 1.
+			for bit, t in zip(corner, fractions):
+				weight *= t if bit else 1. - t
+			if weight != 0.:
+				result += weight * self.z[tuple(i + bit for bit, i in zip(corner, indexes))]
+		return float(result)
 
 
 #
@@ -1527,6 +2354,18 @@ def InterpBinnedArray(binnedarray, fill_value = 0.0):
 #
 
 
+#
+# windows are often requested repeatedly with the same parameters (e.g.,
+# each time a ranking statistic's PDFs are recomputed), and for each
+# parameter set the most recently generated windows are kept in a small
+# LRU cache
+#
+
+
+_gaussian_window_cache = collections.OrderedDict()
+_gaussian_window_cache_size = 32
+
+
 def gaussian_window(*bins, **kwargs):
 	"""
 	Generate a normalized (integral = 1) Gaussian window in N
@@ -1554,6 +2393,22 @@ def gaussian_window(*bins, **kwargs):
 	sigma = kwargs.pop("sigma", 10)
 	if kwargs:
 		raise ValueError("unrecognized keyword argument(s): %s" % ",".join(kwargs))
+	key = bins, sigma
+	try:
+		window = _gaussian_window_cache.pop(key)
+	except KeyError:
+		window = _gaussian_window(bins, sigma)
+	_gaussian_window_cache[key] = window
+	while len(_gaussian_window_cache) > _gaussian_window_cache_size:
+		_gaussian_window_cache.popitem(last = False)
+	# the caller is allowed to modify the window
+	return window.copy()
+
+
+def _gaussian_window(bins, sigma):
+	"""
+	Compute the window for gaussian_window().  For internal use only.
+	"""
 	windows = []
 	for b in bins:
 		if b <= 0:
@@ -1633,6 +2488,60 @@ def tophat_window2d(bins_x, bins_y):
 #
 
 
+#
+# the work space used by filter_array() for each group of magnitude bands
+# is limited to about this many bytes
+#
+
+
+_filter_workspace_bytes = 1 << 20
+
+
+def _next_fast_len(n):
+	"""
+	Return the smallest integer >= n whose only prime factors are 2,
+	3 and 5.  For internal use only.
+	"""
+	best = 1
+	while best < n:
+		best *= 2
+	p5 = 1
+	while p5 < best:
+		p35 = p5
+		while p35 < best:
+			m = p35
+			while m < n:
+				m *= 2
+			best = min(best, m)
+			p35 *= 3
+		p5 *= 5
+	return best
+
+
+_window_fft_cache = collections.OrderedDict()
+_window_fft_cache_size = 16
+
+
+def _window_fft(window, shape):
+	"""
+	Return the real-input FFT of the window function zero-padded to
+	shape.  The most recently used transforms are kept in a small LRU
+	cache keyed on the window's contents and the padded shape, and
+	are returned read-only.  For internal use only.
+	"""
+	window = numpy.asarray(window, dtype = "double")
+	key = window.shape, window.tostring(), shape
+	try:
+		window_fft = _window_fft_cache.pop(key)
+	except KeyError:
+		window_fft = numpy.fft.rfftn(window, s = shape)
+		window_fft.flags.writeable = False
+	_window_fft_cache[key] = window_fft
+	while len(_window_fft_cache) > _window_fft_cache_size:
+		_window_fft_cache.popitem(last = False)
+	return window_fft
+
+
 def filter_array(a, window, cyclic = False):
 	"""
 	Filter an array using the window function.  The transformation is
@@ -1645,7 +2554,15 @@ def filter_array(a, window, cyclic = False):
 	of the window function in the affected dimensions will be used.
 	This is done silently;  to determine if window function truncation
 	will occur, check for yourself that your window function is smaller
-	than your data in all dimensions.
+	than your data in all dimensions.  The data must be finite.
+
+	Example:
+
+	>>> a = numpy.array([0., 0., 1e-200, 0., 0., 1., 0.])
+	>>> filter_array(a, numpy.array([0.25, 0.5, 0.25]))
+	array([  0.00000000e+000,   2.50000000e-201,   5.00000000e-201,
+	         2.50000000e-201,   2.50000000e-001,   5.00000000e-001,
+	         2.50000000e-001])
 	"""
 	assert not cyclic	# no longer supported, maybe in future
 	# check that the window and the data have the same number of
@@ -1666,48 +2583,69 @@ def filter_array(a, window, cyclic = False):
 			window_slices.append(slice(first, first + n))
 		else:
 			window_slices.append(slice(0, window.shape[d]))
-	window = window[window_slices]
-
-	# this loop works around dynamic range limits in the FFT
-	# convolution code.  we move data 4 orders of magnitude at a time
-	# from the original array into a work space, convolve the work
-	# space with the filter, zero the workspace in any elements that
-	# are more than 14 orders of magnitude below the maximum value in
-	# the result, and add the result to the total.
-	result = numpy.zeros_like(a)
-	while a.any():
-		# copy contents of input array to work space
-		workspace = numpy.copy(a)
-
-		# mask = indexes of elements of work space not more than 4
-		# orders of magnitude larger than the smallest non-zero
-		# element.  these are the elements to be processed in this
-		# iteration
-		abs_workspace = abs(workspace)
-		mask = abs_workspace <= abs_workspace[abs_workspace > 0].min() * 1e4
-		del abs_workspace
-
-		# zero the masked elements in the input array, zero
-		# everything except the masked elements in the work space
-		a[mask] = 0.
-		workspace[~mask] = 0.
-		del mask
-
-		# convolve the work space with the kernel
-		workspace = signaltools.fftconvolve(workspace, window, mode = "same")
-
-		# determine the largest value in the work space, and set to
-		# zero anything more than 14 orders of magnitude smaller
+	window = window[tuple(window_slices)]
+
+	# nothing to do?
+	abs_a = abs(a)
+	nonzero = abs_a > 0.
+	if not nonzero.any():
+		return a
+	if not numpy.isfinite(a).all():
+		raise ValueError("array contains non-finite values")
+
+	# this works around dynamic range limits in the FFT convolution.
+	# the elements are sorted into bands spanning 4 orders of
+	# magnitude each, starting from the smallest non-zero magnitude,
+	# and each band is convolved with the filter separately.  in each
+	# band's result, anything more than 14 orders of magnitude below
+	# that result's largest value is set to zero before the bands are
+	# summed.  the bands are transformed together, in groups whose
+	# size is limited by _filter_workspace_bytes, with one transform
+	# of the window function.
+	if abs_a.max() <= abs_a[nonzero].min() * 1e4:
+		# one band (fast path)
+		nbands = 1
+		workspace = a.copy()
+	else:
+		indexes, = numpy.nonzero(nonzero.ravel())
+		data = a.ravel()[indexes]
+		ln_abs_data = numpy.log10(abs_a.ravel()[indexes])
+		# bands = 0-based rank of each element's band among the
+		# bands that are populated
+		bands = numpy.floor((ln_abs_data - ln_abs_data.min()) / 4.).astype("int")
+		del ln_abs_data
+		populated = numpy.bincount(bands) != 0
+		nbands = populated.sum()
+		bands = (numpy.cumsum(populated) - 1)[bands]
+		del populated
+	del abs_a, nonzero
+
+	# zero-pad to the length of the full linear convolution, rounded
+	# up to a length the FFT handles efficiently, and crop the result
+	# to the "same" portion centred on the input
+	shape = tuple(_next_fast_len(n + w - 1) for n, w in zip(a.shape, window.shape))
+	axes = tuple(range(1, dims + 1))
+	crop = (slice(None),) + tuple(slice((w - 1) // 2, (w - 1) // 2 + n) for n, w in zip(a.shape, window.shape))
+	window_fft = _window_fft(window, shape)
+	group_size = max(1, _filter_workspace_bytes // window_fft.nbytes)
+
+	a.fill(0.)
+	for i in xrange(0, nbands, group_size):
+		n = min(group_size, nbands - i)
+		if nbands == 1:
+			workspace.shape = (1,) + a.shape
+		else:
+			workspace = numpy.zeros((n,) + a.shape, dtype = "double")
+			select = (bands >= i) & (bands < i + n)
+			workspace.reshape((n, -1))[bands[select] - i, indexes[select]] = data[select]
+			del select
+		workspace = numpy.fft.irfftn(numpy.fft.rfftn(workspace, s = shape, axes = axes) * window_fft, s = shape, axes = axes)[crop]
 		abs_workspace = abs(workspace)
-		workspace[abs_workspace < abs_workspace.max() * 1e-14] = 0.
+		threshold = abs_workspace.reshape((n, -1)).max(axis = 1) * 1e-14
+		workspace[abs_workspace < threshold.reshape((n,) + (1,) * dims)] = 0.
 		del abs_workspace
-
-		# sum what remains into the result
-		result += workspace
+		a += workspace.sum(axis = 0)
 		del workspace
-	# overwrite the input with the result
-	# FIXME:  in numpy >= 1.7.0 there is a copyto() function
-	a.flat = result.flat
 
 	return a
 
@@ -1749,6 +2687,60 @@ def filter_binned_ratios(ratios, window, cyclic = False):
 	filter_array(ratios.denominator.array, window, cyclic = cyclic)
 
 
+def filter_sparse_binned_array(binnedarray, window, cyclic = False, block_volume = 1 << 20):
+	"""
+	Convolve the contents of a SparseBinnedArray with a window
+	function.  The index space is divided into blocks of about
+	block_volume bins, and for each block that contains non-zero bins
+	the smallest sub-volume containing them, padded by the extent of
+	the window, is converted to a dense array and filtered with
+	filter_array(), and the results are summed.  The memory
+	required is set by the block size, not by how widely separated
+	the non-zero bins are.  The result is the same as that of
+	applying filter_array() to the equivalent dense array, except
+	that filter_array() discards values more than 14 orders of
+	magnitude below the largest in its input, which is now decided
+	block by block.
+
+	Example:
+
+	>>> x = SparseBinnedArray(NDBins((LinearBins(0, 1000000, 1000000),)))
+	>>> x[500000.5,] = 1
+	>>> filter_sparse_binned_array(x, tophat_window(3))
+	>>> sorted(x.cells)
+	[(499999,), (500000,), (500001,)]
+	>>> x[500000.5,]
+	0.33333333333333331
+	"""
+	indices, values = binnedarray.indices_and_values()
+	if not len(values):
+		return
+	shape = numpy.array(binnedarray.bins.shape)
+	w = numpy.array(window.shape)
+	# the edge length of the blocks, and each bin's block
+	edge = max(int(block_volume**(1. / len(shape))), 1)
+	blocks = indices // edge
+	blocks = numpy.ravel_multi_index(tuple(blocks.T), tuple((shape + edge - 1) // edge))
+	order = numpy.argsort(blocks, kind = "mergesort")
+	indices, values, blocks = indices[order], values[order], blocks[order]
+	boundaries = numpy.flatnonzero(numpy.diff(blocks)) + 1
+	binnedarray.cells = {}
+	for indices, values in itertools.izip(numpy.split(indices, boundaries), numpy.split(values, boundaries)):
+		# filter_array() centres the window on sample (w - 1) // 2
+		lo = numpy.maximum(indices.min(axis = 0) - (w - 1) // 2, 0)
+		hi = numpy.minimum(indices.max(axis = 0) + 1 + w // 2, shape)
+		# filter_array() truncates windows larger than the data, so
+		# the sub-volume must be at least as large as the window or
+		# span the whole array for the result to be the same
+		hi = numpy.minimum(numpy.maximum(hi, lo + w), shape)
+		lo = numpy.maximum(numpy.minimum(lo, hi - w), 0)
+		a = numpy.zeros(tuple(hi - lo), dtype = "double")
+		a[tuple((indices - lo).T)] = values
+		filter_array(a, window, cyclic = cyclic)
+		indices = numpy.transpose(numpy.nonzero(a))
+		binnedarray._add_indices(indices + lo, a[tuple(indices.T)])
+
+
 #
 # =============================================================================
 #
@@ -1802,7 +2794,10 @@ def to_moving_mean_density(binned_array, filterdata, cyclic = False):
 	unit, except at the edges where the smoothing window has picked up
 	zero values from beyond the ends of the array.
 	"""
-	filter_array(binned_array.array, filterdata, cyclic = cyclic)
+	if isinstance(binned_array, SparseBinnedArray):
+		filter_sparse_binned_array(binned_array, filterdata, cyclic = cyclic)
+	else:
+		filter_array(binned_array.array, filterdata, cyclic = cyclic)
 	binned_array.to_density()
 
 
@@ -1811,9 +2806,14 @@ def marginalize(pdf, dim):
 	From a BinnedArray object containing probability density data (bins
 	whose volume integral is 1), return a new BinnedArray object
 	containing the probability density marginalized over dimension
-	dim.
+	dim.  If pdf is a SparseBinnedArray so is the result.
 	"""
 	dx = pdf.bins[dim].upper() - pdf.bins[dim].lower()
+	if isinstance(pdf, SparseBinnedArray):
+		indices, values = pdf.indices_and_values()
+		result = SparseBinnedArray(NDBins(pdf.bins[:dim] + pdf.bins[dim+1:]), dtype = pdf.dtype)
+		result._add_indices(numpy.delete(indices, dim, axis = 1), values * dx[indices[:, dim]])
+		return result
 	dx_shape = [1] * len(pdf.bins)
 	dx_shape[dim] = len(dx)
 	dx.shape = dx_shape
@@ -31,6 +31,7 @@ Light Weight XML documents.
 
 
 import bisect
+import contextlib
 try:
 	from fpconst import NaN, NegInf, PosInf
 except ImportError:
@@ -40,13 +41,15 @@ except ImportError:
 	NegInf = float("-inf")
 	PosInf = float("+inf")
 import itertools
+import json
 import math
+import multiprocessing
 import numpy
-import random
 from scipy.constants import c as speed_of_light
 import scipy.optimize
 import sys
 import threading
+import time
 import warnings
 
 
@@ -55,9 +58,11 @@ from glue import offsetvector
 from glue import segmentsUtils
 from glue.ligolw import ligolw
 from glue.ligolw import array as ligolw_array
+from glue.ligolw import ilwd
 from glue.ligolw import param as ligolw_param
 from glue.ligolw import table as ligolw_table
 from glue.ligolw import lsctables
+from glue.ligolw import utils as ligolw_utils
 from glue.text_progress_bar import ProgressBar
 from pylal import git_version
 from pylal import inject
@@ -69,6 +74,302 @@ __version__ = "git id %s" % git_version.id
 __date__ = git_version.date
 
 
+#
+# =============================================================================
+#
+#                               Instrumentation
+#
+# =============================================================================
+#
+
+
+class Instrumentation(object):
+	"""
+	A registry of counters, timers and sample statistics recording
+	what the coincidence engine is doing.  Instrumentation is off by
+	default;  it is turned on by placing an instance of this class in
+	the module-level "instrumentation" variable, e.g., with
+	enable_instrumentation().  The hot loops accumulate their numbers
+	locally and report them once per call, so leaving it on costs
+	little.
+
+	The quantities recorded are
+
+	- counters:  "candidates" (pairs of events found by the time
+	  window searches and passed to the comparison function),
+	  "passed" (pairs found to be coincident), "coincs" (coincs
+	  assembled at each node)
+	- timers:  "leaf" (all two-instrument offset vectors), "leaf
+	  <offset vector>" (each two-instrument offset vector), "assembly"
+	  (construction of the higher-order offset vectors from their
+	  components)
+	- samples:  "window" (the number of candidates in the time window
+	  around each event)
+
+	Callbacks added with .add_callback() are called as
+	callback(kind, name, value) each time a quantity is reported,
+	where kind is "count", "time" or "sample".  For counters value is
+	the increment, for timers it is the elapsed time in seconds, and
+	for samples it is the tuple (count, total, minimum, maximum) being
+	added.  When the
+	two-instrument offset vectors are constructed by worker processes
+	the callbacks are called in the workers.
+
+	Example:
+
+	>>> from pylal import snglcoinc
+	>>> instrumentation = snglcoinc.Instrumentation()
+	>>> instrumentation.count("passed", 3)
+	>>> with instrumentation.timer("assembly"):
+	...	pass
+	...
+	>>> instrumentation.counters["passed"]
+	3
+	>>> instrumentation.timers["assembly"][0]
+	1
+	"""
+	def __init__(self, callbacks = ()):
+		# name --> count
+		self.counters = {}
+		# name --> [calls, total seconds, longest]
+		self.timers = {}
+		# name --> [count, total, minimum, maximum]
+		self.samples = {}
+		self.callbacks = list(callbacks)
+
+	def add_callback(self, callback):
+		self.callbacks.append(callback)
+
+	def remove_callback(self, callback):
+		self.callbacks.remove(callback)
+
+	def count(self, name, n = 1):
+		"""
+		Add n to the counter called name.
+		"""
+		self.counters[name] = self.counters.get(name, 0) + n
+		for callback in self.callbacks:
+			callback("count", name, n)
+
+	def add_time(self, name, seconds, calls = 1):
+		"""
+		Add an elapsed time to the timer called name.
+		"""
+		try:
+			stats = self.timers[name]
+		except KeyError:
+			stats = self.timers[name] = [0, 0.0, 0.0]
+		stats[0] += calls
+		stats[1] += seconds
+		stats[2] = max(stats[2], seconds)
+		for callback in self.callbacks:
+			callback("time", name, seconds)
+
+	@contextlib.contextmanager
+	def timer(self, name):
+		"""
+		Context manager that adds the time spent in its body to the
+		timer called name.
+		"""
+		t_start = time.time()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.time() - t_start)
+
+	def sample(self, name, count, total, minimum, maximum):
+		"""
+		Add a summary of count samples to the statistics called
+		name.  total, minimum and maximum are the sum, smallest and
+		largest of the samples.
+		"""
+		if not count:
+			return
+		try:
+			stats = self.samples[name]
+		except KeyError:
+			self.samples[name] = [count, total, minimum, maximum]
+		else:
+			stats[0] += count
+			stats[1] += total
+			stats[2] = min(stats[2], minimum)
+			stats[3] = max(stats[3], maximum)
+		for callback in self.callbacks:
+			callback("sample", name, (count, total, minimum, maximum))
+
+	def sample_array(self, name, values):
+		"""
+		Add the samples in the numpy array values to the statistics
+		called name.
+		"""
+		if len(values):
+			self.sample(name, len(values), values.sum().item(), values.min().item(), values.max().item())
+
+	def merge(self, other):
+		"""
+		Add the quantities recorded by another Instrumentation
+		object, e.g., one from a worker process, to this one.  The
+		callbacks are not called.
+		"""
+		for name, n in other.counters.items():
+			self.counters[name] = self.counters.get(name, 0) + n
+		for name, (calls, seconds, longest) in other.timers.items():
+			stats = self.timers.setdefault(name, [0, 0.0, 0.0])
+			stats[0] += calls
+			stats[1] += seconds
+			stats[2] = max(stats[2], longest)
+		for name, (count, total, minimum, maximum) in other.samples.items():
+			if name in self.samples:
+				stats = self.samples[name]
+				stats[0] += count
+				stats[1] += total
+				stats[2] = min(stats[2], minimum)
+				stats[3] = max(stats[3], maximum)
+			else:
+				self.samples[name] = [count, total, minimum, maximum]
+
+	def summary(self):
+		"""
+		Return a dictionary summarizing the quantities recorded,
+		suitable for encoding as JSON.
+		"""
+		return {
+			"counters": dict(self.counters),
+			"timers": dict((name, {"calls": calls, "seconds": seconds, "longest": longest}) for name, (calls, seconds, longest) in self.timers.items()),
+			"samples": dict((name, {"count": count, "mean": total / float(count), "min": minimum, "max": maximum}) for name, (count, total, minimum, maximum) in self.samples.items())
+		}
+
+	def write_json(self, fileobj):
+		"""
+		Write the .summary() to fileobj as JSON.
+		"""
+		json.dump(self.summary(), fileobj, sort_keys = True)
+		fileobj.write("\n")
+
+
+#
+# the active Instrumentation object, or None when instrumentation is
+# turned off
+#
+
+
+instrumentation = None
+
+
+@contextlib.contextmanager
+def enable_instrumentation(registry = None):
+	"""
+	Context manager that turns on instrumentation for the duration of
+	its body, and yields the Instrumentation object in use.  If
+	registry is None the Instrumentation object already in use is
+	kept, or if instrumentation is off a new one is created.  The
+	previous state is restored on exit, even if an exception is
+	raised.
+
+	Example:
+
+	>>> from pylal import snglcoinc
+	>>> with snglcoinc.enable_instrumentation() as registry:
+	...	registry is snglcoinc.instrumentation
+	...
+	True
+	>>> snglcoinc.instrumentation is None
+	True
+	"""
+	global instrumentation
+	previous = instrumentation
+	if registry is None:
+		registry = previous if previous is not None else Instrumentation()
+	instrumentation = registry
+	try:
+		yield registry
+	finally:
+		instrumentation = previous
+
+
+@contextlib.contextmanager
+def disable_instrumentation():
+	"""
+	Context manager that turns off instrumentation for the duration of
+	its body, and yields the Instrumentation object that was in use,
+	or None.  The previous state is restored on exit, even if an
+	exception is raised.
+	"""
+	global instrumentation
+	previous, instrumentation = instrumentation, None
+	try:
+		yield previous
+	finally:
+		instrumentation = previous
+
+
+class ArrayComparefunc(object):
+	"""
+	Pairs an event comparison function with a vectorized counterpart.
+	Calling the wrapper calls comparefunc.  The vectorized counterpart
+	is available as the .compare_array attribute, and is used by
+	ColumnarEventList.compare_candidates() in place of calling
+	comparefunc for each candidate pair.  It is called as
+
+	compare_array(eventlist_a, eventlist_b, ia, ib, light_travel_time, threshold)
+
+	where ia and ib are equal-length arrays of indexes into eventlist_a
+	and eventlist_b identifying the candidate pairs, and must return an
+	array of booleans that is True for each pair for which comparefunc
+	would return False (each pair that is coincident).
+
+	Any callable with a .compare_array attribute obeys the same
+	protocol, so a plain function can instead be given the attribute
+	directly.
+	"""
+	__slots__ = ("comparefunc", "compare_array")
+
+	def __init__(self, comparefunc, compare_array):
+		self.comparefunc = comparefunc
+		self.compare_array = compare_array
+
+	def __call__(self, *args):
+		return self.comparefunc(*args)
+
+
+class CountingComparefunc(object):
+	"""
+	Wrapper that counts the calls to an event comparison function and
+	the pairs that pass, e.g., for benchmarking.  The wrapped function
+	is available as the .comparefunc attribute.  If the wrapped
+	function has a vectorized .compare_array counterpart (see
+	ArrayComparefunc) so does the wrapper, and each candidate pair
+	given to it is counted as one call.  Note that wrapping a
+	comparison function hides it from EventList implementations that
+	recognize it by identity and select a faster code path.
+	"""
+	__slots__ = ("comparefunc", "calls", "passed")
+
+	def __init__(self, comparefunc):
+		self.comparefunc = comparefunc
+		self.calls = 0
+		self.passed = 0
+
+	def __call__(self, *args):
+		self.calls += 1
+		result = self.comparefunc(*args)
+		if not result:
+			self.passed += 1
+		return result
+
+	@property
+	def compare_array(self):
+		compare_array = getattr(self.comparefunc, "compare_array", None)
+		if compare_array is None:
+			return None
+		def counting_compare_array(eventlist_a, eventlist_b, ia, ib, *args):
+			coincident = compare_array(eventlist_a, eventlist_b, ia, ib, *args)
+			self.calls += len(ia)
+			self.passed += int(numpy.count_nonzero(coincident))
+			return coincident
+		return counting_compare_array
+
+
 #
 # =============================================================================
 #
@@ -90,6 +391,11 @@ class EventList(list):
 	class need to be overridden, indeed they probably should not be
 	unless you know what you're doing.
 	"""
+	# get_coincs() implementations can set this to the number of
+	# events in the time window they searched in the most recent call,
+	# for the benefit of instrumentation.  None means unknown
+	last_window = None
+
 	def __init__(self, instrument):
 		# the offset that should be added to the times of events in
 		# this list when comparing to the times of other events.
@@ -111,6 +417,17 @@ class EventList(list):
 		"""
 		pass
 
+	def merge(self, events):
+		"""
+		Add events to the list and update the index.  The default
+		implementation extends the list and calls .make_index().
+		Subclasses whose index is a sort order can override this to
+		merge the new events into place instead of re-sorting the
+		whole list;  the result must be the same.
+		"""
+		self.extend(events)
+		self.make_index()
+
 	def set_offset(self, offset):
 		"""
 		Set an offset on the times of all events in the list.
@@ -149,10 +466,202 @@ class EventList(list):
 
 		comparefunc is the function to use to compare events in
 		this list to event_a.
+
+		Implementations should set the .last_window attribute to
+		the number of events in the time window that was searched
+		(the number of candidates considered).
 		"""
 		raise NotImplementedError
 
 
+class ColumnarEventList(EventList):
+	"""
+	An EventList that, in addition to being a list of event objects,
+	maintains a copy of the event times (and of any other parameters
+	the comparison function needs) in contiguous numpy arrays.  This
+	allows get_doubles() to find coincidences between two such lists
+	with a handful of vectorized operations instead of one bisection
+	search per event.
+
+	Subclasses must override the event_time_ns() method and the
+	set_dt() method (see, e.g., the set_dt() method of the EventList
+	subclasses in ligolw_thinca).  Subclasses can override the
+	event_columns() method to record additional per-event parameters,
+	and the compare_candidates() method to apply a comparison function
+	to many candidate pairs at once.  The default .compare_candidates()
+	uses the comparison function's vectorized counterpart if it has
+	one (see ArrayComparefunc), and otherwise applies the comparison
+	function to each candidate pair in turn, so the output of
+	get_doubles() is identical to that obtained with the
+	bisection-based EventList implementations.
+
+	NOTE:  the events must not be modified after .make_index() has
+	been called, and .make_index() must be called again if events are
+	added to or removed from the list.
+	"""
+	# the number of events from the other list to process in a single
+	# vectorized pass.  sets the memory footprint of the candidate pair
+	# index arrays
+	blocksize = 1 << 16
+
+	def __init__(self, instrument):
+		super(ColumnarEventList, self).__init__(instrument)
+		# sorted integer nanosecond times of the events, and
+		# dictionary of additional per-event parameter arrays
+		self.times = numpy.empty((0,), dtype = "int64")
+		self.columns = {}
+		# the coincidence window half-width in integer nanoseconds
+		self.dt = 0
+
+	@staticmethod
+	def event_time_ns(event):
+		"""
+		Return the time of event as an integer count of
+		nanoseconds.  Must be overridden in a subclass.
+		"""
+		raise NotImplementedError
+
+	def event_columns(self, events = None):
+		"""
+		Return a dictionary mapping parameter name to a numpy array
+		of that parameter's values for the events in events, in
+		order, or for the events in this list if events is None.
+		The default implementation returns an empty dictionary.
+		"""
+		return {}
+
+	def set_dt(self, dt):
+		"""
+		Set the coincidence window half-width in seconds.  Must be
+		overridden in a subclass, and the subclass must store the
+		window in the .dt attribute as an integer count of
+		nanoseconds.
+		"""
+		raise NotImplementedError
+
+	def make_index(self):
+		"""
+		Sort the events by time and rebuild the time and parameter
+		arrays.
+		"""
+		self.sort(key = self.event_time_ns)
+		self.times = numpy.fromiter((self.event_time_ns(event) for event in self), dtype = "int64", count = len(self))
+		self.columns = self.event_columns()
+
+	def merge(self, events):
+		"""
+		Add events to the list, merging them into time order and
+		into the time and parameter arrays without re-sorting the
+		events already in the list.  The result is the same as
+		extending the list and calling .make_index().
+		"""
+		if type(self).make_index.__func__ is not ColumnarEventList.make_index.__func__:
+			# subclass maintains an index of its own
+			super(ColumnarEventList, self).merge(events)
+			return
+		events = sorted(events, key = self.event_time_ns)
+		if not events:
+			return
+		times = numpy.fromiter((self.event_time_ns(event) for event in events), dtype = "int64", count = len(events))
+		columns = self.event_columns(events)
+		if not len(self):
+			self.extend(events)
+			self.times = times
+			self.columns = columns
+			return
+		# the index of each new event in the merged list.  new
+		# events go after events already in the list with the same
+		# time, as they would in a stable sort
+		positions = self.times.searchsorted(times, side = "right") + numpy.arange(len(events))
+		is_new = numpy.zeros((len(self) + len(events),), dtype = "bool")
+		is_new[positions] = True
+		def merged(old, new):
+			result = numpy.empty((len(is_new),) + old.shape[1:], dtype = numpy.result_type(old, new))
+			result[~is_new] = old
+			result[is_new] = new
+			return result
+		# only the events after the first new one move
+		start = positions[0]
+		old = iter(self[start:])
+		new = iter(events)
+		self[start:] = [new.next() if flag else old.next() for flag in is_new[start:].tolist()]
+		self.times = merged(self.times, times)
+		self.columns = dict((name, merged(self.columns[name], columns[name])) for name in self.columns)
+
+	def compare_candidates(self, eventlist_a, ia, ib, light_travel_time, threshold, comparefunc):
+		"""
+		Given eventlist_a and two equal-length arrays of indexes,
+		ia into eventlist_a and ib into this list, identifying
+		candidate pairs of events, return an array of booleans that
+		is True for each pair that is coincident.  If comparefunc
+		has a vectorized counterpart (see ArrayComparefunc) it is
+		used, otherwise comparefunc() is called for each pair.
+		"""
+		compare_array = getattr(comparefunc, "compare_array", None)
+		if compare_array is not None:
+			return compare_array(eventlist_a, self, ia, ib, light_travel_time, threshold)
+		offset_a = eventlist_a.offset
+		offset_b = self.offset
+		return numpy.fromiter((not comparefunc(eventlist_a[i], offset_a, self[j], offset_b, light_travel_time, threshold) for i, j in itertools.izip(ia.tolist(), ib.tolist())), dtype = "bool", count = len(ia))
+
+	def get_coinc_indexes(self, eventlist_a, light_travel_time, threshold, comparefunc):
+		"""
+		Vectorized counterpart of the .get_coincs() method.
+		eventlist_a is another ColumnarEventList.  Generates a
+		sequence of pairs of index arrays, (ia, ib), each pair
+		identifying a block of coincident events, ia indexing
+		eventlist_a and ib indexing this list.  Within and across
+		blocks the pairs are ordered by ia then by ib, so the
+		sequence of pairs is the same as would be obtained by
+		calling .get_coincs() for each event in eventlist_a in
+		turn.
+		"""
+		shift = _offset_ns(eventlist_a.offset) - _offset_ns(self.offset)
+		for start in xrange(0, len(eventlist_a), self.blocksize):
+			t = eventlist_a.times[start : start + self.blocksize] + shift
+			lo = self.times.searchsorted(t - self.dt, side = "left")
+			hi = self.times.searchsorted(t + self.dt, side = "right")
+			ia, ib = _expand_ranges(lo, hi)
+			ia += start
+			candidates = len(ia)
+			if candidates:
+				coincident = self.compare_candidates(eventlist_a, ia, ib, light_travel_time, threshold, comparefunc)
+				ia = ia[coincident]
+				ib = ib[coincident]
+			if instrumentation is not None:
+				instrumentation.count("candidates", candidates)
+				instrumentation.count("passed", len(ia))
+				instrumentation.sample_array("window", hi - lo)
+			yield ia, ib
+
+	def get_coincs(self, event_a, offset_a, light_travel_time, threshold, comparefunc):
+		t = self.event_time_ns(event_a) + _offset_ns(offset_a) - _offset_ns(self.offset)
+		window = self[self.times.searchsorted(t - self.dt, side = "left"):self.times.searchsorted(t + self.dt, side = "right")]
+		self.last_window = len(window)
+		return [event_b for event_b in window if not comparefunc(event_a, offset_a, event_b, self.offset, light_travel_time, threshold)]
+
+
+def _offset_ns(offset):
+	"""
+	Convert a time offset to an integer count of nanoseconds.
+	"""
+	return lsctables.LIGOTimeGPS(offset).ns()
+
+
+def _expand_ranges(lo, hi):
+	"""
+	Given two equal-length integer arrays giving the bounds [lo, hi)
+	of ranges of indexes, return two arrays (i, j) enumerating the
+	pairs (i, j) for all j in range(lo[i], hi[i]), ordered by i then
+	j.
+	"""
+	counts = hi - lo
+	offsets = counts.cumsum() - counts
+	i = numpy.repeat(numpy.arange(len(counts)), counts)
+	j = numpy.arange(counts.sum()) + numpy.repeat(lo - offsets, counts)
+	return i, j
+
+
 class EventListDict(dict):
 	"""
 	A dictionary of EventList objects, indexed by instrument,
@@ -250,7 +759,12 @@ def get_doubles(eventlists, comparefunc, instruments, thresholds, verbose = Fals
 	dictionary for that pair of instruments.  The return value should
 	be 0 (False) if the events are coincident, and non-zero otherwise
 	(the behaviour of the comparison function is like a subtraction
-	operator, returning 0 when the two events are "the same").
+	operator, returning 0 when the two events are "the same").  The
+	comparison function must not modify the events:  the offsets are
+	to be applied to copies of the times (or accounted for
+	arithmetically), not by adjusting the events' times in place.
+	Event objects are shared by all offset vectors, and might be
+	examined by several threads at once.
 
 	The thresholds dictionary should look like
 
@@ -275,6 +789,16 @@ def get_doubles(eventlists, comparefunc, instruments, thresholds, verbose = Fals
 	NOTE:  the order of the events in each tuple returned by this
 	function is arbitrary, in particular it does not necessarily match
 	the order of the instruments sequence.
+
+	NOTE:  if both event lists are ColumnarEventList instances the
+	candidate pairs are identified with vectorized operations on the
+	lists' time arrays, otherwise the .get_coincs() method of the
+	longer list is called for each event in the shorter list.  The
+	sequence of pairs generated is the same in either case.
+
+	NOTE:  when instrumentation is on (see Instrumentation) and the
+	.get_coincs() method is used, the candidate counts are taken from
+	the .last_window attribute of the longer list.
 	"""
 	# retrieve the event lists for the requested instrument combination
 
@@ -299,19 +823,52 @@ def get_doubles(eventlists, comparefunc, instruments, thresholds, verbose = Fals
 		raise KeyError("no coincidence thresholds provided for instrument pair %s, %s" % e.args[0])
 	light_travel_time = inject.light_travel_time(eventlista.instrument, eventlistb.instrument)
 
-	# for each event in the shortest list
+	# if both lists provide columnar storage, find the coincident pairs
+	# in blocks using vectorized operations
 
-	for n, eventa in enumerate(eventlista):
-		if verbose and not (n % 2000):
-			print >>sys.stderr, "\t%.1f%%\r" % (100.0 * n / length),
+	if isinstance(eventlista, ColumnarEventList) and isinstance(eventlistb, ColumnarEventList):
+		n = 0
+		for ia, ib in eventlistb.get_coinc_indexes(eventlista, light_travel_time, threshold_data, comparefunc):
+			if verbose:
+				print >>sys.stderr, "\t%.1f%%\r" % (100.0 * n / length),
+			n += eventlistb.blocksize
+			for i, j in itertools.izip(ia.tolist(), ib.tolist()):
+				yield (eventlista[i], eventlistb[j])
+		if verbose:
+			print >>sys.stderr, "\t100.0%"
+		return
 
-		# iterate over events from the other list that are
-		# coincident with the event, and return the pairs
+	# for each event in the shortest list.  if instrumentation is on,
+	# record the size of the time window searched and the number of
+	# coincidences found for each event, and report them when done
 
-		for eventb in eventlistb.get_coincs(eventa, eventlista.offset, light_travel_time, threshold_data, comparefunc):
-			yield (eventa, eventb)
-	if verbose:
-		print >>sys.stderr, "\t100.0%"
+	registry = instrumentation
+	windows = [] if registry is not None else None
+	passed = 0
+	try:
+		for n, eventa in enumerate(eventlista):
+			if verbose and not (n % 2000):
+				print >>sys.stderr, "\t%.1f%%\r" % (100.0 * n / length),
+
+			# iterate over events from the other list that are
+			# coincident with the event, and return the pairs
+
+			coincs = eventlistb.get_coincs(eventa, eventlista.offset, light_travel_time, threshold_data, comparefunc)
+			if windows is not None:
+				windows.append(eventlistb.last_window)
+				passed += len(coincs)
+			for eventb in coincs:
+				yield (eventa, eventb)
+		if verbose:
+			print >>sys.stderr, "\t100.0%"
+	finally:
+		if registry is not None:
+			# windows are unknown (None) if the EventList
+			# implementation does not record them
+			windows = numpy.array([window for window in windows if window is not None], dtype = "int64")
+			registry.count("candidates", windows.sum().item())
+			registry.count("passed", passed)
+			registry.sample_array("window", windows)
 
 	# done
 
@@ -325,6 +882,90 @@ def get_doubles(eventlists, comparefunc, instruments, thresholds, verbose = Fals
 #
 
 
+def _void_rows(a):
+	"""
+	View each row of the two-dimensional array a as a single opaque
+	value so that rows can be sorted and searched for as a unit.
+	Equal rows have equal values, but the sort order is not numerical.
+	"""
+	a = numpy.ascontiguousarray(a)
+	return a.view(numpy.dtype((numpy.void, a.dtype.itemsize * a.shape[1]))).reshape((len(a),))
+
+
+def _join_rows(a, b):
+	"""
+	Sorted join of the rows of two two-dimensional integer arrays
+	having the same number of columns.  Returns two arrays of indexes,
+	(i, j), such that a[i[k]] == b[j[k]] for all k, enumerating all
+	such pairs, ordered by i then j.
+	"""
+	if not len(a) or not len(b):
+		return numpy.empty((0,), dtype = "intp"), numpy.empty((0,), dtype = "intp")
+	a = _void_rows(a)
+	b = _void_rows(b)
+	order = b.argsort(kind = "mergesort")
+	b = b[order]
+	i, j = _expand_ranges(b.searchsorted(a, side = "left"), b.searchsorted(a, side = "right"))
+	return i, order[j]
+
+
+def _rows_in(a, b):
+	"""
+	Return an array of booleans indicating which rows of the
+	two-dimensional integer array a are found in b.
+	"""
+	if not len(a) or not len(b):
+		return numpy.zeros((len(a),), dtype = "bool")
+	a = _void_rows(a)
+	b = numpy.sort(_void_rows(b))
+	i = b.searchsorted(a).clip(0, len(b) - 1)
+	return b[i] == a
+
+
+def _repeated_rows(a):
+	"""
+	Return the sorted array of the indexes of the first occurrences
+	of those rows of the two-dimensional integer array a that occur
+	more than once.
+	"""
+	rows, index, counts = numpy.unique(_void_rows(a), return_index = True, return_counts = True)
+	return numpy.sort(index[counts > 1])
+
+
+class CoincRetention(object):
+	"""
+	Bookkeeping of the coinc tuples held by the nodes of a
+	TimeSlideGraph.  Nodes with a single component share their
+	component's tuple, so tuples are tracked by identity and each is
+	counted once regardless of how many nodes hold it.  .count is the
+	number of event ID tuples (pairs, for the two-instrument offset
+	vectors) currently retained, and .peak is the largest value .count
+	has had.
+	"""
+	def __init__(self):
+		self.held = {}
+		self.count = 0
+		self.peak = 0
+
+	def retain(self, coincs):
+		try:
+			self.held[id(coincs)][1] += 1
+		except KeyError:
+			# record the length, not the object, so that the
+			# bookkeeping does not keep the tuple alive.  the
+			# id cannot be reused while a node holds the tuple
+			self.held[id(coincs)] = [len(coincs), 1]
+			self.count += len(coincs)
+			self.peak = max(self.peak, self.count)
+
+	def release(self, coincs):
+		entry = self.held[id(coincs)]
+		entry[1] -= 1
+		if not entry[1]:
+			del self.held[id(coincs)]
+			self.count -= entry[0]
+
+
 class TimeSlideGraphNode(object):
 	def __init__(self, offset_vector, time_slide_id = None):
 		self.time_slide_id = time_slide_id
@@ -332,12 +973,81 @@ class TimeSlideGraphNode(object):
 		self.deltas = frozenset(offset_vector.deltas.items())
 		self.components = None
 		self.coincs = None
-		self.unused_coincs = set()
+		# the coincs from the smaller offset vectors below this one
+		# in the graph that were not used to construct this node's
+		# coincs.  a dictionary mapping the alphabetically-sorted
+		# tuple of instruments involved in the coincs to an
+		# (integer event IDs, coincs) tuple like .coinc_ids and
+		# .coincs
+		self.unused = {}
+		# the number of nodes that use this one as a component and
+		# have not yet been constructed, and whether or not the
+		# results have been discarded
+		self.dependents = 0
+		self.released = False
+		# the coincs encoded as an array of integer event IDs.
+		# computed on demand for the leaf nodes, and as part of the
+		# assembly for the others
+		self.coinc_ids = None
 
 	def name(self):
 		return self.offset_vector.__str__(compact = True)
 
-	def get_coincs(self, eventlists, event_comparefunc, thresholds, verbose = False):
+	@property
+	def unused_coincs(self):
+		"""
+		An iterator over the coincs from the smaller offset vectors
+		below this one in the graph that were not used to construct
+		this node's coincs.
+		"""
+		return itertools.chain(*(coincs for instruments, (ids, coincs) in sorted(self.unused.items())))
+
+	def release(self, retention = None):
+		"""
+		Discard the coincs.  The node cannot be evaluated again.
+		"""
+		if retention is not None and self.coincs is not None:
+			retention.release(self.coincs)
+		self.coincs = None
+		self.coinc_ids = None
+		self.unused = None
+		self.released = True
+
+	def dependent_done(self, retention = None, stream = False):
+		"""
+		Called by a node that uses this one as a component when it
+		has finished constructing its own coincs.  In streaming
+		mode, when the last such node is done this node's coincs
+		are discarded.
+		"""
+		self.dependents -= 1
+		if stream and not self.dependents:
+			self.release(retention)
+
+	def get_coinc_ids(self, eventlists, event_comparefunc, thresholds, verbose = False, retention = None, stream = False):
+		"""
+		Return the coincs encoded as an array of integer event IDs,
+		one row per coinc, constructing the coincs if needed.  The
+		array is computed once and retained with the coincs.  Only
+		the leaf nodes need to convert the event IDs, the array for
+		any other node is built from those of its components.
+		"""
+		if self.coinc_ids is None:
+			coincs = self.get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose, retention = retention, stream = stream)
+			self.coinc_ids = numpy.fromiter((int(event_id) for coinc in coincs for event_id in coinc), dtype = "int64", count = len(coincs) * len(self.offset_vector)).reshape((len(coincs), len(self.offset_vector)))
+		return self.coinc_ids
+
+	def get_coincs(self, eventlists, event_comparefunc, thresholds, verbose = False, retention = None, stream = False):
+		"""
+		Construct and return the coincs for this node's offset
+		vector.  If retention is not None it is a CoincRetention
+		object with which to record the coincs retained by the
+		graph's nodes.  If stream is True, the coincs of the
+		component nodes are discarded as soon as all nodes that
+		depend on them have been constructed.
+		"""
+		assert not self.released, "coincs for %s have been discarded" % str(self.offset_vector)
+
 		#
 		# has this node already been visited?  if so, return the
 		# answer we already know
@@ -385,6 +1095,8 @@ class TimeSlideGraphNode(object):
 
 			if verbose:
 				print >>sys.stderr, "\tsearching ..."
+			if instrumentation is not None:
+				t_start = time.time()
 			# FIXME:  assumes the instrument column is named
 			# "ifo".  works for inspirals, bursts, and
 			# ring-downs.  note that the event order in each
@@ -392,6 +1104,13 @@ class TimeSlideGraphNode(object):
 			# we need to sort each tuple by instrument name
 			# explicitly
 			self.coincs = tuple(sorted((a.event_id, b.event_id) if a.ifo <= b.ifo else (b.event_id, a.event_id) for (a, b) in get_doubles(eventlists, event_comparefunc, offset_instruments, thresholds, verbose = verbose)))
+			if instrumentation is not None:
+				elapsed = time.time() - t_start
+				instrumentation.add_time("leaf", elapsed)
+				instrumentation.add_time("leaf %s" % self.name(), elapsed)
+				instrumentation.count("coincs", len(self.coincs))
+			if retention is not None:
+				retention.retain(self.coincs)
 			return self.coincs
 
 		#
@@ -402,14 +1121,18 @@ class TimeSlideGraphNode(object):
 		if len(self.components) == 1:
 			if verbose:
 				print >>sys.stderr, "\tgetting coincs from %s ..." % str(self.components[0].offset_vector)
-			self.coincs = self.components[0].get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose)
-			self.unused_coincs = self.components[0].unused_coincs
+			self.coincs = self.components[0].get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose, retention = retention, stream = stream)
+			self.coinc_ids = self.components[0].coinc_ids
+			self.unused = self.components[0].unused
+			if retention is not None:
+				retention.retain(self.coincs)
 
 			#
 			# done.  unlink the graph as we go to release
 			# memory
 			#
 
+			self.components[0].dependent_done(retention, stream)
 			self.components = None
 			return self.coincs
 
@@ -424,101 +1147,98 @@ class TimeSlideGraphNode(object):
 		# synthesis algorithm to populate its coincs
 		#
 
-		self.coincs = []
-
-		# all coincs with n-1 instruments from the component time
-		# slides are potentially unused.  they all go in, we'll
-		# remove things from this set as we use them
 		# NOTE:  this function call is the recursion into the
 		# components to ensure they are initialized, it must be
 		# executed before any of what follows
 		for component in self.components:
-			self.unused_coincs |= set(component.get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose))
-		# of the (< n-1)-instrument coincs that were not used in
-		# forming the (n-1)-instrument coincs, any that remained
-		# unused after forming two compontents cannot have been
-		# used by any other components, they definitely won't be
-		# used to construct our n-instrument coincs, and so they go
-		# into our unused pile
-		for componenta, componentb in iterutils.choices(self.components, 2):
-			self.unused_coincs |= componenta.unused_coincs & componentb.unused_coincs
+			component.get_coincs(eventlists, event_comparefunc, thresholds, verbose = verbose, retention = retention, stream = stream)
 
 		if verbose:
 			print >>sys.stderr, "\tassembling %s ..." % str(self.offset_vector)
+		if instrumentation is not None:
+			t_start = time.time()
 		# magic:  we can form all n-instrument coincs by knowing
 		# just three sets of the (n-1)-instrument coincs no matter
-		# what n is (n > 2).  note that we pass verbose=False
-		# because we've already called the .get_coincs() methods
-		# above, these are no-ops to retrieve the answers again
-		allcoincs0 = self.components[0].get_coincs(eventlists, event_comparefunc, thresholds, verbose = False)
-		allcoincs1 = self.components[1].get_coincs(eventlists, event_comparefunc, thresholds, verbose = False)
-		allcoincs2 = self.components[-1].get_coincs(eventlists, event_comparefunc, thresholds, verbose = False)
-		# for each coinc in list 0
-		length = len(allcoincs0)
-		for n, coinc0 in enumerate(allcoincs0):
-			if verbose and not (n % 200):
-				print >>sys.stderr, "\t%.1f%%\r" % (100.0 * n / length),
-			# find all the coincs in list 1 whose first (n-2)
-			# event IDs are the same as the first (n-2) event
-			# IDs in coinc0.  note that they are guaranteed to
-			# be arranged together in the list of coincs and
-			# can be identified with two bisection searches
-			# note:  cannot use bisect_right() because we're
-			# only comparing against the first (n-2) of (n-1)
-			# things in each tuple, we need to use bisect_left
-			# after incrementing the last of the (n-2) things
-			# by one to obtain the correct range of indexes
-			coincs1 = allcoincs1[bisect.bisect_left(allcoincs1, coinc0[:-1]):bisect.bisect_left(allcoincs1, coinc0[:-2] + (coinc0[-2] + 1,))]
-			# find all the coincs in list 2 whose first (n-2)
-			# event IDs are the same as the last (n-2) event
-			# IDs in coinc0.  note that they are guaranteed to
-			# be arranged together in the list and can be
-			# identified with two bisection searches
-			coincs2 = allcoincs2[bisect.bisect_left(allcoincs2, coinc0[1:]):bisect.bisect_left(allcoincs2, coinc0[1:-1] + (coinc0[-1] + 1,))]
-			# for each coinc extracted from list 1 above search
-			# for a coinc extracted from list 2 above whose
-			# first (n-2) event IDs are the last (n-2) event
-			# IDs in coinc 0 and whose last event ID is the
-			# last event ID in coinc 1.  when found, the first
-			# ID from coinc 0 prepended to the (n-1) coinc IDs
-			# from coinc 2 forms an n-instrument coinc.  how
-			# this works is as follows:  coinc 0 and coinc 1,
-			# both (n-1)-instrument coincs, together identify a
-			# unique potential n-instrument coinc.  coinc 2's
-			# role is to confirm the coincidence by showing
-			# that the event from the instrument in coinc 1
-			# that isn't found in coinc 0 is coincident with
-			# all the other events that are in coinc 1.  if the
-			# coincidence holds then that combination of event
-			# IDs must be found in the coincs2 list, because we
-			# assume the coincs2 list is complete  the
-			# bisection search above to extract the coincs2
-			# list could be skipped, but by starting with a
-			# shorter list the bisection searches inside the
-			# following loop are faster.
-			for coinc1 in coincs1:
-				i = bisect.bisect_left(coincs2, coinc0[1:] + coinc1[-1:])
-				if i < len(coincs2) and coincs2[i] == coinc0[1:] + coinc1[-1:]:
-					new_coinc = coinc0[:1] + coincs2[i]
-					# break the new coinc into
-					# (n-1)-instrument components and
-					# remove them from the unused list
-					# because we just used them, then
-					# record the coinc and move on
-					self.unused_coincs -= set(iterutils.choices(new_coinc, len(new_coinc) - 1))
-					self.coincs.append(new_coinc)
+		# what n is (n > 2).  the .get_coincs() methods of the
+		# components have been called above, so the answers are
+		# already known
+		# the coincs are encoded as arrays of integer event IDs
+		# for the assembly
+		ids0 = self.components[0].get_coinc_ids(eventlists, event_comparefunc, thresholds)
+		ids1 = self.components[1].get_coinc_ids(eventlists, event_comparefunc, thresholds)
+		ids2 = self.components[-1].get_coinc_ids(eventlists, event_comparefunc, thresholds)
+		# find all pairs of coincs, coinc0 from list 0 and coinc1
+		# from list 1, whose first (n-2) event IDs are the same.
+		# coinc 0 and coinc 1, both (n-1)-instrument coincs,
+		# together identify a unique potential n-instrument coinc.
+		# the pairs are found with a sorted join on the (n-2) ID
+		# prefixes
+		i0, i1 = _join_rows(ids0[:, :-1], ids1[:, :-1])
+		# the role of list 2 is to confirm the coincidence by
+		# showing that the event from the instrument in coinc 1
+		# that isn't found in coinc 0 is coincident with all the
+		# other events that are in coinc 1.  if the coincidence
+		# holds then the last (n-2) event IDs of coinc 0 followed
+		# by the last event ID of coinc 1 must be found in list 2,
+		# because we assume list 2 is complete.
+		confirmed = _rows_in(numpy.hstack((ids0[i0, 1:], ids1[i1, -1:])), ids2)
+		i0 = i0[confirmed]
+		i1 = i1[confirmed]
+		# when confirmed, coinc 0 followed by the last ID from
+		# coinc 1 forms an n-instrument coinc.  sort the coincs by
+		# the component event IDs (the integer event IDs sort the
+		# same way as the IDs themselves) and convert to a tuple
+		# for speed
+		self.coinc_ids = numpy.hstack((ids0[i0], ids1[i1, -1:]))
+		order = numpy.lexsort(self.coinc_ids.T[::-1])
+		self.coinc_ids = self.coinc_ids[order]
+		allcoincs0 = self.components[0].coincs
+		allcoincs1 = self.components[1].coincs
+		self.coincs = tuple(allcoincs0[i] + allcoincs1[j][-1:] for i, j in itertools.izip(i0[order].tolist(), i1[order].tolist()))
 		if verbose:
-			print >>sys.stderr, "\t100.0%"
-		# sort the coincs we just constructed by the component
-		# event IDs and convert to a tuple for speed
-		self.coincs.sort()
-		self.coincs = tuple(self.coincs)
+			print >>sys.stderr, "\t%d coincs" % len(self.coincs)
+
+		# each component's coincs are the new coincs with one
+		# instrument's event removed.  those not found among the
+		# new coincs are unused.  the unused coincs are copied so
+		# that the component nodes can be released
+		instruments = sorted(self.offset_vector)
+		for component in self.components:
+			missing, = set(self.offset_vector) - set(component.offset_vector)
+			ids = component.get_coinc_ids(eventlists, event_comparefunc, thresholds)
+			unused = ~_rows_in(ids, numpy.delete(self.coinc_ids, instruments.index(missing), axis = 1))
+			self.unused[tuple(sorted(component.offset_vector))] = ids[unused], tuple(itertools.compress(component.coincs, unused))
+		# of the (< n-1)-instrument coincs that were not used in
+		# forming the (n-1)-instrument coincs, any that remained
+		# unused after forming two compontents cannot have been
+		# used by any other components, they definitely won't be
+		# used to construct our n-instrument coincs, and so they go
+		# into our unused pile.  the smaller coincs involving a
+		# given set of instruments come from a single node, so the
+		# union of the pairwise intersections of the components'
+		# unused coincs is the set of those found in the unused
+		# coincs of more than one component
+		for key in set(key for component in self.components for key in component.unused):
+			components_unused = [component.unused[key] for component in self.components if key in component.unused]
+			if len(components_unused) < 2:
+				continue
+			ids = numpy.concatenate([ids for ids, coincs in components_unused])
+			repeated = numpy.zeros((len(ids),), dtype = "bool")
+			repeated[_repeated_rows(ids)] = True
+			self.unused[key] = ids[repeated], tuple(itertools.compress(itertools.chain(*(coincs for ids, coincs in components_unused)), repeated))
+		if instrumentation is not None:
+			instrumentation.add_time("assembly", time.time() - t_start)
+			instrumentation.count("coincs", len(self.coincs))
+		if retention is not None:
+			retention.retain(self.coincs)
 
 		#
 		# done.  we won't be back here again so unlink the graph as
 		# we go to release memory
 		#
 
+		for component in self.components:
+			component.dependent_done(retention, stream)
 		self.components = None
 		return self.coincs
 
@@ -591,6 +1311,7 @@ class TimeSlideGraph(object):
 
 			node.components = tuple(sorted((component for component in self.generations[len(node.offset_vector)] if node.deltas == component.deltas), key = lambda x: sorted(x.offset_vector)))
 			assert len(node.components) == 1
+			node.components[0].dependents += 1
 
 		for n, nodes in self.generations.items():
 			assert n >= 2	# failure indicates bug in code that constructed generations
@@ -600,6 +1321,17 @@ class TimeSlideGraph(object):
 			for node in nodes:
 				component_deltas = set(frozenset(offset_vector.deltas.items()) for offset_vector in offsetvector.component_offsetvectors([node.offset_vector], n - 1))
 				node.components = tuple(sorted((component for component in self.generations[n - 1] if component.deltas in component_deltas), key = lambda x: sorted(x.offset_vector)))
+				for component in node.components:
+					component.dependents += 1
+
+		#
+		# record the linkage so that the graph can be reset after
+		# use, and set up the bookkeeping of the coincs held by the
+		# nodes
+		#
+
+		self.links = tuple((node, node.components, node.dependents) for node in itertools.chain(self.head, *self.generations.values()))
+		self.retention = CoincRetention()
 
 		#
 		# done
@@ -612,7 +1344,114 @@ class TimeSlideGraph(object):
 			print >>sys.stderr, "\t%d offset vectors total" % sum(len(self.generations[n]) for n in self.generations)
 
 
-	def get_coincs(self, eventlists, event_comparefunc, thresholds, include_small_coincs = True, verbose = False):
+	def reset(self):
+		"""
+		Discard all coincs and restore the graph's linkage so that
+		it can be used to construct coincs again, e.g., from a new
+		set of event lists.  The cost does not depend on the number
+		of coincs that have been constructed.
+		"""
+		for node, components, dependents in self.links:
+			node.components = components
+			node.dependents = dependents
+			node.coincs = None
+			node.coinc_ids = None
+			node.unused = {}
+			node.released = False
+		self.retention = CoincRetention()
+
+	@property
+	def peak_retained_coincs(self):
+		"""
+		The largest number of event ID tuples (pairs, for the
+		two-instrument offset vectors) held by the graph's nodes at
+		any one time so far.  Use this to estimate the memory
+		required by a job.
+		"""
+		return self.retention.peak
+
+	def get_leaf_coincs(self, eventlists, event_comparefunc, thresholds, nproc, verbose = False):
+		"""
+		Construct the coincs for the leaf nodes (the
+		two-instrument offset vectors) of the graph using a pool of
+		nproc worker processes.  The workers are forked from this
+		process so each has its own copy of the event lists on
+		which to set the offsets;  the event lists of the calling
+		process are not modified.  The results are identical to
+		those obtained by evaluating the leaf nodes one-by-one.
+		Leaf nodes whose coincs are already known, and leaf nodes
+		requiring instruments for which there are no event lists,
+		are skipped (the latter are handled by the serial code
+		path).
+		"""
+		global _leaf_worker_state
+		avail_instruments = set(eventlists)
+		leaves = [node for node in self.generations.get(2, ()) if node.coincs is None and set(node.offset_vector).issubset(avail_instruments)]
+		if not leaves:
+			return
+		if verbose:
+			print >>sys.stderr, "constructing %d two-instrument offset vectors using %d processes ..." % (len(leaves), nproc)
+
+		# the worker processes inherit the event lists, etc., when
+		# the pool is created, so these must be in place before
+		# then
+		_leaf_worker_state = (eventlists, event_comparefunc, thresholds, [node.offset_vector for node in leaves], {})
+		# the integer event IDs of the events in each list, from
+		# which those of the coincs are obtained by indexing
+		event_ids = dict((instrument, numpy.fromiter((int(event.event_id) for event in eventlists[instrument]), dtype = "int64", count = len(eventlists[instrument]))) for instrument in set(instrument for node in leaves for instrument in node.offset_vector))
+		pool = multiprocessing.Pool(nproc)
+		try:
+			for n, (node, (pairs, registry)) in enumerate(itertools.izip(leaves, pool.imap(_get_leaf_coinc_indexes, xrange(len(leaves))))):
+				if verbose:
+					print >>sys.stderr, "\t%d/%d: %s\r" % (n + 1, len(leaves), str(node.offset_vector)),
+				# pairs is an array of the list indexes of
+				# the events, ordered alphabetically by
+				# instrument name.  convert to event ID
+				# pairs and sort
+				instrumenta, instrumentb = sorted(node.offset_vector)
+				node.coinc_ids = numpy.column_stack((event_ids[instrumenta][pairs[:, 0]], event_ids[instrumentb][pairs[:, 1]]))
+				order = numpy.lexsort(node.coinc_ids.T[::-1])
+				node.coinc_ids = node.coinc_ids[order]
+				eventlista, eventlistb = eventlists[instrumenta], eventlists[instrumentb]
+				node.coincs = tuple((eventlista[i].event_id, eventlistb[j].event_id) for i, j in pairs[order].tolist())
+				self.retention.retain(node.coincs)
+				if registry is not None:
+					instrumentation.merge(registry)
+			pool.close()
+		except:
+			pool.terminate()
+			raise
+		finally:
+			pool.join()
+			_leaf_worker_state = None
+		if verbose:
+			print >>sys.stderr
+
+	def get_coincs(self, eventlists, event_comparefunc, thresholds, include_small_coincs = True, nproc = 1, stream = False, verbose = False):
+		"""
+		Generate a sequence of (node, coinc) tuples, one for every
+		coinc constructed for each of the target offset vectors
+		(head nodes) in the graph.  If nproc is greater than 1, the
+		two-instrument offset vectors are constructed in parallel
+		by a pool of that many worker processes before the
+		higher-order offset vectors are assembled (see
+		.get_leaf_coincs()).
+
+		If stream is True, the coincs of each node are discarded as
+		soon as every node that depends on them has been
+		constructed, and the coincs of each head node are
+		discarded once they have been generated, bounding the
+		memory required to the coincs needed to construct the
+		remaining head nodes.  The sequence generated is the same
+		but the graph cannot be used again afterwards.  In either
+		mode, the .peak_retained_coincs attribute reports the
+		largest number of coincs held by the graph at one time.
+		NOTE:  in parallel mode all two-instrument offset vectors
+		are constructed, and retained, before any higher-order
+		offset vectors are assembled.
+		"""
+		if nproc > 1:
+			self.get_leaf_coincs(eventlists, event_comparefunc, thresholds, nproc, verbose = verbose)
 		if verbose:
 			print >>sys.stderr, "constructing coincs for target offset vectors ..."
 		for n, node in enumerate(self.head, start = 1):
@@ -623,11 +1462,15 @@ class TimeSlideGraph(object):
 				# after the call to .get_coincs() because
 				# the former is computed as a side effect
 				# of the latter
-				iterator = itertools.chain(node.get_coincs(eventlists, event_comparefunc, thresholds, verbose), node.unused_coincs)
+				iterator = itertools.chain(node.get_coincs(eventlists, event_comparefunc, thresholds, verbose, retention = self.retention, stream = stream), node.unused_coincs)
 			else:
-				iterator = node.get_coincs(eventlists, event_comparefunc, thresholds, verbose)
+				iterator = node.get_coincs(eventlists, event_comparefunc, thresholds, verbose, retention = self.retention, stream = stream)
 			for coinc in iterator:
 				yield node, coinc
+			if stream:
+				node.release(self.retention)
+		if verbose:
+			print >>sys.stderr, "peak number of coincs retained:  %d" % self.peak_retained_coincs
 
 
 	def write(self, fileobj):
@@ -648,6 +1491,57 @@ class TimeSlideGraph(object):
 		print >>fileobj, "}"
 
 
+#
+# worker process code for TimeSlideGraph.get_leaf_coincs().  the state is
+# placed in a module global by the parent before the pool of workers is
+# forked
+#
+
+
+_leaf_worker_state = None
+
+
+def _get_leaf_coinc_indexes(n):
+	"""
+	Construct the coincs for the n-th leaf offset vector recorded in
+	the worker state.  Returns an array of pairs of indexes into the
+	two event lists, ordered alphabetically by instrument name, and,
+	if instrumentation is on, an Instrumentation object recording the
+	work done (None otherwise).
+	"""
+	global instrumentation
+	eventlists, event_comparefunc, thresholds, offset_vectors, index = _leaf_worker_state
+	if instrumentation is not None:
+		# each task reports only its own numbers
+		instrumentation = Instrumentation(callbacks = instrumentation.callbacks)
+		t_start = time.time()
+	offset_vector = offset_vectors[n]
+	instruments = sorted(offset_vector)
+	# map each event to its position in its list.  the lists are not
+	# modified in the worker so the map is computed once per list
+	for instrument in instruments:
+		if instrument not in index:
+			index[instrument] = dict((id(event), i) for i, event in enumerate(eventlists[instrument]))
+	indexa, indexb = (index[instrument] for instrument in instruments)
+	eventlists.offsetvector = offset_vector
+	pairs = []
+	for a, b in get_doubles(eventlists, event_comparefunc, instruments, thresholds):
+		if a.ifo > b.ifo:
+			a, b = b, a
+		pairs.append((indexa[id(a)], indexb[id(b)]))
+	registry = None
+	if instrumentation is not None:
+		elapsed = time.time() - t_start
+		instrumentation.add_time("leaf", elapsed)
+		instrumentation.add_time("leaf %s" % offset_vector.__str__(compact = True), elapsed)
+		instrumentation.count("coincs", len(pairs))
+		# return a copy without the callbacks, they might not be
+		# picklable
+		registry = Instrumentation()
+		registry.merge(instrumentation)
+	return numpy.array(pairs, dtype = "int64").reshape((len(pairs), 2)), registry
+
+
 #
 # =============================================================================
 #
@@ -723,6 +1617,42 @@ class CoincTables(object):
 			self.coincmaptable.append(coincmap)
 		return coinc
 
+	def append_coincs(self, process_id, time_slide_id, coinc_def_id, coincs):
+		"""
+		Bulk version of .append_coinc().  coincs is a sequence of
+		tuples of events, all from the time slide identified by
+		time_slide_id.  The coinc_event and coinc_event_map rows
+		are identical to those that would be constructed by calling
+		.append_coinc() for each coinc in turn, but are added to
+		the tables together.  Returns a list of the new coinc_event
+		rows, in the order of coincs.
+
+		Subclasses that wish to override this method should first
+		chain to this method to construct and initialize the
+		coinc_event and coinc_event_map rows.
+		"""
+		coinc_rows = []
+		coincmap_rows = []
+		for events in coincs:
+			coinc = self.coinctable.RowType()
+			coinc.process_id = process_id
+			coinc.coinc_def_id = coinc_def_id
+			coinc.coinc_event_id = self.coinctable.get_next_id()
+			coinc.time_slide_id = time_slide_id
+			coinc.set_instruments(None)
+			coinc.nevents = len(events)
+			coinc.likelihood = None
+			coinc_rows.append(coinc)
+			for event in events:
+				coincmap = self.coincmaptable.RowType()
+				coincmap.coinc_event_id = coinc.coinc_event_id
+				coincmap.table_name = event.event_id.table_name
+				coincmap.event_id = event.event_id
+				coincmap_rows.append(coincmap)
+		self.coinctable.extend(coinc_rows)
+		self.coincmaptable.extend(coincmap_rows)
+		return coinc_rows
+
 
 #
 # =============================================================================
@@ -741,7 +1671,7 @@ class CoincSynthesizer(object):
 	rates related to the problem of doing so.
 	"""
 
-	def __init__(self, eventlists = None, segmentlists = None, delta_t = None, abundance_rel_accuracy = 1e-4):
+	def __init__(self, eventlists = None, segmentlists = None, delta_t = None, abundance_rel_accuracy = 1e-4, random_state = None):
 		"""
 		eventlists is either a dictionary mapping instrument name
 		to a list of the events (arbitrary objects) seen in that
@@ -760,6 +1690,15 @@ class CoincSynthesizer(object):
 		in the Monte Carlo integrator used to estimate the relative
 		abundances of the different kinds of coincs.
 
+		random_state is the source of all of the random numbers
+		drawn by this object:  an integer seed, a
+		numpy.random.RandomState instance, or None (the default) to
+		use numpy's global random number generator (see
+		numpy.random.seed()).  NOTE:  the random numbers are drawn
+		with numpy, not Python's random module, so random.seed()
+		does not make the results reproducible.  Pass a seed or a
+		RandomState to do that.
+
 		Example:
 
 		>>> from glue.segments import *
@@ -782,6 +1721,27 @@ class CoincSynthesizer(object):
 		assert set(self.eventlists) <= set(self.segmentlists)
 		self.abundance_rel_accuracy = abundance_rel_accuracy
 
+		# the number of random draws made by the array methods in
+		# a single vectorized pass
+		self.blocksize = 1 << 14
+
+		if random_state is None:
+			self.random_state = numpy.random
+		elif isinstance(random_state, numpy.random.RandomState):
+			self.random_state = random_state
+		else:
+			self.random_state = numpy.random.RandomState(random_state)
+
+		# the number of trial time-of-arrival vectors drawn by the
+		# array methods, and the number accepted, for each tuple of
+		# instruments, and the number of trial event tuples drawn
+		# and accepted for each instrument combination (as a
+		# frozenset)
+		self.toa_draws = {}
+		self.toa_accepted = {}
+		self.coinc_draws = {}
+		self.coinc_accepted = {}
+
 		self.verbose = False	# turn on for diagnostics
 
 
@@ -813,6 +1773,36 @@ class CoincSynthesizer(object):
 			del self._rates
 		except AttributeError:
 			pass
+		try:
+			del self._event_times
+		except AttributeError:
+			pass
+		for counts in (self.toa_draws, self.toa_accepted, self.coinc_draws, self.coinc_accepted):
+			counts.clear()
+
+
+	@property
+	def toa_acceptance_rate(self):
+		"""
+		Dictionary mapping tuple of instruments to the fraction of
+		the trial time-of-arrival vectors drawn for them by
+		.plausible_toas_array() (and .plausible_toas()) that have
+		been found to be mutually coincident.  Tuples for which
+		none have been drawn are not included.
+		"""
+		return dict((instruments, float(self.toa_accepted[instruments]) / draws) for instruments, draws in self.toa_draws.items() if draws)
+
+
+	@property
+	def coinc_acceptance_rate(self):
+		"""
+		Dictionary mapping instrument combination (as a frozenset)
+		to the fraction of the random event tuples drawn for it by
+		.coinc_index_array() (and .coincs()) that have passed the
+		zero-lag test.  Combinations for which none have been drawn
+		are not included.
+		"""
+		return dict((instruments, float(self.coinc_accepted[instruments]) / draws) for instruments, draws in self.coinc_draws.items() if draws)
 
 
 	@property
@@ -1006,21 +1996,25 @@ class CoincSynthesizer(object):
 		# desired accuracy, but that choice creates a rather strong
 		# bias that, to overcome, requires some extra hacks to
 		# force the loop to run for additional iterations.  this
-		# approach is cleaner.
-					math_sqrt = math.sqrt
-					random_uniform = random.uniform
+		# approach is cleaner.  the trials are drawn in blocks, and
+		# the running totals after each trial in the block are
+		# tested against the exit criterion so that the loop stops
+		# after the same trial it would if the trials were drawn
+		# one at a time.
+					lo, hi = numpy.array(windows, dtype = "double").T
 					epsilon = self.abundance_rel_accuracy
+					trials = numpy.arange(1, self.blocksize + 1)
 					n, d = 0, 0
-					while math_sqrt(d) >= epsilon * n:
-						dt = tuple(random_uniform(*window) for window in windows)
-						if all(abs(dt[i] - dt[j]) <= maxdt for i, j, maxdt in ijseq):
-		# instead of adding 1 here and multiplying n by 2 in the
-		# loop exit test, we increment n by 2 and then fix it
-		# afterwards.
-							n += 2
-						d += 1
-		# fix n (see above)
-					n //= 2
+					while math.sqrt(d) >= 2. * epsilon * n:
+						dt = self.random_state.uniform(lo, hi, (self.blocksize, len(windows)))
+						accept = numpy.ones((self.blocksize,), dtype = "bool")
+						for i, j, maxdt in ijseq:
+							accept &= abs(dt[:, i] - dt[:, j]) <= maxdt
+						nn = n + accept.cumsum()
+						dd = d + trials
+						done, = (numpy.sqrt(dd) < 2. * epsilon * nn).nonzero()
+						k = done[0] if len(done) else -1
+						n, d = int(nn[k]), int(dd[k])
 
 					rate *= float(n) / float(d)
 					if self.verbose:
@@ -1132,6 +2126,29 @@ class CoincSynthesizer(object):
 		>>> combos = coinc_synth.instrument_combos()
 		>>> combos.next()	# returns a frozenset of instruments
 		"""
+		cumulative, combos = self._instrument_combo_cdf()
+		if not combos:
+			return
+
+		#
+		# generate random instrument combos
+		#
+
+		random_uniform = self.random_state.uniform
+		while 1:	# 1 is immutable, so faster than True
+			yield combos[cumulative.searchsorted(random_uniform(0.0, 1.0), side = "left")]
+
+
+	def _instrument_combo_cdf(self):
+		"""
+		Return an array of cumulative probabilities and a tuple of
+		the corresponding instrument combos (as frozensets) for
+		drawing random instrument combos:  combo k is selected if a
+		random number uniformly distributed in [0, 1] is in
+		(cumulative[k-1], cumulative[k]].  Combos whose probability
+		is 0 are not included.  If no combos remain, the array and
+		tuple are empty.
+		"""
 		#
 		# retrieve sorted tuple of (probability mass, instrument
 		# combo) pairs.  remove instrument combos whose probability
@@ -1141,7 +2158,7 @@ class CoincSynthesizer(object):
 
 		P = tuple(sorted([mass, instruments] for instruments, mass in self.P_instrument_combo.items() if mass != 0))
 		if not P:
-			return
+			return numpy.empty((0,), dtype = "double"), ()
 
 		#
 		# replace the probability masses with cummulative probabilities
@@ -1159,12 +2176,141 @@ class CoincSynthesizer(object):
 			P[i][0] /= P[-1][0]
 		assert P[-1][0] == 1.0
 
-		#
-		# generate random instrument combos
-		#
+		return numpy.array([cumulative for cumulative, instruments in P], dtype = "double"), tuple(instruments for cumulative, instruments in P)
 
-		while 1:	# 1 is immutable, so faster than True
-			yield P[bisect.bisect_left(P, [random.uniform(0.0, 1.0)])][1]
+
+	def event_times(self, timefunc):
+		"""
+		Return a dictionary mapping instrument name to an array of
+		the times, as computed by timefunc, of the events in
+		self.eventlists, as floats relative to an arbitrary common
+		origin (so that the differences are accurate even for GPS
+		times).  The arrays are cached until .reset() is invoked or
+		a different timefunc is provided.
+		"""
+		try:
+			cached_timefunc, times = self._event_times
+		except AttributeError:
+			pass
+		else:
+			if cached_timefunc is timefunc:
+				return times
+		origin = None
+		times = {}
+		for instrument, events in self.eventlists.items():
+			t = [timefunc(event) for event in events]
+			if origin is None and t:
+				origin = t[0]
+			times[instrument] = numpy.array([float(x - origin) for x in t], dtype = "double")
+		self._event_times = timefunc, times
+		return times
+
+
+	def _coinc_index_block(self, n, cumulative, combos, timefunc, allow_zero_lag):
+		"""
+		Draw n random event tuples and return the instrument combo
+		indexes and the event index array (see .coinc_index_array())
+		of those that pass the zero-lag test.
+		"""
+		instruments = self.coinc_instruments
+		membership = numpy.array([[instrument in combo for instrument in instruments] for combo in combos], dtype = "bool")
+
+		# random instrument combos
+		combo_indexes = drawn = cumulative.searchsorted(self.random_state.uniform(0.0, 1.0, n), side = "left")
+		members = membership[combo_indexes]
+
+		# random events from those instruments
+		indexes = numpy.empty((n, len(instruments)), dtype = "int64")
+		indexes.fill(-1)
+		for k, instrument in enumerate(instruments):
+			rows = members[:, k]
+			if rows.any():
+				indexes[rows, k] = self.random_state.randint(0, len(self.eventlists[instrument]), rows.sum())
+
+		# test for genuine zero-lag coincidences among them
+		if not allow_zero_lag:
+			times = self.event_times(timefunc)
+			accept = numpy.ones((n,), dtype = "bool")
+			for a, b in iterutils.choices(range(len(instruments)), 2):
+				rows = members[:, a] & members[:, b]
+				if not rows.any():
+					continue
+				dt = abs(times[instruments[a]][indexes[rows, a]] - times[instruments[b]][indexes[rows, b]])
+				accept[rows] &= dt >= self.tau[frozenset((instruments[a], instruments[b]))]
+			combo_indexes = combo_indexes[accept]
+			indexes = indexes[accept]
+
+		draws = numpy.bincount(drawn, minlength = len(combos))
+		accepted = numpy.bincount(combo_indexes, minlength = len(combos))
+		for combo, m, k in zip(combos, draws.tolist(), accepted.tolist()):
+			self.coinc_draws[combo] = self.coinc_draws.get(combo, 0) + m
+			self.coinc_accepted[combo] = self.coinc_accepted.get(combo, 0) + k
+		return combo_indexes, indexes
+
+
+	@property
+	def coinc_instruments(self):
+		"""
+		A tuple of the names of the instruments, in alphabetical
+		order, in the order of the columns of the arrays returned
+		by .coinc_index_array().
+		"""
+		return tuple(sorted(self.eventlists))
+
+
+	def coinc_index_array(self, n, timefunc = None, allow_zero_lag = False):
+		"""
+		Vectorized counterpart of the .coincs() generator.  Returns
+		an array of n random event tuples, one per row, each drawn
+		in the same way as the tuples yielded by .coincs().  The
+		array has one column for each instrument (see
+		.coinc_instruments), the entries are the indexes of the
+		events in the instruments' event lists, or -1 for
+		instruments not participating in the coinc.  As with
+		.coincs(), if allow_zero_lag is False (the default) event
+		tuples containing genuine zero-lag coincidences are
+		rejected, and timefunc is required to compute the times of
+		the events (see .event_times()).  The fraction of the
+		draws accepted is recorded (see .coinc_acceptance_rate).
+		If no instrument combinations are possible, an array with
+		no rows is returned.
+
+		Example:
+
+		>>> from glue.segments import *
+		>>> eventlists = {"H1": [0, 1, 2, 3], "L1": [10, 11, 12, 13], "V1": [20, 21, 22, 23]}
+		>>> seglists = segmentlistdict({"H1": segmentlist([segment(0, 30)]), "L1": segmentlist([segment(10, 50)]), "V1": segmentlist([segment(20, 70)])})
+		>>> coinc_synth = CoincSynthesizer(eventlists, seglists, 0.001)
+		>>> coinc_synth.coinc_index_array(1000, (lambda x: x)).shape
+		(1000, 3)
+		"""
+		return self._coinc_index_array(n, timefunc, allow_zero_lag)[2]
+
+
+	def _coinc_index_array(self, n, timefunc, allow_zero_lag):
+		cumulative, combos = self._instrument_combo_cdf()
+		# start with empty blocks so that the result has the
+		# correct shape if nothing is drawn
+		combo_blocks = [numpy.empty((0,), dtype = "intp")]
+		index_blocks = [numpy.empty((0, len(self.coinc_instruments)), dtype = "int64")]
+		if not combos:
+			return combos, combo_blocks[0], index_blocks[0]
+		if not allow_zero_lag and timefunc is None:
+			raise ValueError("timefunc is required if allow_zero_lag is False")
+		accepted = 0
+		P = numpy.diff(numpy.concatenate(((0.,), cumulative)))
+		while accepted < n:
+			# draw enough to finish given the acceptance rates so
+			# far, assuming instrument combinations not yet drawn
+			# are always accepted
+			rates = self.coinc_acceptance_rate
+			rate = sum(p * rates.get(combo, 1.0) for p, combo in zip(P.tolist(), combos))
+			m = min(max(int((n - accepted) / max(rate, 1e-3) * 1.1) + 1, 64), self.blocksize)
+			combo_indexes, indexes = self._coinc_index_block(m, cumulative, combos, timefunc, allow_zero_lag)
+			combo_blocks.append(combo_indexes)
+			index_blocks.append(indexes)
+			accepted += len(indexes)
+		return combos, numpy.concatenate(combo_blocks)[:n], numpy.concatenate(index_blocks)[:n]
 
 
 	def coincs(self, timefunc, allow_zero_lag = False):
@@ -1188,6 +2334,9 @@ class CoincSynthesizer(object):
 		tuples in which no event pairs would be considered to be coincident
 		without time shifts applied.
 
+		The event tuples are drawn in blocks by
+		.coinc_index_array().
+
 
 		Example:
 
@@ -1198,17 +2347,64 @@ class CoincSynthesizer(object):
 		>>> coincs = coinc_synth.coincs((lambda x: 0), allow_zero_lag = True)
 		>>> coincs.next()	# returns a tuple of events
 		"""
-		for instruments in self.instrument_combos():
-			# randomly selected events from those instruments
-			instruments = tuple(instruments)
-			events = tuple(random.choice(self.eventlists[instrument]) for instrument in instruments)
+		instruments = self.coinc_instruments
+		eventlists = [self.eventlists[instrument] for instrument in instruments]
+		while True:
+			combos, combo_indexes, indexes = self._coinc_index_array(self.blocksize, timefunc, allow_zero_lag)
+			if not combos:
+				return
+			# the events in each tuple are in the order in which
+			# the combo's instruments are iterated over
+			columns = [tuple(instruments.index(instrument) for instrument in combo) for combo in combos]
+			for c, row in itertools.izip(combo_indexes.tolist(), indexes.tolist()):
+				yield tuple(eventlists[k][row[k]] for k in columns[c])
+
+
+	def plausible_toas_array(self, instruments, n):
+		"""
+		Vectorized counterpart of the .plausible_toas() generator.
+		Returns an array of n random event time-of-arrival vectors
+		for the instruments in instruments, one per row, with the
+		columns in the order in which instruments is iterated over.
+		The first instrument's time-of-arrival is 0, and the
+		time-of-arrivals are mutually coincident given the maximum
+		allowed inter-instrument \Delta t's.  The trial vectors are
+		drawn in blocks, and the fraction accepted is recorded (see
+		.toa_acceptance_rate).
 
-			# test for a genuine zero-lag coincidence among them
-			if not allow_zero_lag and any(abs(ta - tb) < self.tau[frozenset((instrumenta, instrumentb))] for (instrumenta, ta), (instrumentb, tb) in iterutils.choices(zip(instruments, (timefunc(event) for event in events)), 2)):
-				continue
+		Example:
 
-			# return acceptable event tuples
-			yield events
+		>>> tau = {frozenset(['V1', 'H1']): 0.028287979933844225, frozenset(['H1', 'L1']): 0.011012846152223924, frozenset(['V1', 'L1']): 0.027448341016726496}
+		>>> coinc_synth = CoincSynthesizer()
+		>>> coinc_synth.tau = tau	# override
+		>>> coinc_synth.plausible_toas_array(("H1", "L1", "V1"), 1000).shape
+		(1000, 3)
+		"""
+		# this algorithm is documented in slideless_coinc_generator_rates()
+		instruments = tuple(instruments)
+		anchor, others = instruments[0], instruments[1:]
+		taus = numpy.array([self.tau[frozenset((anchor, instrument))] for instrument in others], dtype = "double")
+		ijseq = tuple((i, j, self.tau[frozenset((others[i], others[j]))]) for (i, j) in iterutils.choices(range(len(others)), 2))
+		blocks = []
+		accepted = 0
+		while accepted < n:
+			# draw enough to finish given the acceptance rate so
+			# far
+			rate = self.toa_acceptance_rate.get(instruments, 1.0)
+			m = min(max(int((n - accepted) / max(rate, 1e-3) * 1.1) + 1, 64), self.blocksize)
+			dt = self.random_state.uniform(-taus, +taus, (m, len(others)))
+			accept = numpy.ones((m,), dtype = "bool")
+			for i, j, maxdt in ijseq:
+				accept &= abs(dt[:, i] - dt[:, j]) <= maxdt
+			dt = dt[accept]
+			self.toa_draws[instruments] = self.toa_draws.get(instruments, 0) + m
+			self.toa_accepted[instruments] = self.toa_accepted.get(instruments, 0) + len(dt)
+			blocks.append(dt)
+			accepted += len(dt)
+		toas = numpy.zeros((n, len(instruments)), dtype = "double")
+		if blocks:
+			toas[:, 1:] = numpy.concatenate(blocks)[:n]
+		return toas
 
 
 	def plausible_toas(self, instruments):
@@ -1216,7 +2412,9 @@ class CoincSynthesizer(object):
 		Generator that yields dictionaries of random event
 		time-of-arrivals for the instruments in instruments such
 		that the time-of-arrivals are mutually coincident given the
-		maximum allowed inter-instrument \Delta t's.
+		maximum allowed inter-instrument \Delta t's.  The
+		time-of-arrivals are drawn in blocks by
+		.plausible_toas_array().
 
 		Example:
 
@@ -1228,15 +2426,10 @@ class CoincSynthesizer(object):
 		>>> toas.next()
 		>>> toas.next()
 		"""
-		# this algorithm is documented in slideless_coinc_generator_rates()
 		instruments = tuple(instruments)
-		anchor, instruments = instruments[0], instruments[1:]
-		windows = tuple((-self.tau[frozenset((anchor, instrument))], +self.tau[frozenset((anchor, instrument))]) for instrument in instruments)
-		ijseq = tuple((i, j, self.tau[frozenset((instruments[i], instruments[j]))]) for (i, j) in iterutils.choices(range(len(instruments)), 2))
 		while True:
-			dt = tuple(random.uniform(*window) for window in windows)
-			if all(abs(dt[i] - dt[j]) <= maxdt for i, j, maxdt in ijseq):
-				yield dict([(anchor, 0.0)] + zip(instruments, dt))
+			for toas in self.plausible_toas_array(instruments, 1024).tolist():
+				yield dict(zip(instruments, toas))
 
 
 #
@@ -1444,6 +2637,123 @@ class TOATriangulator(object):
 		# done
 		return n, t0 + toa, chi2 / len(self.sigmas), dt
 
+	def triangulate_many(self, ts):
+		"""
+		Triangulate the directions to the sources of many signals
+		at once.  ts is an (N, n_locations) array-like of arrival
+		times, one row per signal, with the columns in the same
+		order as the locations provided when the instance was
+		created.  The return value is a tuple of arrays
+
+			(n, toa, chi2 / DOF, dt)
+
+		with shapes (N, 3), (N,), (N,) and (N,), whose rows are
+		the values __call__() would return for the corresponding
+		rows of ts.  The singular value decomposition computed
+		when the instance was created is reused for every row,
+		and the secular equation is solved for all rows together
+		by bisection, so this is much faster than calling the
+		instance once per signal.
+
+		The arrival times are converted to double precision before
+		the per-row reference time is removed, so the caller should
+		subtract a common offset from very large times (e.g., GPS
+		times) first if sub-microsecond resolution matters.
+
+		Example:
+
+		>>> n, toa, chi2_per_dof, dt = triangulator.triangulate_many([
+			[794546669.429688, 794546669.41333, 794546669.431885],
+			[794546669.429688, 794546669.42333, 794546669.431885]
+		])
+		>>> n.shape
+		(2, 3)
+		"""
+		ts = numpy.array(ts, dtype = "double", ndmin = 2)
+		assert ts.ndim == 2 and ts.shape[1] == len(self.sigmas)
+		N = len(ts)
+
+		# change of t co-ordinate to preserve precision
+		t0 = ts.min(axis = 1)
+		ts = ts - t0[:,numpy.newaxis]
+
+		# sigma^-2 -weighted mean of arrival times
+		w = 1 / self.sigmas**2
+		tbar = numpy.dot(ts, w) / w.sum()
+		# the (j, i)-th element is ts - tbar for the i-th location
+		# of the j-th signal
+		tau = ts - tbar[:,numpy.newaxis]
+
+		if len(self.rs) >= 3:
+			tau_prime = numpy.dot(tau, self.U)[:,:3]
+
+			if self.singular:
+				np = tau_prime / self.S
+				np2 = 1.0 - np[:,0]**2 - np[:,1]**2
+				np[:,2] = numpy.sqrt(numpy.maximum(np2, 0.0))
+				bad = np2 < 0.0
+				np[bad] /= numpy.sqrt((np[bad]**2).sum(axis = 1))[:,numpy.newaxis]
+			else:
+				Stauprime = self.S * tau_prime
+				S2 = self.S * self.S
+				def secular_equation(l):
+					return ((Stauprime / (S2 + l[:,numpy.newaxis]))**2).sum(axis = 1) - 1
+
+				# see __call__() for the choice of the initial
+				# bracket.  the secular equation is monotonically
+				# decreasing above the lower bound, so the upper
+				# bound is doubled until it is negative
+				l_lo = numpy.empty((N,), dtype = "double")
+				l_lo.fill(-S2[-1])
+				l_hi = numpy.ones((N,), dtype = "double")
+				with numpy.errstate(divide = "ignore", invalid = "ignore"):
+					positive = secular_equation(l_hi) > 0
+					while positive.any():
+						l_lo[positive] = l_hi[positive]
+						l_hi[positive] *= 2
+						positive &= secular_equation(l_hi) > 0
+
+					# solve for l by bisection to brentq()'s
+					# default tolerance
+					for i in xrange(1100):
+						l = (l_lo + l_hi) / 2
+						if ((l_hi - l_lo) <= 2e-12 + 4 * numpy.finfo(float).eps * abs(l)).all():
+							break
+						positive = secular_equation(l) > 0
+						l_lo = numpy.where(positive, l, l_lo)
+						l_hi = numpy.where(positive, l_hi, l)
+
+				# compute n'
+				np = Stauprime / (S2 + l[:,numpy.newaxis])
+
+			# compute n from n'
+			n = numpy.dot(np, self.VT)
+
+			# safety check the nomalization of the result
+			assert (abs((n * n).sum(axis = 1) - 1.0) < 1e-8).all()
+
+			# projected light travel times
+			rn = numpy.dot(n, self.rs.T) / self.v
+
+			# arrival time at origin
+			toa = numpy.dot(ts - rn, w) / w.sum()
+
+			# chi^{2}
+			chi2 = (((numpy.dot(n, self.R.T) / self.v - tau) / self.sigmas)**2).sum(axis = 1)
+
+			# root-sum-square timing residual
+			dt = ts - toa[:,numpy.newaxis] - rn
+			dt = numpy.sqrt((dt * dt).sum(axis = 1))
+		else:
+			# len(rs) == 2
+			n = numpy.zeros((N, 3), dtype = "double")
+			toa = numpy.zeros((N,), dtype = "double")
+			dt = numpy.maximum(abs(ts[:,1] - ts[:,0]) - self.max_dt, 0)
+			chi2 = dt**2 / sum(self.sigmas**2)
+
+		# done
+		return n, t0 + toa, chi2 / len(self.sigmas), dt
+
 
 #
 # =============================================================================
@@ -1497,6 +2807,33 @@ class InstrumentCategories(dict):
 #
 
 
+class _LazyDict(dict):
+	"""
+	A dictionary whose missing entries are computed on demand.  When
+	.enabled is True, looking up a missing key calls the method named
+	.method of .owner with the key, this dictionary, and .args as
+	arguments, and the method stores the value in the dictionary.  The
+	method is referenced by name, not as a bound method, so instances
+	can be pickled.  For internal use only.
+	"""
+	owner = None
+	method = None
+	args = ()
+	enabled = False
+
+	def __init__(self, owner = None, method = None, args = (), enabled = False):
+		self.owner = owner
+		self.method = method
+		self.args = args
+		self.enabled = enabled
+
+	def __missing__(self, key):
+		if not self.enabled:
+			raise KeyError(key)
+		getattr(self.owner, self.method)(key, self, *self.args)
+		return dict.__getitem__(self, key)
+
+
 class CoincParamsDistributions(object):
 	"""
 	A class for histograming the parameters of coincidences (or of
@@ -1507,7 +2844,9 @@ class CoincParamsDistributions(object):
 	for performing the kernel density estimation transform to obtain
 	PDFs from histograms of counts.  The binnings is a dictionary
 	mapping parameter names to rate.NDBins instances describing the
-	binning to be used for each paramter.  The pdf_from_rates_func
+	binning to be used for each paramter;  the histograms are always
+	rate.BinnedArray objects, rate.SparseBinnedArray is not supported.
+	The pdf_from_rates_func
 	dictionary maps parameter names to functions to smooth and
 	normalize bin count data into PDFs.  As a special case, a default
 	function is provided and will be used for any parameters whose
@@ -1571,35 +2910,57 @@ class CoincParamsDistributions(object):
 		self.zero_lag_rates = dict((param, rate.BinnedArray(binning)) for param, binning in self.binnings.items())
 		self.background_rates = dict((param, rate.BinnedArray(binning)) for param, binning in self.binnings.items())
 		self.injection_rates = dict((param, rate.BinnedArray(binning)) for param, binning in self.binnings.items())
-		self.zero_lag_pdf = {}
-		self.background_pdf = {}
-		self.injection_pdf = {}
-		self.zero_lag_lnpdf_interp = {}
-		self.background_lnpdf_interp = {}
-		self.injection_lnpdf_interp = {}
+		# the PDFs are computed from the rates on demand after
+		# .finish(lazy = True) has been invoked
+		self.zero_lag_pdf = _LazyDict(self, "_make_pdf", ("zero_lag_rates", "zero lag"))
+		self.background_pdf = _LazyDict(self, "_make_pdf", ("background_rates", "background"))
+		self.injection_pdf = _LazyDict(self, "_make_pdf", ("injection_rates", "injections"))
+		# the interpolators are always built on demand
+		self.zero_lag_lnpdf_interp = _LazyDict(self, "_make_lnpdf_interp", ("zero_lag_pdf",), enabled = True)
+		self.background_lnpdf_interp = _LazyDict(self, "_make_lnpdf_interp", ("background_pdf",), enabled = True)
+		self.injection_lnpdf_interp = _LazyDict(self, "_make_lnpdf_interp", ("injection_pdf",), enabled = True)
 		self.process_id = process_id
 
+	@staticmethod
+	def _ln_binnedarray(binnedarray):
+		"""
+		Return a copy of a PDF's BinnedArray containing the natural
+		logarithm of the PDF.  For internal use only.
+		"""
+		with numpy.errstate(invalid = "ignore"):
+			assert not (binnedarray.array < 0.).any()
+		binnedarray = binnedarray.copy()
+		with numpy.errstate(divide = "ignore"):
+			binnedarray.array = numpy.log(binnedarray.array)
+		return binnedarray
+
+	def _make_lnpdf_interp(self, key, interp_dict, pdf_attr):
+		"""
+		Build the interpolator for the PDF named key in the PDF
+		dictionary named pdf_attr, and store it in interp_dict.
+		For internal use only.
+		"""
+		interp_dict[key] = rate.InterpBinnedArray(self._ln_binnedarray(getattr(self, pdf_attr)[key]), fill_value = NegInf)
+
 	def _rebuild_interpolators(self):
 		"""
-		Initialize the interp dictionaries from the discretely
-		sampled PDF data.  For internal use only.
+		Discard the interpolators so that they will be rebuilt
+		from the discretely sampled PDF data when next used.  For
+		internal use only.
 		"""
 		self.zero_lag_lnpdf_interp.clear()
 		self.background_lnpdf_interp.clear()
 		self.injection_lnpdf_interp.clear()
-		def mkinterp(binnedarray):
-			with numpy.errstate(invalid = "ignore"):
-				assert not (binnedarray.array < 0.).any()
-			binnedarray = binnedarray.copy()
-			with numpy.errstate(divide = "ignore"):
-				binnedarray.array = numpy.log(binnedarray.array)
-			return rate.InterpBinnedArray(binnedarray, fill_value = NegInf)
-		for key, binnedarray in self.zero_lag_pdf.items():
-			self.zero_lag_lnpdf_interp[key] = mkinterp(binnedarray)
-		for key, binnedarray in self.background_pdf.items():
-			self.background_lnpdf_interp[key] = mkinterp(binnedarray)
-		for key, binnedarray in self.injection_pdf.items():
-			self.injection_lnpdf_interp[key] = mkinterp(binnedarray)
+
+	def _materialize_pdfs(self):
+		"""
+		Compute any PDFs that have not yet been computed on demand.
+		For internal use only.
+		"""
+		for rates_dict, pdf_dict in ((self.zero_lag_rates, self.zero_lag_pdf), (self.background_rates, self.background_pdf), (self.injection_rates, self.injection_pdf)):
+			if getattr(pdf_dict, "enabled", False):
+				for key in rates_dict:
+					pdf_dict[key]
 
 	@staticmethod
 	def addbinnedarrays(rate_target_dict, rate_source_dict, pdf_target_dict, pdf_source_dict):
@@ -1615,6 +2976,16 @@ class CoincParamsDistributions(object):
 				rate_target_dict[name] += binnedarray
 			else:
 				rate_target_dict[name] = binnedarray.copy()
+		if getattr(pdf_target_dict, "enabled", False):
+			# the target's PDFs are computed on demand from its
+			# rates.  discard the ones that are out of date
+			for name in rate_source_dict:
+				pdf_target_dict.pop(name, None)
+			return
+		if getattr(pdf_source_dict, "enabled", False):
+			# compute the source's PDFs that have not yet been
+			# computed on demand
+			pdf_source_dict = dict((name, pdf_source_dict[name]) for name in rate_source_dict)
 		for name, binnedarray in pdf_source_dict.items():
 			if name in pdf_target_dict:
 				binnedarray = binnedarray.copy()
@@ -1625,7 +2996,11 @@ class CoincParamsDistributions(object):
 			else:
 				pdf_target_dict[name] = binnedarray.copy()
 
-	def __iadd__(self, other):
+	def _add(self, other):
+		"""
+		Add the rates and PDFs of other to this object without
+		rebuilding the interpolators.  For internal use only.
+		"""
 		if type(other) != type(self):
 			raise TypeError(other)
 
@@ -1633,6 +3008,9 @@ class CoincParamsDistributions(object):
 		self.addbinnedarrays(self.background_rates, other.background_rates, self.background_pdf, other.background_pdf)
 		self.addbinnedarrays(self.injection_rates, other.injection_rates, self.injection_pdf, other.injection_pdf)
 
+	def __iadd__(self, other):
+		self._add(other)
+
 		#
 		# rebuild interpolators
 		#
@@ -1647,9 +3025,24 @@ class CoincParamsDistributions(object):
 
 	def copy(self):
 		new = type(self)(process_id = self.process_id)
+		new.zero_lag_pdf.enabled = self.zero_lag_pdf.enabled
+		new.background_pdf.enabled = self.background_pdf.enabled
+		new.injection_pdf.enabled = self.injection_pdf.enabled
 		new += self
 		return new
 
+	@staticmethod
+	def _invalidate(param_dict, pdf_dict, interp_dict):
+		"""
+		Discard the PDFs and interpolators named in param_dict if
+		the PDFs are being computed on demand.  For internal use
+		only.
+		"""
+		if getattr(pdf_dict, "enabled", False):
+			for param in param_dict:
+				pdf_dict.pop(param, None)
+				interp_dict.pop(param, None)
+
 	def add_zero_lag(self, param_dict, weight = 1.0):
 		"""
 		Increment a bin in one or more of the observed data (or
@@ -1664,6 +3057,7 @@ class CoincParamsDistributions(object):
 			except IndexError:
 				# param value out of range
 				pass
+		self._invalidate(param_dict, self.zero_lag_pdf, self.zero_lag_lnpdf_interp)
 
 	def add_background(self, param_dict, weight = 1.0):
 		"""
@@ -1679,6 +3073,7 @@ class CoincParamsDistributions(object):
 			except IndexError:
 				# param value out of range
 				pass
+		self._invalidate(param_dict, self.background_pdf, self.background_lnpdf_interp)
 
 	def add_injection(self, param_dict, weight = 1.0):
 		"""
@@ -1694,6 +3089,7 @@ class CoincParamsDistributions(object):
 			except IndexError:
 				# param value out of range
 				pass
+		self._invalidate(param_dict, self.injection_pdf, self.injection_lnpdf_interp)
 
 	def default_pdf_from_rates(self, key, pdf_dict):
 		"""
@@ -1704,7 +3100,23 @@ class CoincParamsDistributions(object):
 			rate.filter_array(binnedarray.array, self.filters[key])
 		binnedarray.to_pdf()
 
-	def finish(self, verbose = False):
+	def _make_pdf(self, key, pdf_dict, rates_attr, msg):
+		"""
+		Compute the PDF named key from the rates dictionary named
+		rates_attr, and store it in pdf_dict.  For internal use
+		only.
+		"""
+		rates_dict = getattr(self, rates_attr)
+		assert numpy.isfinite(rates_dict[key].array).all() and (rates_dict[key].array >= 0).all(), "%s %s counts are not valid" % (key, msg)
+		pdf_dict[key] = rates_dict[key].copy()
+		try:
+			pdf_from_rates_func = self.pdf_from_rates_func[key]
+		except KeyError:
+			pdf_from_rates_func = self.default_pdf_from_rates
+		if pdf_from_rates_func is not None:
+			pdf_from_rates_func(key, pdf_dict)
+
+	def finish(self, verbose = False, lazy = False):
 		"""
 		Populate the discrete PDF dictionaries from the contents of
 		the rates dictionaries, and then the PDF interpolator
@@ -1714,6 +3126,13 @@ class CoincParamsDistributions(object):
 		instance, and converted to normalized PDFs using the bin
 		volumes.  Finally the dictionary of PDF interpolators is
 		populated from the discretely sampled PDF data.
+
+		If lazy is True, the PDFs and interpolators are not
+		computed now but instead each is computed the first time
+		it is used.  Thereafter, incrementing a histogram with one
+		of the .add_*() methods discards its PDF and interpolator
+		so that they will be recomputed from the new counts when
+		next used.
 		"""
 		#
 		# convert raw bin counts into normalized PDFs
@@ -1722,28 +3141,28 @@ class CoincParamsDistributions(object):
 		self.zero_lag_pdf.clear()
 		self.background_pdf.clear()
 		self.injection_pdf.clear()
+		self._rebuild_interpolators()
+		for pdf_dict in (self.zero_lag_pdf, self.background_pdf, self.injection_pdf):
+			pdf_dict.enabled = lazy
+		if lazy:
+			return
 		progressbar = ProgressBar(text = "Computing Parameter PDFs", max = len(self.zero_lag_rates) + len(self.background_rates) + len(self.injection_rates)) if verbose else None
-		for key, (msg, rates_dict, pdf_dict) in itertools.chain(
-				zip(self.zero_lag_rates, itertools.repeat(("zero lag", self.zero_lag_rates, self.zero_lag_pdf))),
-				zip(self.background_rates, itertools.repeat(("background", self.background_rates, self.background_pdf))),
-				zip(self.injection_rates, itertools.repeat(("injections", self.injection_rates, self.injection_pdf)))
+		for key, (msg, rates_attr, pdf_dict) in itertools.chain(
+				zip(self.zero_lag_rates, itertools.repeat(("zero lag", "zero_lag_rates", self.zero_lag_pdf))),
+				zip(self.background_rates, itertools.repeat(("background", "background_rates", self.background_pdf))),
+				zip(self.injection_rates, itertools.repeat(("injections", "injection_rates", self.injection_pdf)))
 		):
-			assert numpy.isfinite(rates_dict[key].array).all() and (rates_dict[key].array >= 0).all(), "%s %s counts are not valid" % (key, msg)
-			pdf_dict[key] = rates_dict[key].copy()
-			try:
-				pdf_from_rates_func = self.pdf_from_rates_func[key]
-			except KeyError:
-				pdf_from_rates_func = self.default_pdf_from_rates
-			if pdf_from_rates_func is not None:
-				pdf_from_rates_func(key, pdf_dict)
+			self._make_pdf(key, pdf_dict, rates_attr, msg)
 			if progressbar is not None:
 				progressbar.increment()
 
 		#
-		# rebuild interpolators
+		# build interpolators
 		#
 
-		self._rebuild_interpolators()
+		for pdf_dict, interp_dict in ((self.zero_lag_pdf, self.zero_lag_lnpdf_interp), (self.background_pdf, self.background_lnpdf_interp), (self.injection_pdf, self.injection_lnpdf_interp)):
+			for key in pdf_dict:
+				interp_dict[key]
 
 	def lnP_noise(self, params):
 		"""
@@ -1795,6 +3214,68 @@ class CoincParamsDistributions(object):
 		__getitem__ = self.injection_lnpdf_interp.__getitem__
 		return sum(__getitem__(name)(*value) for name, value in params.items())
 
+	@staticmethod
+	def _lnP_array(params_seq, interp_dict):
+		"""
+		For internal use by .lnP_noise_array() and
+		.lnP_signal_array().
+		"""
+		params_seq = list(params_seq)
+		lnP = numpy.zeros((len(params_seq),), dtype = "double")
+
+		# group the parameter values by PDF name
+		isnone = numpy.zeros((len(params_seq),), dtype = "bool")
+		grouped = {}
+		for i, params in enumerate(params_seq):
+			if params is None:
+				isnone[i] = True
+				continue
+			for name, value in params.items():
+				try:
+					indexes, values = grouped[name]
+				except KeyError:
+					indexes, values = grouped[name] = [], []
+				indexes.append(i)
+				values.append(value)
+
+		# evaluate each PDF once for all of its co-ordinates.  each
+		# PDF appears at most once in each parameter dictionary so
+		# the indexes are unique
+		for name, (indexes, values) in grouped.items():
+			values = numpy.array(values, dtype = "double").reshape((len(indexes), -1))
+			lnP[indexes] += interp_dict[name](*values.T)
+
+		lnP[isnone] = NaN
+		return lnP
+
+	def lnP_noise_array(self, params_seq, **kwargs):
+		"""
+		Vectorized version of .lnP_noise().  params_seq is a
+		sequence of parameter value dictionaries as returned by
+		self.coinc_params(), any of which may be None.  The return
+		value is an array of the natural logarithms of the noise
+		probability densities at those points in parameter space,
+		with NaN in place of the None entries.
+
+		Each PDF's interpolator is called once with the
+		co-ordinates from all of the dictionaries containing it.
+		If a sub-class overrides .lnP_noise() but not this method,
+		this method falls back to calling .lnP_noise() for each
+		entry, passing the key-word arguments to it.
+		"""
+		if type(self).lnP_noise.__func__ is not CoincParamsDistributions.lnP_noise.__func__:
+			return numpy.array([self.lnP_noise(params, **kwargs) if params is not None else NaN for params in params_seq], dtype = "double")
+		return self._lnP_array(params_seq, self.background_lnpdf_interp)
+
+	def lnP_signal_array(self, params_seq, **kwargs):
+		"""
+		Vectorized version of .lnP_signal().  See
+		.lnP_noise_array() for more information.
+		"""
+		if type(self).lnP_signal.__func__ is not CoincParamsDistributions.lnP_signal.__func__:
+			return numpy.array([self.lnP_signal(params, **kwargs) if params is not None else NaN for params in params_seq], dtype = "double")
+		return self._lnP_array(params_seq, self.injection_lnpdf_interp)
+
 	def get_xml_root(self, xml, name):
 		"""
 		Sub-classes can use this in their overrides of the
@@ -1808,14 +3289,11 @@ class CoincParamsDistributions(object):
 		return xml[0]
 
 	@classmethod
-	def from_xml(cls, xml, name):
+	def _from_xml(cls, xml, name):
 		"""
-		In the XML document tree rooted at xml, search for the
-		serialized CoincParamsDistributions object named name, and
-		deserialize it.  The return value is a two-element tuple.
-		The first element is the deserialized
-		CoincParamsDistributions object, the second is the process
-		ID recorded when it was written to XML.
+		Deserialize the CoincParamsDistributions object named name
+		from the XML document tree rooted at xml without building
+		the interpolators.  For internal use only.
 		"""
 		# create an instance
 		self = cls()
@@ -1837,18 +3315,26 @@ class CoincParamsDistributions(object):
 		reconstruct(xml, u"injection", self.injection_rates)
 		reconstruct(xml, u"injection_pdf", self.injection_pdf)
 
-		#
-		# rebuild interpolators
-		#
-
-		self._rebuild_interpolators()
-
 		#
 		# done
 		#
 
 		return self
 
+	@classmethod
+	def from_xml(cls, xml, name):
+		"""
+		In the XML document tree rooted at xml, search for the
+		serialized CoincParamsDistributions object named name, and
+		deserialize it.  The return value is a two-element tuple.
+		The first element is the deserialized
+		CoincParamsDistributions object, the second is the process
+		ID recorded when it was written to XML.
+		"""
+		self = cls._from_xml(xml, name)
+		self._rebuild_interpolators()
+		return self
+
 	def to_xml(self, name):
 		"""
 		Serialize this CoincParamsDistributions object to an XML
@@ -1857,6 +3343,7 @@ class CoincParamsDistributions(object):
 		recorded in the serialized XML, and the object will be
 		given the name name.
 		"""
+		self._materialize_pdfs()
 		xml = ligolw.LIGO_LW({u"Name": u"%s:%s" % (name, self.ligo_lw_name_suffix)})
 		xml.appendChild(ligolw_param.new_param(u"process_id", u"ilwd:char", self.process_id))
 		def store(xml, prefix, source_dict):
@@ -1871,6 +3358,339 @@ class CoincParamsDistributions(object):
 
 		return xml
 
+	#
+	# binary serialization.  the BinnedArray objects are stored in a
+	# pylal.rate binary container using the same names as in the XML
+	# serialization, so large distributions can be memory-mapped
+	# instead of parsed
+	#
+
+	_binary_prefixes = (
+		(u"zero_lag", "zero_lag_rates"),
+		(u"zero_lag_pdf", "zero_lag_pdf"),
+		(u"background", "background_rates"),
+		(u"background_pdf", "background_pdf"),
+		(u"injection", "injection_rates"),
+		(u"injection_pdf", "injection_pdf")
+	)
+
+	@classmethod
+	def _from_binary(cls, filename, name, mmap_mode = "c"):
+		"""
+		Load the CoincParamsDistributions object named name from
+		filename without building the interpolators.  For internal
+		use only.
+		"""
+		objects, metadata = rate.load_binary(filename, mmap_mode = mmap_mode)
+		if metadata.get(u"name") != u"%s:%s" % (name, cls.ligo_lw_name_suffix):
+			raise ValueError("%s does not contain a %s named %s" % (filename, cls.__name__, name))
+
+		# create an instance
+		self = cls()
+
+		# retrieve the process ID
+		self.process_id = ilwd.ilwdchar(metadata[u"process_id"]) if metadata.get(u"process_id") is not None else None
+
+		# reconstruct the BinnedArray objects
+		suffix = u":pylal_rate_binnedarray"
+		for objname, binnedarray in objects.items():
+			if not objname.endswith(suffix):
+				continue
+			prefix, paramname = objname[:-len(suffix)].split(u":", 1)
+			getattr(self, dict(self._binary_prefixes)[prefix])[str(paramname)] = binnedarray
+
+		#
+		# done
+		#
+
+		return self
+
+	@classmethod
+	def from_binary(cls, filename, name, mmap_mode = "c"):
+		"""
+		Load the CoincParamsDistributions object named name from
+		a file written by .to_binary().  The arrays are
+		memory-mapped using mmap_mode (see
+		pylal.rate.load_binary()).  The default, copy-on-write,
+		allows the distributions to be modified in memory without
+		altering the file.
+		"""
+		self = cls._from_binary(filename, name, mmap_mode = mmap_mode)
+		self._rebuild_interpolators()
+		return self
+
+	#
+	# reduction of many files
+	#
+
+	@classmethod
+	def _load(cls, filename, name, contenthandler = None, verbose = False):
+		"""
+		Load the CoincParamsDistributions object named name from
+		filename, which can be an XML document or a file in the
+		binary format written by .to_binary().  The interpolators
+		are not built unless a sub-class has overridden the
+		deserialization methods.  For internal use only.
+		"""
+		if filename is not None and rate.is_binary(filename):
+			if cls.from_binary.__func__ is not CoincParamsDistributions.from_binary.__func__:
+				return cls.from_binary(filename, name)
+			return cls._from_binary(filename, name)
+		xmldoc = ligolw_utils.load_filename(filename, contenthandler = contenthandler if contenthandler is not None else cls.LIGOLWContentHandler, verbose = verbose)
+		try:
+			if cls.from_xml.__func__ is not CoincParamsDistributions.from_xml.__func__:
+				return cls.from_xml(xmldoc, name)
+			return cls._from_xml(xmldoc, name)
+		finally:
+			xmldoc.unlink()
+
+	@classmethod
+	def _reduce_filenames(cls, filenames, name, contenthandler = None, verbose = False):
+		"""
+		Load the CoincParamsDistributions objects named name from
+		each of filenames in turn and accumulate their sum, holding
+		at most two in memory at a time.  Returns the
+		_CoincParamsDistributionsSum accumulator.  For internal use
+		only.
+		"""
+		total = _CoincParamsDistributionsSum(cls)
+		for filename in filenames:
+			total.add(cls._load(filename, name, contenthandler = contenthandler, verbose = verbose))
+		return total
+
+	@classmethod
+	def from_filenames(cls, filenames, name, nproc = 1, contenthandler = None, verbose = False):
+		"""
+		Load the CoincParamsDistributions objects named name from
+		each of the files in filenames, and return their sum.  The
+		files can be XML documents or files written by
+		.to_binary(), in any mix.  The result is the same as
+		loading each with .from_xml() (or .from_binary()) and
+		adding them together with +=, but the files are loaded one
+		at a time, the rates and the count-weighted sums of the
+		PDFs are accumulated, and the PDFs are normalized and the
+		interpolators rebuilt once at the end.  The process ID is
+		taken from the first file.
+
+		If nproc is greater than 1 the files are divided among a
+		pool of that many worker processes, each of which sums its
+		share of the files;  the partial sums are then added
+		together.  contenthandler is the content handler used to
+		parse XML documents, the default is the
+		.LIGOLWContentHandler attribute of the class.
+
+		ValueError is raised if filenames is empty.
+		"""
+		global _reduce_worker_state
+		filenames = list(filenames)
+		nproc = min(nproc, len(filenames))
+		if nproc > 1:
+			if verbose:
+				print >>sys.stderr, "summing %d files using %d processes ..." % (len(filenames), nproc)
+			# contiguous blocks so that the first file's process
+			# ID is retained
+			blocks = [filenames[i * len(filenames) // nproc : (i + 1) * len(filenames) // nproc] for i in range(nproc)]
+			_reduce_worker_state = (cls, name, contenthandler, verbose)
+			pool = multiprocessing.Pool(nproc)
+			try:
+				total = _CoincParamsDistributionsSum(cls)
+				for partial in pool.imap(_reduce_coinc_params_distributions, blocks):
+					total.merge(partial)
+				pool.close()
+			except:
+				pool.terminate()
+				raise
+			finally:
+				pool.join()
+				_reduce_worker_state = None
+		else:
+			total = cls._reduce_filenames(filenames, name, contenthandler = contenthandler, verbose = verbose)
+		if total.result is None:
+			raise ValueError("no input files")
+		self = total.finish()
+
+		#
+		# rebuild interpolators
+		#
+
+		self._rebuild_interpolators()
+
+		#
+		# done
+		#
+
+		return self
+
+	def to_binary(self, filename, name):
+		"""
+		Write this CoincParamsDistributions object to filename in
+		the pylal.rate binary container format (see
+		pylal.rate.save_binary()), giving it the name name.  The
+		.process_id attribute is recorded in the file's metadata.
+		"""
+		self._materialize_pdfs()
+		objects = {}
+		for prefix, attr in self._binary_prefixes:
+			for paramname, binnedarray in getattr(self, attr).items():
+				objects[u"%s:%s:pylal_rate_binnedarray" % (prefix, paramname)] = binnedarray
+		metadata = {
+			u"name": u"%s:%s" % (name, self.ligo_lw_name_suffix),
+			u"process_id": unicode(self.process_id) if self.process_id is not None else None
+		}
+		rate.save_binary(filename, objects, metadata = metadata)
+
+
+class _CoincParamsDistributionsSum(object):
+	"""
+	Running sum of CoincParamsDistributions objects of class cls, for
+	use by CoincParamsDistributions.from_filenames().  The rates are
+	summed into the first object added, .result.  The PDF for each
+	parameter is the average of the PDFs being summed weighted by the
+	total counts in the corresponding rates, so for each PDF the
+	weighted sum and the total weight are accumulated, and the PDFs
+	are normalized once by .finish().  The result is the same as
+	summing the objects with +=, which is what is done for classes
+	that override .__iadd__() (and might carry additional state).
+	For internal use only.
+	"""
+	attrs = (("zero_lag_rates", "zero_lag_pdf"), ("background_rates", "background_pdf"), ("injection_rates", "injection_pdf"))
+
+	def __init__(self, cls):
+		self.iadd_overridden = cls.__iadd__.__func__ is not CoincParamsDistributions.__iadd__.__func__
+		self.result = None
+		# PDF attribute --> {parameter: [PDF or weighted sum of
+		# PDFs, total weight, True if weighted sum]}
+		self.pdf_sums = dict((pdf_attr, {}) for rates_attr, pdf_attr in self.attrs)
+
+	@staticmethod
+	def _add_pdf(pdf_sums, name, pdf, weight, weighted):
+		"""
+		Add a PDF with the given total weight, or a weighted sum of
+		PDFs if weighted is True, to the entry for name in
+		pdf_sums.
+		"""
+		try:
+			entry = pdf_sums[name]
+		except KeyError:
+			pdf_sums[name] = [pdf, weight, weighted]
+			return
+		if not entry[2]:
+			# first addition to this PDF.  the stored PDF
+			# belongs to the sum
+			entry[0].array *= entry[1]
+			entry[2] = True
+		if weighted:
+			entry[0] += pdf
+		elif not cmp(entry[0].bins, pdf.bins):
+			entry[0].array += weight * pdf.array
+		else:
+			pdf = pdf.copy()
+			pdf.array *= weight
+			entry[0] += pdf
+		entry[1] += weight
+
+	def add(self, other):
+		"""
+		Add the rates and PDFs of a CoincParamsDistributions object
+		to the sum.  other must not be used afterwards.
+		"""
+		if self.result is not None and type(other) != type(self.result):
+			raise TypeError(other)
+		if self.result is not None and self.iadd_overridden:
+			self.result += other
+			return
+		for rates_attr, pdf_attr in self.attrs:
+			rates = getattr(other, rates_attr)
+			pdf_dict = getattr(other, pdf_attr)
+			if self.result is not None:
+				result_rates = getattr(self.result, rates_attr)
+				for name, binnedarray in rates.items():
+					if name in result_rates:
+						result_rates[name] += binnedarray
+					else:
+						result_rates[name] = binnedarray
+				result_pdf_dict = getattr(self.result, pdf_attr)
+			else:
+				result_pdf_dict = pdf_dict
+			if getattr(result_pdf_dict, "enabled", False):
+				# the result's PDFs are computed on demand
+				# from its rates.  discard the ones that are
+				# out of date
+				for name in rates:
+					result_pdf_dict.pop(name, None)
+				continue
+			if getattr(pdf_dict, "enabled", False):
+				# compute the PDFs that have not yet been
+				# computed on demand
+				pdf_dict = dict((name, pdf_dict[name]) for name in rates)
+			for name, pdf in pdf_dict.items():
+				self._add_pdf(self.pdf_sums[pdf_attr], name, pdf, rates[name].array.sum(), False)
+		if self.result is None:
+			self.result = other
+
+	def merge(self, other):
+		"""
+		Add the contents of another _CoincParamsDistributionsSum
+		to this one.
+		"""
+		if other.result is None:
+			return
+		if self.result is None:
+			self.result = other.result
+			self.pdf_sums = other.pdf_sums
+			return
+		if self.iadd_overridden:
+			self.result += other.result
+			return
+		for rates_attr, pdf_attr in self.attrs:
+			result_rates = getattr(self.result, rates_attr)
+			for name, binnedarray in getattr(other.result, rates_attr).items():
+				if name in result_rates:
+					result_rates[name] += binnedarray
+				else:
+					result_rates[name] = binnedarray
+			result_pdf_dict = getattr(self.result, pdf_attr)
+			if getattr(result_pdf_dict, "enabled", False):
+				for name in getattr(other.result, rates_attr):
+					result_pdf_dict.pop(name, None)
+				continue
+			for name, (pdf, weight, weighted) in other.pdf_sums[pdf_attr].items():
+				self._add_pdf(self.pdf_sums[pdf_attr], name, pdf, weight, weighted)
+
+	def finish(self):
+		"""
+		Normalize the PDFs, store them in the result, and return
+		the result.  The interpolators are not rebuilt.
+		"""
+		for rates_attr, pdf_attr in self.attrs:
+			result_pdf_dict = getattr(self.result, pdf_attr)
+			for name, (pdf, weight, weighted) in self.pdf_sums[pdf_attr].items():
+				if weighted:
+					pdf.array /= weight
+				result_pdf_dict[name] = pdf
+			self.pdf_sums[pdf_attr] = {}
+		return self.result
+
+
+#
+# worker process code for CoincParamsDistributions.from_filenames().  the
+# state is placed in a module global by the parent before the pool of
+# workers is forked
+#
+
+
+_reduce_worker_state = None
+
+
+def _reduce_coinc_params_distributions(filenames):
+	"""
+	Load the CoincParamsDistributions objects in a block of files
+	using the class, object name, and content handler recorded in the
+	worker state, and return their (unnormalized) sum.
+	"""
+	cls, name, contenthandler, verbose = _reduce_worker_state
+	return cls._reduce_filenames(filenames, name, contenthandler = contenthandler, verbose = verbose)
+
 
 #
 # Likelihood Ratio
@@ -1924,6 +3744,8 @@ class LnLikelihoodRatio(object):
 	def __init__(self, coinc_param_distributions):
 		self.lnP_noise = coinc_param_distributions.lnP_noise
 		self.lnP_signal = coinc_param_distributions.lnP_signal
+		self.lnP_noise_array = coinc_param_distributions.lnP_noise_array
+		self.lnP_signal_array = coinc_param_distributions.lnP_signal_array
 
 	def __call__(self, *args, **kwargs):
 		"""
@@ -1973,6 +3795,28 @@ class LnLikelihoodRatio(object):
 				warnings.warn("inf/inf encountered")
 		return  lnP_signal - lnP_noise
 
+	def array(self, params_seq, **kwargs):
+		"""
+		Vectorized version of .__call__().  params_seq is a
+		sequence of parameter value dictionaries, any of which may
+		be None, and the return value is an array of the natural
+		logarithms of the likelihood ratios, with NaN in place of
+		the None entries.  The sequence is passed to the
+		.lnP_noise_array() and .lnP_signal_array() methods of the
+		snglcoinc.CoincParamsDistributions instance with which this
+		object is associated, followed by any key-word arguments.
+		"""
+		params_seq = list(params_seq)
+		lnP_noise = self.lnP_noise_array(params_seq, **kwargs)
+		lnP_signal = self.lnP_signal_array(params_seq, **kwargs)
+		with numpy.errstate(invalid = "ignore"):
+			lnL = lnP_signal - lnP_noise
+			# see .__call__() for the special cases
+			if (numpy.isposinf(lnP_noise) & numpy.isposinf(lnP_signal)).any():
+				warnings.warn("inf/inf encountered")
+			lnL[numpy.isneginf(lnP_noise) & numpy.isneginf(lnP_signal)] = NegInf
+		return lnL
+
 	def samples(self, random_params_seq, **kwargs):
 		"""
 		Generator that yields an unending sequence of 3-element
@@ -29,6 +29,7 @@
 #include <Python.h>
 #include <structmember.h>
 #include <string.h>
+#include <lal/Date.h>
 #include <lal/DetectorSite.h>
 #include <misc.h>
 #include <tools.h>
@@ -281,9 +282,11 @@ static PyObject *pylal_XLALCalculateEThincaParameter(PyObject *self, PyObject *a
 	static InspiralAccuracyList accuracyparams;
 	static int accuracyparams_set = 0;
 	pylal_SnglInspiralTable *row1, *row2;
+	SnglInspiralTable sngl1, sngl2;
+	double offset1 = 0.0, offset2 = 0.0;
 	double result;
 
-	if(!PyArg_ParseTuple(args, "O!O!", &pylal_SnglInspiralTable_Type, &row1, &pylal_SnglInspiralTable_Type, &row2))
+	if(!PyArg_ParseTuple(args, "O!O!|dd", &pylal_SnglInspiralTable_Type, &row1, &pylal_SnglInspiralTable_Type, &row2, &offset1, &offset2))
 		return NULL;
 
 	if(!accuracyparams_set) {
@@ -292,7 +295,20 @@ static PyObject *pylal_XLALCalculateEThincaParameter(PyObject *self, PyObject *a
 		accuracyparams_set = 1;
 	}
 
-	result = XLALCalculateEThincaParameter(&row1->sngl_inspiral, &row2->sngl_inspiral, &accuracyparams);
+	/*
+	 * apply the time offsets to copies of the rows so that the rows
+	 * themselves are never modified
+	 */
+
+	sngl1 = row1->sngl_inspiral;
+	sngl2 = row2->sngl_inspiral;
+	sngl1.next = sngl2.next = NULL;
+	if(offset1)
+		XLALGPSAdd(&sngl1.end, offset1);
+	if(offset2)
+		XLALGPSAdd(&sngl2.end, offset2);
+
+	result = XLALCalculateEThincaParameter(&sngl1, &sngl2, &accuracyparams);
 
 	if(XLAL_IS_REAL8_FAIL_NAN(result)) {
 		XLALClearErrno();
@@ -359,7 +375,7 @@ static PyObject *pylal_XLAL3DRinca(PyObject *self, PyObject *args)
 
 static struct PyMethodDef methods[] = {
 	{"XLALSnglInspiralTimeError", pylal_XLALSnglInspiralTimeError, METH_VARARGS, "XLALSnglInspiralTimeError(row, threshold)\n\nFrom a sngl_inspiral event compute the \\Delta t interval corresponding to the given e-thinca threshold."},
-	{"XLALCalculateEThincaParameter", pylal_XLALCalculateEThincaParameter, METH_VARARGS, "XLALCalculateEThincaParameter(row1, row2)\n\nTakes two SnglInspiralTable objects and\ncalculates the overlap factor between them."},
+	{"XLALCalculateEThincaParameter", pylal_XLALCalculateEThincaParameter, METH_VARARGS, "XLALCalculateEThincaParameter(row1, row2, offset1 = 0.0, offset2 = 0.0)\n\nTakes two SnglInspiralTable objects and\ncalculates the overlap factor between them.  The optional\noffsets (in seconds) are added to the rows' end times for the\ncomputation;  the rows are not modified."},
 	{"XLALRingdownTimeError", pylal_XLALRingdownTimeError, METH_VARARGS, "XLALRingdownTimeError(row, ds^2)\n\nFrom a sngl_ringdown event compute the \\Delta t interval corresponding to the given ds^2 threshold."},
 	{"XLAL3DRinca", pylal_XLAL3DRinca, METH_VARARGS, "XLAL3DRinca(row1, row)\n\nTakes two SnglRingdown objects and\ncalculates the distance, ds^2, between them."},
 	{NULL,}
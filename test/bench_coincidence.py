@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+
+"""
+Benchmarks for the coincidence engine:  snglcoinc.get_doubles(),
+snglcoinc.TimeSlideGraph.get_coincs(), ligolw_thinca.ligolw_thinca() and
+ligolw_sstinca.ligolw_thinca(), run on synthetic sngl_inspiral tables.
+
+Each benchmark is run in a fresh process, and one JSON object is written
+per benchmark per line of output, e.g.,
+
+python bench_coincidence.py --instruments H1,L1,V1 --rate 2 --duration 1000 --templates 50 --slides 10 >>bench.jsonl
+
+The reported quantities are the number of events per second of wall
+time, the number of calls to the pair-wise comparison function per second
+of wall time, and the process' peak resident set size.  When pairs are
+being counted the comparison function is wrapped, which disables the
+fast paths that recognize specific comparison functions by identity
+(sstinca's exact-match template index), so use --no-count-pairs when
+measuring those.  The vectorized comparisons used with the columnar
+event lists are counted, one call per candidate pair.
+"""
+
+
+import json
+import math
+import multiprocessing
+from optparse import OptionParser
+import random
+import resource
+import sys
+import time
+import traceback
+
+
+from glue import iterutils
+from glue import offsetvector
+from glue import segments
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw.utils import process as ligolw_process
+from pylal import git_version
+from pylal import ligolw_sstinca
+from pylal import ligolw_thinca
+from pylal import snglcoinc
+
+
+__version__ = "git id %s" % git_version.id
+__date__ = git_version.date
+
+
+#
+# =============================================================================
+#
+#                                 Command Line
+#
+# =============================================================================
+#
+
+
+benchmarks = ("get_doubles", "graph", "thinca", "sstinca")
+
+
+def parse_command_line():
+	parser = OptionParser(
+		version = "Name: %%prog\n%s" % git_version.verbose_msg,
+		usage = "%prog [options]",
+		description = "Benchmark the inspiral coincidence engine on synthetic triggers.  One JSON object per benchmark is written to stdout."
+	)
+	parser.add_option("--instruments", metavar = "name[,name,...]", default = "H1,L1,V1", help = "Set the instruments (default = \"H1,L1,V1\").")
+	parser.add_option("--rate", metavar = "Hz", type = "float", default = 1.0, help = "Set the trigger rate in each instrument (default = 1).")
+	parser.add_option("--duration", metavar = "seconds", type = "float", default = 1000.0, help = "Set the duration of the analysis segment (default = 1000).")
+	parser.add_option("--templates", metavar = "count", type = "int", default = 20, help = "Set the number of templates (default = 20).")
+	parser.add_option("--slides", metavar = "count", type = "int", default = 1, help = "Set the number of offset vectors, including the zero-lag one (default = 1).")
+	parser.add_option("--slide-step", metavar = "seconds", type = "float", default = 5.0, help = "Set the time slide step (default = 5).")
+	parser.add_option("--e-thinca-parameter", metavar = "value", type = "float", default = 0.5, help = "Set the e-thinca parameter (default = 0.5).")
+	parser.add_option("--event-list", metavar = "bisect|columnar", default = "bisect", help = "Set the event list implementation used by the get_doubles, graph and thinca benchmarks (default = \"bisect\").")
+	parser.add_option("--num-processes", metavar = "count", type = "int", default = 1, help = "Set the number of processes to use for the leaf nodes of the time slide graph (default = 1).")
+	parser.add_option("--benchmark", metavar = "name", action = "append", default = [], help = "Run this benchmark.  Can be given multiple times.  Known benchmarks are %s.  The default is to run all of them." % ", ".join(benchmarks))
+	parser.add_option("--repeat", metavar = "count", type = "int", default = 1, help = "Run each benchmark this many times (default = 1).")
+	parser.add_option("--seed", metavar = "integer", type = "int", default = 0, help = "Set the random number generator seed (default = 0).")
+	parser.add_option("--no-count-pairs", action = "store_true", help = "Do not wrap the comparison function to count the pairs compared.")
+	options, filenames = parser.parse_args()
+
+	options.instruments = [instrument.strip() for instrument in options.instruments.split(",")]
+	if len(options.instruments) < 2:
+		raise ValueError("need at least 2 instruments")
+	if options.rate <= 0. or options.duration <= 0.:
+		raise ValueError("--rate and --duration must be positive")
+	if options.templates < 1 or options.slides < 1 or options.repeat < 1 or options.num_processes < 1:
+		raise ValueError("--templates, --slides, --repeat and --num-processes must be >= 1")
+	if options.event_list not in ("bisect", "columnar"):
+		raise ValueError("unrecognized --event-list \"%s\"" % options.event_list)
+	if not options.benchmark:
+		options.benchmark = list(benchmarks)
+	for name in options.benchmark:
+		if name not in benchmarks:
+			raise ValueError("unrecognized benchmark \"%s\"" % name)
+
+	return options, filenames
+
+
+#
+# =============================================================================
+#
+#                              Synthetic Triggers
+#
+# =============================================================================
+#
+
+
+def make_template_bank(n, rng):
+	"""
+	Return a list of n (mass1, mass2, Gamma) tuples where Gamma is a
+	tuple of the 6 independent components (Gamma0, ..., Gamma5) of a
+	positive-definite 3x3 metric in (t, tau0, tau3) giving timing
+	uncertainties of a few ms.
+	"""
+	bank = []
+	for i in xrange(n):
+		mass1 = rng.uniform(1., 25.)
+		mass2 = rng.uniform(1., mass1)
+		g = rng.uniform(5e4, 5e5)
+		Gamma = (g, 0.1 * math.sqrt(g * 100.), 0.05 * math.sqrt(g * 1000.), 100., 1., 1000.)
+		bank.append((mass1, mass2, Gamma))
+	return bank
+
+
+def make_sngl_inspiral(table, RowType, instrument, t, template, process_id, rng):
+	mass1, mass2, Gamma = template
+	row = RowType()
+	row.process_id = process_id
+	row.ifo = instrument
+	row.search = u"bench"
+	row.channel = u""
+	row.end_time, row.end_time_ns = int(t), int(round((t - int(t)) * 1e9)) % 1000000000
+	row.mass1, row.mass2 = mass1, mass2
+	row.mtotal = mass1 + mass2
+	row.eta = mass1 * mass2 / row.mtotal**2.
+	row.mchirp = row.mtotal * row.eta**0.6
+	row.tau0 = 10. / row.mchirp
+	row.tau3 = 1. / row.mtotal
+	row.template_duration = row.tau0
+	row.Gamma0, row.Gamma1, row.Gamma2, row.Gamma3, row.Gamma4, row.Gamma5 = Gamma
+	row.Gamma6 = row.Gamma7 = row.Gamma8 = row.Gamma9 = 0.
+	row.spin1x = row.spin1y = row.spin1z = row.spin2x = row.spin2y = row.spin2z = 0.
+	row.snr = rng.uniform(5.5, 12.)
+	row.chisq = rng.uniform(5., 40.)
+	row.chisq_dof = 16
+	row.sigmasq = 1.
+	row.event_id = table.get_next_id()
+	return row
+
+
+def make_document(options, RowType = ligolw_thinca.SnglInspiral, coincident_fraction = 0.2):
+	"""
+	Construct an XML document containing process, search_summary,
+	sngl_inspiral and time_slide tables populated with synthetic
+	triggers.  The triggers are Poisson distributed in time, with a
+	fraction coincident_fraction of them placed in clusters of
+	same-template triggers in all instruments a few ms apart so that
+	the higher-order coincidence code is exercised.  Returns the
+	document and the process row.
+	"""
+	rng = random.Random(options.seed)
+	t0 = 1000000000
+
+	xmldoc = ligolw.Document()
+	xmldoc.appendChild(ligolw.LIGO_LW())
+	process = ligolw_process.register_to_xmldoc(xmldoc, u"bench_coincidence", {})
+
+	search_summary_table = lsctables.New(lsctables.SearchSummaryTable)
+	xmldoc.childNodes[0].appendChild(search_summary_table)
+	seg = segments.segment(lsctables.LIGOTimeGPS(t0), lsctables.LIGOTimeGPS(t0) + options.duration)
+	for instrument in options.instruments:
+		row = search_summary_table.RowType()
+		for column in search_summary_table.validcolumns:
+			setattr(row, column.split(":")[-1], None)
+		row.process_id = process.process_id
+		row.ifos = instrument
+		row.set_in(seg)
+		row.set_out(seg)
+		row.nevents = 0
+		row.nnodes = 1
+		search_summary_table.append(row)
+
+	sngl_inspiral_table = lsctables.New(lsctables.SnglInspiralTable)
+	xmldoc.childNodes[0].appendChild(sngl_inspiral_table)
+	bank = make_template_bank(options.templates, rng)
+	n = int(round(options.rate * options.duration))
+	for instrument in options.instruments:
+		for i in xrange(int(round(n * (1. - coincident_fraction)))):
+			sngl_inspiral_table.append(make_sngl_inspiral(sngl_inspiral_table, RowType, instrument, t0 + rng.uniform(0., options.duration), rng.choice(bank), process.process_id, rng))
+	for i in xrange(int(round(n * coincident_fraction))):
+		t = t0 + rng.uniform(0.1, options.duration - 0.1)
+		template = rng.choice(bank)
+		for instrument in options.instruments:
+			sngl_inspiral_table.append(make_sngl_inspiral(sngl_inspiral_table, RowType, instrument, t + rng.gauss(0., 0.002), template, process.process_id, rng))
+
+	time_slide_table = lsctables.New(lsctables.TimeSlideTable)
+	xmldoc.childNodes[0].appendChild(time_slide_table)
+	for i in xrange(options.slides):
+		time_slide_table.append_offsetvector(offsetvector.offsetvector((instrument, i * k * options.slide_step) for k, instrument in enumerate(options.instruments)), process)
+
+	return xmldoc, process
+
+
+#
+# =============================================================================
+#
+#                                  Benchmarks
+#
+# =============================================================================
+#
+
+
+def make_eventlists(xmldoc, options):
+	EventListType = {"bisect": ligolw_thinca.InspiralEventList, "columnar": ligolw_thinca.InspiralColumnarEventList}[options.event_list]
+	eventlists = snglcoinc.make_eventlists(xmldoc, EventListType, lsctables.SnglInspiralTable.tableName)
+	max_dt = ligolw_thinca.inspiral_max_dt(lsctables.SnglInspiralTable.get_table(xmldoc), options.e_thinca_parameter)
+	for eventlist in eventlists.values():
+		eventlist.set_dt(max_dt)
+	return eventlists, ligolw_thinca.replicate_threshold(options.e_thinca_parameter, set(eventlists))
+
+
+def bench_get_doubles(options, comparefunc):
+	xmldoc, process = make_document(options)
+	eventlists, thresholds = make_eventlists(xmldoc, options)
+	eventlists.offsetvector = offsetvector.offsetvector((instrument, 0.) for instrument in eventlists)
+	t_start = time.time()
+	coincs = 0
+	for instruments in iterutils.choices(sorted(eventlists), 2):
+		for coinc in snglcoinc.get_doubles(eventlists, comparefunc, instruments, thresholds):
+			coincs += 1
+	elapsed = time.time() - t_start
+	del eventlists.offsetvector
+	return len(lsctables.SnglInspiralTable.get_table(xmldoc)), coincs, elapsed
+
+
+def bench_graph(options, comparefunc):
+	xmldoc, process = make_document(options)
+	eventlists, thresholds = make_eventlists(xmldoc, options)
+	graph = snglcoinc.TimeSlideGraph(lsctables.TimeSlideTable.get_table(xmldoc).as_dict())
+	t_start = time.time()
+	coincs = 0
+	for node, coinc in graph.get_coincs(eventlists, comparefunc, thresholds, nproc = options.num_processes, stream = True):
+		coincs += 1
+	elapsed = time.time() - t_start
+	del eventlists.offsetvector
+	return len(lsctables.SnglInspiralTable.get_table(xmldoc)), coincs, elapsed
+
+
+def bench_thinca(options, comparefunc):
+	xmldoc, process = make_document(options)
+	EventListType = {"bisect": ligolw_thinca.InspiralEventList, "columnar": ligolw_thinca.InspiralColumnarEventList}[options.event_list]
+	t_start = time.time()
+	ligolw_thinca.ligolw_thinca(xmldoc, process.process_id, ligolw_thinca.InspiralCoincDef, comparefunc, options.e_thinca_parameter, EventListType = EventListType, nproc = options.num_processes)
+	elapsed = time.time() - t_start
+	return len(lsctables.SnglInspiralTable.get_table(xmldoc)), len(lsctables.CoincTable.get_table(xmldoc)), elapsed
+
+
+def bench_sstinca(options, comparefunc):
+	xmldoc, process = make_document(options, RowType = ligolw_sstinca.SnglInspiral)
+	t_start = time.time()
+	ligolw_sstinca.ligolw_thinca(xmldoc, process.process_id, ligolw_sstinca.InspiralCoincDef, comparefunc, options.e_thinca_parameter, max_dt_func = ligolw_sstinca.inspiral_max_dt_exact, nproc = options.num_processes)
+	elapsed = time.time() - t_start
+	return len(lsctables.SnglInspiralTable.get_table(xmldoc)), len(lsctables.CoincTable.get_table(xmldoc)), elapsed
+
+
+def run_benchmark(name, options):
+	"""
+	Run one benchmark and return the result as a dictionary.  Intended
+	to be run in a process of its own so the peak RSS is the
+	benchmark's.
+	"""
+	func, comparefunc = {
+		"get_doubles": (bench_get_doubles, ligolw_thinca.inspiral_coinc_compare),
+		"graph": (bench_graph, ligolw_thinca.inspiral_coinc_compare),
+		"thinca": (bench_thinca, ligolw_thinca.inspiral_coinc_compare),
+		"sstinca": (bench_sstinca, ligolw_sstinca.inspiral_coinc_compare_exact)
+	}[name]
+	if not options.no_count_pairs:
+		comparefunc = snglcoinc.CountingComparefunc(comparefunc)
+	events, coincs, elapsed = func(options, comparefunc)
+	pairs = None if options.no_count_pairs else comparefunc.calls
+	return {
+		"benchmark": name,
+		"version": git_version.id,
+		"instruments": options.instruments,
+		"rate": options.rate,
+		"duration": options.duration,
+		"templates": options.templates,
+		"slides": options.slides,
+		"event_list": options.event_list if name != "sstinca" else None,
+		"num_processes": options.num_processes,
+		"seed": options.seed,
+		"events": events,
+		"coincs": coincs,
+		"seconds": elapsed,
+		"events_per_s": events / elapsed if elapsed else None,
+		"pairs": pairs,
+		"pairs_per_s": pairs / elapsed if pairs is not None and elapsed else None,
+		# kilobytes on Linux, bytes on OS X
+		"peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+		"peak_rss_children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+	}
+
+
+def run_benchmark_in_child(name, options):
+	"""
+	Run a benchmark in a new process and return the result.  The
+	child is not a daemon so that it can start process pools of its
+	own.
+	"""
+	def target(connection):
+		try:
+			connection.send(run_benchmark(name, options))
+		except:
+			connection.send(traceback.format_exc())
+			raise
+		finally:
+			connection.close()
+	parent_connection, child_connection = multiprocessing.Pipe(False)
+	process = multiprocessing.Process(target = target, args = (child_connection,))
+	process.start()
+	result = parent_connection.recv()
+	process.join()
+	if not isinstance(result, dict):
+		raise RuntimeError("benchmark \"%s\" failed:\n%s" % (name, result))
+	return result
+
+
+#
+# =============================================================================
+#
+#                                     Main
+#
+# =============================================================================
+#
+
+
+if __name__ == "__main__":
+	options, filenames = parse_command_line()
+	for name in options.benchmark:
+		for i in xrange(options.repeat):
+			print json.dumps(run_benchmark_in_child(name, options), sort_keys = True)
+			sys.stdout.flush()
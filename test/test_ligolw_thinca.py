@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+import warnings
+
+import numpy
+
+from glue import offsetvector
+from glue import segments
+from glue.ligolw import ligolw
+from glue.ligolw import lsctables
+from glue.ligolw.utils import process as ligolw_process
+from pylal import ligolw_thinca
+from pylal import snglcoinc
+
+LIGOTimeGPS = lsctables.LIGOTimeGPS
+
+t0 = 1000000000
+duration = 100.
+instruments = ("H1", "L1", "V1")
+e_thinca_parameter = 0.5
+
+#
+# Utility functions
+#
+
+def event_time_ns(event):
+    return event.end_time * 1000000000 + event.end_time_ns
+
+def gps_from_ns(ns):
+    return LIGOTimeGPS(ns // 1000000000, ns % 1000000000)
+
+def make_sngl_inspiral(table, process, instrument, t, template):
+    row = ligolw_thinca.SnglInspiral()
+    for column, columntype in table.validcolumns.items():
+        setattr(row, column.split(":")[-1], 0. if columntype in ("real_4", "real_8") else 0)
+    row.process_id = process.process_id
+    row.ifo = instrument
+    row.search = u"test"
+    row.channel = u""
+    t = LIGOTimeGPS(t)
+    row.end_time, row.end_time_ns = t.gpsSeconds, t.gpsNanoSeconds
+    row.mass1, row.mass2 = template
+    row.mtotal = row.mass1 + row.mass2
+    row.eta = row.mass1 * row.mass2 / row.mtotal**2.
+    row.mchirp = row.mtotal * row.eta**0.6
+    row.tau0 = 10. / row.mchirp
+    row.tau3 = 1. / row.mtotal
+    g = 1e5 / row.mtotal
+    row.Gamma0, row.Gamma1, row.Gamma2, row.Gamma3, row.Gamma4, row.Gamma5 = g, 0.1 * (g * 100.)**.5, 0.05 * (g * 1000.)**.5, 100., 1., 1000.
+    row.snr = random.uniform(5., 10.)
+    row.chisq = random.uniform(1., 20.)
+    row.chisq_dof = 16
+    row.event_id = table.get_next_id()
+    return row
+
+def make_document(nevents = 150, ntemplates = 3, nslides = 3, seed = 0, planted = ()):
+    """
+    Return a document containing random triggers, and the process
+    row.  planted is a sequence of (instrument, time, template index)
+    tuples giving additional triggers.
+    """
+    random.seed(seed)
+    xmldoc = ligolw.Document()
+    xmldoc.appendChild(ligolw.LIGO_LW())
+    process = ligolw_process.register_to_xmldoc(xmldoc, u"inspiral", {})
+    search_summary_table = lsctables.New(lsctables.SearchSummaryTable)
+    xmldoc.childNodes[0].appendChild(search_summary_table)
+    seg = segments.segment(LIGOTimeGPS(t0 - 10), LIGOTimeGPS(t0) + duration + 10)
+    for instrument in instruments:
+        row = search_summary_table.RowType()
+        for column in search_summary_table.validcolumns:
+            setattr(row, column.split(":")[-1], None)
+        row.process_id = process.process_id
+        row.ifos = instrument
+        row.set_in(seg)
+        row.set_out(seg)
+        row.nevents = 0
+        row.nnodes = 1
+        search_summary_table.append(row)
+    sngl_inspiral_table = lsctables.New(lsctables.SnglInspiralTable)
+    xmldoc.childNodes[0].appendChild(sngl_inspiral_table)
+    templates = [(random.uniform(1., 3.), random.uniform(1., 3.)) for i in range(ntemplates)]
+    for instrument in instruments:
+        for i in range(nevents):
+            sngl_inspiral_table.append(make_sngl_inspiral(sngl_inspiral_table, process, instrument, t0 + random.uniform(0., duration), random.choice(templates)))
+    for instrument, t, k in planted:
+        sngl_inspiral_table.append(make_sngl_inspiral(sngl_inspiral_table, process, instrument, t, templates[k]))
+    time_slide_table = lsctables.New(lsctables.TimeSlideTable)
+    xmldoc.childNodes[0].appendChild(time_slide_table)
+    for n in range(nslides):
+        time_slide_table.append_offsetvector(offsetvector.offsetvector((instrument, 0.5 * n * k) for k, instrument in enumerate(instruments)), process)
+    return xmldoc, process
+
+def coinc_set(xmldoc):
+    """
+    Return the coincs in xmldoc as a sorted list of (offset vector,
+    tuple of (instrument, end time) pairs) tuples, which does not
+    depend on the coincs' IDs or the order of the rows.
+    """
+    offset_vectors = lsctables.TimeSlideTable.get_table(xmldoc).as_dict()
+    events = dict((row.event_id, (row.ifo, event_time_ns(row))) for row in lsctables.SnglInspiralTable.get_table(xmldoc))
+    coinc_events = {}
+    for row in lsctables.CoincMapTable.get_table(xmldoc):
+        coinc_events.setdefault(row.coinc_event_id, []).append(events[row.event_id])
+    return sorted((tuple(sorted(offset_vectors[row.time_slide_id].items())), tuple(sorted(coinc_events[row.coinc_event_id]))) for row in lsctables.CoincTable.get_table(xmldoc))
+
+def max_dt(xmldoc):
+    return ligolw_thinca.inspiral_max_dt(lsctables.SnglInspiralTable.get_table(xmldoc), e_thinca_parameter)
+
+def run_batch(EventListType, **kwargs):
+    xmldoc, process = make_document(**kwargs)
+    ligolw_thinca.ligolw_thinca(xmldoc, process.process_id, ligolw_thinca.InspiralCoincDef, ligolw_thinca.inspiral_coinc_compare, e_thinca_parameter, max_dt = max_dt(xmldoc), EventListType = EventListType)
+    return coinc_set(xmldoc)
+
+def start_incremental(EventListType, **kwargs):
+    """
+    Return the document, with its sngl_inspiral table emptied, an
+    IncrementalThinca for it, and the triggers in time order.
+    """
+    xmldoc, process = make_document(**kwargs)
+    sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(xmldoc)
+    dt = max_dt(xmldoc)
+    events = sorted(sngl_inspiral_table, key = event_time_ns)
+    del sngl_inspiral_table[:]
+    thinca = ligolw_thinca.IncrementalThinca(xmldoc, process.process_id, ligolw_thinca.InspiralCoincDef, ligolw_thinca.inspiral_coinc_compare, e_thinca_parameter, dt, EventListType = EventListType)
+    return xmldoc, thinca, events
+
+def chunks(events, boundaries):
+    """
+    Yield (events, boundary) pairs splitting the time-ordered events
+    at the boundaries, given in integer nanoseconds.
+    """
+    i = 0
+    for boundary in boundaries:
+        j = i
+        while j < len(events) and event_time_ns(events[j]) < boundary:
+            j += 1
+        yield events[i:j], gps_from_ns(boundary)
+        i = j
+    yield events[i:], None
+
+#
+# Unit tests
+#
+
+class test_IncrementalThinca(unittest.TestCase):
+    EventListType = ligolw_thinca.InspiralEventList
+
+    def test_chunked_matches_batch(self):
+        """
+        Chunked ingestion records the same coincs as a single
+        ligolw_thinca() run, for chunks shorter and longer than the
+        horizon.
+        """
+        batch = run_batch(self.EventListType)
+        self.assertTrue(batch)
+        for chunk in (0.7, 3., 17., 200.):
+            xmldoc, thinca, events = start_incremental(self.EventListType)
+            boundaries = [t0 * 1000000000 + int(n * chunk * 1e9) for n in range(1, int(duration / chunk) + 1)]
+            for chunk_events, boundary in chunks(events, boundaries):
+                thinca.append(chunk_events, boundary = boundary)
+            thinca.flush()
+            self.assertEqual(coinc_set(xmldoc), batch)
+
+    def test_boundary(self):
+        """
+        A coinc whose earliest trigger is exactly one horizon before
+        the boundary is held back, and is recorded once the boundary
+        moves one nanosecond later.  A coinc straddling a chunk
+        boundary is recorded.
+        """
+        t = LIGOTimeGPS(t0 + 50)
+        planted = [("H1", t, 0), ("L1", t + 0.001, 0), ("H1", t + 20, 1), ("V1", t + 20.002, 1)]
+        batch = run_batch(self.EventListType, nevents = 20, planted = planted)
+        xmldoc, thinca, events = start_incremental(self.EventListType, nevents = 20, planted = planted)
+        t_ns = t.ns()
+        boundaries = [t_ns + thinca.horizon, t_ns + thinca.horizon + 1, (t + 20.001).ns()]
+        planted_coinc = ((u"H1", t_ns), (u"L1", (t + 0.001).ns()))
+        for n, (chunk_events, boundary) in enumerate(chunks(events, boundaries)):
+            thinca.append(chunk_events, boundary = boundary)
+            recorded = [coinc for offset_vector, coinc in coinc_set(xmldoc) if all(offset == 0. for instrument, offset in offset_vector)]
+            self.assertEqual(planted_coinc in recorded, n > 0)
+        thinca.flush()
+        self.assertEqual(coinc_set(xmldoc), batch)
+
+    def test_retained_events(self):
+        """
+        Events earlier than the earliest coinc not yet recorded are
+        discarded.
+        """
+        xmldoc, thinca, events = start_incremental(self.EventListType)
+        boundaries = [t0 * 1000000000 + int(n * 5e9) for n in range(1, 20)]
+        for chunk_events, boundary in chunks(events, boundaries):
+            thinca.append(chunk_events, boundary = boundary)
+            if boundary is not None:
+                for eventlist in thinca.eventlists.values():
+                    self.assertTrue(all(event_time_ns(event) >= boundary.ns() - thinca.horizon for event in eventlist))
+        thinca.flush()
+
+class test_IncrementalThincaColumnar(test_IncrementalThinca):
+    EventListType = ligolw_thinca.InspiralColumnarEventList
+
+class test_EThincaCache(unittest.TestCase):
+    def e_thinca(self, a, b, light_travel_time):
+        """
+        Brute-force e-thinca parameter:  the contact function of the
+        two error ellipsoids maximized over a grid of s and
+        minimized over a grid of time shifts.
+        """
+        cov_a, cov_b = (numpy.linalg.inv(numpy.array([[e.Gamma0, e.Gamma1, e.Gamma2], [e.Gamma1, e.Gamma3, e.Gamma4], [e.Gamma2, e.Gamma4, e.Gamma5]])) for e in (a, b))
+        r = numpy.array(((event_time_ns(b) - event_time_ns(a)) * 1e-9, b.tau0 - a.tau0, b.tau3 - a.tau3))
+        s = numpy.linspace(0., 1., 1001)
+        # (len(s), 3, 3)
+        c = (1. - s)[:, numpy.newaxis, numpy.newaxis] * cov_a + s[:, numpy.newaxis, numpy.newaxis] * cov_b
+        result = None
+        for shift in numpy.linspace(-light_travel_time, light_travel_time, 201):
+            rr = r + (shift, 0., 0.)
+            f = (s * (1. - s) * (rr * numpy.linalg.solve(c, numpy.tile(rr, (len(s), 1)))).sum(axis = 1)).max()
+            result = f if result is None else min(result, f)
+        return result
+
+    def test_compare(self):
+        """
+        .compare() agrees with the e-thinca parameter computed from
+        the metrics, except within the tolerance of the brute-force
+        calculation.
+        """
+        random.seed(1)
+        xmldoc, process = make_document(nevents = 0)
+        table = lsctables.SnglInspiralTable.get_table(xmldoc)
+        cache = ligolw_thinca.EThincaCache()
+        light_travel_time = 0.01
+        tested = [0, 0]
+        for i in range(60):
+            a = make_sngl_inspiral(table, process, "H1", t0, (random.uniform(1., 3.), random.uniform(1., 3.)))
+            b = make_sngl_inspiral(table, process, "L1", LIGOTimeGPS(t0) + random.gauss(0., 0.015), (a.mass1, a.mass2))
+            b.tau0 += random.gauss(0., 0.05)
+            b.tau3 += random.gauss(0., 0.01)
+            b.Gamma0 *= random.uniform(0.5, 2.)
+            e_thinca = self.e_thinca(a, b, light_travel_time)
+            if abs(e_thinca - e_thinca_parameter) < 1e-3 * e_thinca_parameter:
+                continue
+            self.assertEqual(cache.compare(a, 0., b, 0., light_travel_time, e_thinca_parameter), e_thinca > e_thinca_parameter)
+            self.assertEqual(cache.compare(b, 0., a, 0., light_travel_time, e_thinca_parameter), e_thinca > e_thinca_parameter)
+            tested[e_thinca > e_thinca_parameter] += 1
+        # both outcomes were tested
+        self.assertTrue(min(tested) > 5)
+        self.assertEqual(cache.fallbacks, 0)
+        self.assertEqual(cache.misses, len(cache))
+        self.assertEqual(cache.hits + cache.misses, 4 * sum(tested))
+
+    def test_fallback(self):
+        """
+        Templates whose metric cannot be used are counted, and
+        pairs involving them are given to the comparison function.
+        """
+        calls = []
+        def comparefunc(*args):
+            calls.append(args)
+            return False
+        xmldoc, process = make_document(nevents = 0)
+        table = lsctables.SnglInspiralTable.get_table(xmldoc)
+        cache = ligolw_thinca.EThincaCache(comparefunc)
+        a = make_sngl_inspiral(table, process, "H1", t0, (1.4, 1.4))
+        b = make_sngl_inspiral(table, process, "L1", t0, (1.4, 1.4))
+        b.Gamma3 = -b.Gamma3
+        with warnings.catch_warnings(record = True) as caught:
+            warnings.simplefilter("always")
+            self.assertFalse(cache.compare(a, 0., b, 0., 0.01, e_thinca_parameter))
+            self.assertFalse(cache.compare(a, 0., b, 0., 0.01, e_thinca_parameter))
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(cache.fallbacks, 1)
+        self.assertEqual(len(calls), 2)
+
+class test_get_doubles(unittest.TestCase):
+    def test_offsets(self):
+        """
+        get_doubles() finds the same time-shifted pairs as a
+        brute-force comparison of all pairs, with either kind of
+        event list, and does not modify the rows.
+        """
+        # clusters of triggers that are coincident after the time
+        # shifts
+        xmldoc, process = make_document(nevents = 100, planted = [(instrument, t0 + 5. + 9. * i + 0.5 * k, 0) for i in range(10) for k, instrument in enumerate(instruments)])
+        sngl_inspiral_table = lsctables.SnglInspiralTable.get_table(xmldoc)
+        times = [(row.end_time, row.end_time_ns) for row in sngl_inspiral_table]
+        thresholds = ligolw_thinca.replicate_threshold(e_thinca_parameter, set(instruments))
+        offset_vector = offsetvector.offsetvector({"H1": 0., "L1": -0.5, "V1": -1.})
+        expected = {}
+        for a, b in ((a, b) for a in sngl_inspiral_table for b in sngl_inspiral_table if a.ifo < b.ifo):
+            if not ligolw_thinca.inspiral_coinc_compare(a, offset_vector[a.ifo], b, offset_vector[b.ifo], 0., e_thinca_parameter):
+                expected.setdefault((a.ifo, b.ifo), set()).add((a.event_id, b.event_id))
+        self.assertTrue(expected.get(("H1", "L1")))
+        for EventListType in (ligolw_thinca.InspiralEventList, ligolw_thinca.InspiralColumnarEventList):
+            eventlists = snglcoinc.make_eventlists(xmldoc, EventListType, lsctables.SnglInspiralTable.tableName)
+            for eventlist in eventlists.values():
+                eventlist.set_dt(max_dt(xmldoc))
+            eventlists.offsetvector = offset_vector
+            for pair in (("H1", "L1"), ("H1", "V1"), ("L1", "V1")):
+                doubles = set(tuple(event.event_id for event in sorted(double, key = lambda event: event.ifo)) for double in snglcoinc.get_doubles(eventlists, ligolw_thinca.inspiral_coinc_compare, pair, thresholds))
+                self.assertEqual(doubles, expected.get(pair, set()))
+        self.assertEqual([(row.end_time, row.end_time_ns) for row in sngl_inspiral_table], times)
+
+class test_EventList_merge(unittest.TestCase):
+    def test_merge(self):
+        """
+        .merge() is equivalent to .extend() followed by
+        .make_index(), including for out-of-order chunks and events
+        with equal end times.
+        """
+        xmldoc, process = make_document(nevents = 300)
+        events = [event for event in lsctables.SnglInspiralTable.get_table(xmldoc) if event.ifo == "H1"]
+        for event in events[::7]:
+            event.end_time, event.end_time_ns = events[3].end_time, events[3].end_time_ns
+        for EventListType in (ligolw_thinca.InspiralEventList, ligolw_thinca.InspiralColumnarEventList):
+            for trial in range(10):
+                random.shuffle(events)
+                merged = EventListType("H1")
+                indexed = EventListType("H1")
+                i = 0
+                while i < len(events):
+                    j = i + random.randint(0, 60)
+                    merged.merge(events[i:j])
+                    indexed.extend(events[i:j])
+                    indexed.make_index()
+                    self.assertEqual(map(id, merged), map(id, indexed))
+                    if hasattr(indexed, "times"):
+                        self.assertEqual(merged.times.tolist(), indexed.times.tolist())
+                        self.assertEqual(sorted(merged.columns), sorted(indexed.columns))
+                        for name in indexed.columns:
+                            self.assertEqual(merged.columns[name].tolist(), indexed.columns[name].tolist())
+                    i = j
+
+
+# construct and run the test suite
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(test_IncrementalThinca))
+suite.addTest(unittest.makeSuite(test_IncrementalThincaColumnar))
+suite.addTest(unittest.makeSuite(test_get_doubles))
+suite.addTest(unittest.makeSuite(test_EventList_merge))
+suite.addTest(unittest.makeSuite(test_EThincaCache))
+unittest.TextTestRunner(verbosity=2).run(suite)
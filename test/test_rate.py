@@ -1,7 +1,415 @@
 #!/usr/bin/env python
 
 import doctest
+import itertools
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+from scipy import interpolate
+from scipy import signal
+
+from glue import segments
+from glue.ligolw import ligolw
 from pylal import rate
 
+#
+# Utility functions
+#
+
+def random_sparse(bins, n, random_state):
+	"""
+	Return a SparseBinnedArray with n randomly placed bins set to
+	random values, and the equivalent BinnedArray.
+	"""
+	x = rate.SparseBinnedArray(bins)
+	for i in range(n):
+		x[tuple(random_state.uniform(l[0], u[-1]) for l, u in zip(bins.lower(), bins.upper()))] = random_state.uniform(0.5, 2.)
+	return x, x.to_dense()
+
+def filter_array_reference(a, window):
+	"""
+	Filter a using the original implementation of
+	rate.filter_array():  the elements are moved into bands spanning
+	4 orders of magnitude, and each band is convolved with the
+	truncated window separately.  Returns the result and the
+	tolerance to allow in each element, which is set by the
+	round-off in the bands whose window-sized footprint covers it.
+	"""
+	window = window[tuple(slice((w - n) // 2, (w + n) // 2) for w, n in ((w, min(w, ((s + 1) // 2) * 2 - 1)) for w, s in zip(window.shape, a.shape)))]
+	a = a.copy()
+	result = numpy.zeros_like(a)
+	tolerance = numpy.zeros_like(a)
+	while a.any():
+		workspace = a.copy()
+		abs_workspace = abs(workspace)
+		mask = abs_workspace <= abs_workspace[abs_workspace > 0].min() * 1e4
+		a[mask] = 0.
+		workspace[~mask] = 0.
+		footprint = signal.fftconvolve((workspace != 0).astype("double"), numpy.ones(window.shape), mode = "same") > 0.5
+		tolerance[footprint] += abs(workspace).max() * abs(window).sum() * 1e-13
+		workspace = signal.fftconvolve(workspace, window, mode = "same")
+		abs_workspace = abs(workspace)
+		workspace[abs_workspace < abs_workspace.max() * 1e-14] = 0.
+		result += workspace
+	return result, tolerance
+
+def interp_reference(binnedarray, fill_value = 0.0):
+	"""
+	The scipy-based interpolator formerly returned by
+	rate.InterpBinnedArray() in 1 and 2 dimensions.
+	"""
+	coords, z = rate._interp_grid(binnedarray, fill_value)
+	if len(coords) == 1:
+		interp = interpolate.interp1d(coords[0], z, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
+	else:
+		interp = interpolate.interp2d(coords[0], coords[1], z.T, kind = "linear", copy = False, bounds_error = False, fill_value = fill_value)
+	return lambda *coords: float(interp(*coords))
+
+def assertSparseEqual(testcase, a, b):
+	testcase.assertEqual(a.bins, b.bins)
+	testcase.assertEqual(a.dtype, b.dtype)
+	testcase.assertEqual(sorted(a.cells), sorted(b.cells))
+	for index, value in a.cells.items():
+		testcase.assertEqual(value, b.cells[index])
+
+#
+# Unit tests
+#
+
+class test_Bins(unittest.TestCase):
+	def setUp(self):
+		self.bins = (
+			rate.LinearBins(-1, 1, 8),
+			rate.LinearPlusOverflowBins(-1, 1, 8),
+			rate.LogarithmicBins(0.1, 10, 8),
+			rate.LogarithmicPlusOverflowBins(0.1, 10, 8),
+			rate.ATanBins(-1, 1, 8),
+			rate.IrregularBins([-1, -0.5, 0, 0.1, 1])
+		)
+
+	def assertLookupsAgree(self, bins, x):
+		try:
+			expected = [bins[float(y)] for y in x]
+		except IndexError:
+			self.assertRaises(IndexError, bins.__getitem__, x)
+			return
+		indexes = bins[x]
+		self.assertEqual(indexes.shape, x.shape)
+		self.assertEqual(indexes.tolist(), expected)
+
+	def test_array_lookups(self):
+		"""
+		Looking up an array gives the same indexes as looking up
+		its elements one-by-one, and raises IndexError if any of
+		them are not in the binning.
+		"""
+		random_state = numpy.random.RandomState(6)
+		for bins in self.bins:
+			x = numpy.concatenate((random_state.uniform(0.1, 1, 50), random_state.uniform(-1, 10, 50)))
+			# the boundaries themselves
+			self.assertLookupsAgree(bins, numpy.concatenate((bins.lower()[numpy.isfinite(bins.lower())], bins.upper()[numpy.isfinite(bins.upper())])))
+			self.assertLookupsAgree(bins, x[x > 0.1])
+			self.assertLookupsAgree(bins, x)
+			self.assertLookupsAgree(bins, numpy.array([]))
+			for y in (-1000., 1000., float("-inf"), float("+inf")):
+				self.assertLookupsAgree(bins, numpy.array([0.5, y]))
+			self.assertRaises(IndexError, bins.__getitem__, float("nan"))
+			self.assertRaises(IndexError, bins.__getitem__, numpy.array([0.5, float("nan")]))
+
+	def test_add_many(self):
+		"""
+		BinnedArray.add_many() is equivalent to adding the weights
+		one co-ordinate at a time.
+		"""
+		random_state = numpy.random.RandomState(7)
+		bins = rate.NDBins((rate.LinearBins(-1, 1, 8), rate.ATanBins(-1, 1, 5)))
+		coords = (random_state.uniform(-1, 1, 200), random_state.normal(0, 3, 200))
+		weights = random_state.uniform(0, 1, 200)
+		x = rate.BinnedArray(bins)
+		x.add_many(coords, weights)
+		y = rate.BinnedArray(bins)
+		for a, b, w in zip(coords[0], coords[1], weights):
+			y[a, b] += w
+		self.assertTrue(numpy.allclose(x.array, y.array, rtol = 1e-14, atol = 0.))
+		# scalar weights are broadcast
+		x = rate.BinnedArray(bins)
+		x.add_many(coords)
+		self.assertEqual(x.array.sum(), 200)
+		# nothing is modified if a co-ordinate is out of range
+		self.assertRaises(IndexError, x.add_many, (numpy.array([0., 2.]), numpy.array([0., 0.])))
+		self.assertEqual(x.array.sum(), 200)
+
+class test_bins_spanned(unittest.TestCase):
+	def test_bins_spanned(self):
+		"""
+		bins_spanned() agrees with the intersection of the segment
+		list with each bin, including for segments extending past
+		the ends of the binning and for infinite segments.
+		"""
+		random_state = numpy.random.RandomState(8)
+		for bins in (rate.LinearBins(0, 30, 100), rate.LogarithmicBins(1, 30, 17), rate.ATanBins(0, 30, 20), rate.IrregularBins([-5, 0, 0.5, 3, 29, 40])):
+			for n in (0, 1, 5, 50):
+				seglist = segments.segmentlist(segments.segment(*sorted(random_state.uniform(-10, 40, 2))) for i in range(n)).coalesce()
+				for extra in (segments.segmentlist(), segments.segmentlist([segments.segment(45, float("+inf"))])):
+					s = seglist | extra
+					expected = numpy.array([abs(s & segments.segmentlist([segments.segment(a, b)])) for a, b in zip(bins.lower(), bins.upper())])
+					result = rate.bins_spanned(bins, s)
+					self.assertEqual(result.shape, (len(bins),))
+					self.assertTrue(numpy.allclose(result, expected, rtol = 1e-12, atol = 1e-12), (bins, s))
+
+class test_BinnedArray(unittest.TestCase):
+	def test_iadd_rebin(self):
+		"""
+		Adding an array with finer bins gives the same result as
+		adding it one bin at a time.
+		"""
+		random_state = numpy.random.RandomState(11)
+		for coarse, fine in (
+			(rate.NDBins((rate.LinearBins(0, 10, 5),)), rate.NDBins((rate.LinearBins(0, 10, 20),))),
+			(rate.NDBins((rate.LinearBins(0, 10, 5), rate.LogarithmicBins(1, 1000, 3))), rate.NDBins((rate.LinearBins(0, 10, 10), rate.LogarithmicBins(1, 1000, 12)))),
+			(rate.NDBins((rate.LinearBins(0, 10, 5), rate.LinearBins(-1, 1, 4))), rate.NDBins((rate.LinearBins(0, 10, 5), rate.LinearBins(-1, 1, 8)))),
+			(rate.NDBins((rate.IrregularBins([0, 1, 5, 10]), rate.LinearBins(0, 1, 2))), rate.NDBins((rate.IrregularBins([0, 0.5, 1, 2, 3, 5, 10]), rate.LinearBins(0, 1, 6))))
+		):
+			x = rate.BinnedArray(coarse, array = random_state.uniform(size = coarse.shape))
+			y = rate.BinnedArray(fine, array = random_state.uniform(size = fine.shape))
+			rebinned = rate.BinnedArray(coarse)
+			for coords in itertools.product(*fine.centres()):
+				rebinned[coords] += y[coords]
+			expected = x.array + rebinned.array
+			x += y
+			self.assertTrue(numpy.allclose(x.array, expected, rtol = 1e-14, atol = 0.))
+			# BinnedRatios use the same code
+			ratios = rate.BinnedRatios(coarse)
+			other = rate.BinnedRatios(fine)
+			other.numerator.array[:] = y.array
+			other.denominator.array[:] = 2. * y.array
+			ratios += other
+			self.assertTrue(numpy.allclose(ratios.numerator.array, rebinned.array, rtol = 1e-14, atol = 0.))
+			self.assertTrue(numpy.allclose(ratios.denominator.array, 2. * rebinned.array, rtol = 1e-14, atol = 0.))
+		# incompatible binnings
+		x = rate.BinnedArray(rate.NDBins((rate.LinearBins(0, 10, 4),)))
+		self.assertRaises(TypeError, x.__iadd__, rate.BinnedArray(rate.NDBins((rate.LinearBins(0, 10, 6),))))
+		self.assertRaises(TypeError, x.__iadd__, rate.BinnedArray(rate.NDBins((rate.LinearBins(0, 5, 8),))))
+
+class test_filter_array(unittest.TestCase):
+	def test_filter_array(self):
+		"""
+		filter_array() agrees with the band-by-band convolution for
+		data of both signs spanning 200 orders of magnitude, in 1,
+		2 and 3 dimensions, including when the window function has
+		to be truncated.
+		"""
+		random_state = numpy.random.RandomState(12)
+		for shape, window in (((200,), rate.gaussian_window(5)), ((40, 30), rate.gaussian_window(3, 7)), ((12, 10, 9), rate.gaussian_window(2, 2, 2)), ((5,), rate.gaussian_window(20))):
+			a = numpy.zeros(shape)
+			for n in (1, (a.size + 3) // 4, a.size):
+				a[...] = 0.
+				a.flat[random_state.choice(a.size, n, replace = False)] = random_state.choice([-1., 1.], n) * 10.**random_state.uniform(-200, 0, n)
+				expected, tolerance = filter_array_reference(a, window)
+				result = rate.filter_array(a, window)
+				self.assertTrue(result is a)
+				self.assertTrue((abs(result - expected) <= tolerance).all(), (shape, n))
+		# no-op and errors
+		a = numpy.zeros((5,))
+		self.assertTrue((rate.filter_array(a, rate.gaussian_window(2)) == 0.).all())
+		self.assertRaises(ValueError, rate.filter_array, numpy.array([0., 1., float("inf")]), rate.gaussian_window(2))
+		self.assertRaises(ValueError, rate.filter_array, numpy.ones((5,)), numpy.ones((4,)))
+		self.assertRaises(ValueError, rate.filter_array, numpy.ones((5,)), numpy.ones((3, 3)))
+
+class test_InterpBinnedArray(unittest.TestCase):
+	def assertInterpolatorsAgree(self, x, fill_value):
+		interp = rate.InterpBinnedArray(x, fill_value = fill_value)
+		reference = interp_reference(x, fill_value = fill_value)
+		coords, z = rate._interp_grid(x, fill_value)
+		# random points spanning the grid and a margin around it,
+		# plus the grid points themselves
+		random_state = numpy.random.RandomState(15)
+		points = [numpy.concatenate((random_state.uniform(c[0] - 0.1 * (c[-1] - c[0]), c[-1] + 0.1 * (c[-1] - c[0]), 500), g.ravel())) for c, g in zip(coords, numpy.meshgrid(*coords))]
+		expected = numpy.array([reference(*point) for point in zip(*points)])
+		scalars = numpy.array([interp(*point) for point in zip(*points)])
+		arrays = interp(*points)
+		self.assertTrue(numpy.allclose(scalars, expected, rtol = 1e-12, atol = 1e-12), (x.bins, abs(scalars - expected).max()))
+		self.assertTrue(numpy.allclose(arrays, expected, rtol = 1e-12, atol = 1e-12), (x.bins, abs(arrays - expected).max()))
+
+	def test_1d(self):
+		"""
+		In 1 dimension, InterpBinnedArray() agrees with
+		scipy.interpolate.interp1d() on the same grid.
+		"""
+		random_state = numpy.random.RandomState(13)
+		for bins in (rate.LinearBins(-1, 1, 8), rate.LinearPlusOverflowBins(-1, 1, 8), rate.LogarithmicBins(0.1, 10, 8), rate.LogarithmicPlusOverflowBins(0.1, 10, 8), rate.ATanBins(-1, 1, 8), rate.IrregularBins([-1, -0.5, 0, 0.1, 1]), rate.LinearBins(0, 1, 2)):
+			for fill_value in (0., -3.):
+				x = rate.BinnedArray(rate.NDBins((bins,)), array = random_state.uniform(-1, 1, (len(bins),)))
+				self.assertInterpolatorsAgree(x, fill_value)
+
+	def test_2d(self):
+		"""
+		In 2 dimensions, InterpBinnedArray() agrees with
+		scipy.interpolate.interp2d() on the same grid.
+		"""
+		random_state = numpy.random.RandomState(14)
+		for bins in (
+			rate.NDBins((rate.LinearBins(-1, 1, 8), rate.LinearBins(0, 3, 5))),
+			rate.NDBins((rate.LogarithmicPlusOverflowBins(0.1, 10, 8), rate.ATanBins(-1, 1, 6))),
+			rate.NDBins((rate.IrregularBins([-1, -0.5, 0, 0.1, 1]), rate.LogarithmicBins(1, 1000, 7)))
+		):
+			for fill_value in (0., -3.):
+				x = rate.BinnedArray(bins, array = random_state.uniform(-1, 1, bins.shape))
+				self.assertInterpolatorsAgree(x, fill_value)
+
+class test_SparseBinnedArray(unittest.TestCase):
+	def setUp(self):
+		self.bins = rate.NDBins((rate.LinearBins(0, 10, 5), rate.LogarithmicBins(1, 1000, 3)))
+
+	def test_indexing(self):
+		x = rate.SparseBinnedArray(self.bins)
+		self.assertEqual(x[1, 5], 0.)
+		x[1, 5] = 2
+		x[1.5, 6] += 1
+		x[9, 500] = -1
+		self.assertEqual(x[1, 5], 3.)
+		self.assertEqual(x[9, 500], -1.)
+		self.assertEqual(sorted(x.cells), [(0, 0), (4, 2)])
+		self.assertTrue(isinstance(x[1, 5], numpy.float64))
+		# setting a bin to 0 removes it
+		x[1, 5] = 0
+		self.assertEqual(sorted(x.cells), [(4, 2)])
+		x[1, 5] = 0
+		self.assertEqual(sorted(x.cells), [(4, 2)])
+		# only single bins can be addressed
+		self.assertRaises(TypeError, x.__getitem__, (slice(None), 5))
+		self.assertRaises(TypeError, x.__setitem__, (1, slice(1, 100)), 1)
+		self.assertRaises(IndexError, x.__getitem__, (11, 5))
+
+	def test_add_many(self):
+		x = rate.SparseBinnedArray(self.bins)
+		y = rate.BinnedArray(self.bins)
+		coords = (numpy.array([1., 1.5, 9., 5., 1.]), numpy.array([5., 6., 500., 50., 5.]))
+		weights = numpy.array([1., 2., 0.5, 1., -3.])
+		x.add_many(coords, weights)
+		y.add_many(coords, weights)
+		self.assertEqual(sorted(x.cells), [(2, 1), (4, 2)])
+		self.assertTrue((x.to_dense().array == y.array).all())
+		# nothing is modified if a co-ordinate is out of range
+		self.assertRaises(IndexError, x.add_many, (numpy.array([1., 11.]), numpy.array([5., 5.])))
+		self.assertEqual(sorted(x.cells), [(2, 1), (4, 2)])
+
+	def test_iadd(self):
+		random_state = numpy.random.RandomState(0)
+		x, dense_x = random_sparse(self.bins, 6, random_state)
+		y, dense_y = random_sparse(self.bins, 6, random_state)
+		# sparse + sparse
+		z = x.copy()
+		z += y
+		self.assertTrue(numpy.allclose(z.to_dense().array, dense_x.array + dense_y.array))
+		self.assertEqual(len(x.cells), numpy.count_nonzero(dense_x.array))
+		# sparse + dense
+		z = x.copy()
+		z += dense_y
+		self.assertTrue(numpy.allclose(z.to_dense().array, dense_x.array + dense_y.array))
+		# bins that cancel are removed
+		z = x.copy()
+		z += rate.SparseBinnedArray.from_dense(rate.BinnedArray(self.bins, array = -dense_x.array))
+		self.assertEqual(z.cells, {})
+		# rebinning into coarser bins
+		fine = rate.NDBins((rate.LinearBins(0, 10, 10), rate.LogarithmicBins(1, 1000, 6)))
+		y, dense_y = random_sparse(fine, 20, random_state)
+		z = x.copy()
+		z += y
+		expected = dense_x.copy()
+		expected += dense_y
+		self.assertTrue(numpy.allclose(z.to_dense().array, expected.array))
+		# incompatible binnings
+		y = rate.SparseBinnedArray(rate.NDBins((rate.LinearBins(0, 10, 3), rate.LogarithmicBins(1, 1000, 3))))
+		self.assertRaises(TypeError, x.__iadd__, y)
+
+	def test_marginalize(self):
+		x, dense_x = random_sparse(self.bins, 8, numpy.random.RandomState(1))
+		for dim in range(len(self.bins)):
+			result = rate.marginalize(x, dim)
+			self.assertTrue(isinstance(result, rate.SparseBinnedArray))
+			expected = rate.marginalize(dense_x, dim)
+			self.assertEqual(result.bins, expected.bins)
+			self.assertTrue(numpy.allclose(result.to_dense().array, expected.array))
+
+	def test_filter(self):
+		"""
+		filter_sparse_binned_array() gives the same result as
+		filter_array() applied to the dense array, when the blocks
+		are smaller than the window, and near the edges.
+		"""
+		random_state = numpy.random.RandomState(2)
+		bins = rate.NDBins((rate.LinearBins(0, 60, 60), rate.LinearBins(0, 5, 5), rate.LinearBins(0, 30, 30)))
+		for window in (rate.gaussian_window(1, 1, 1), rate.gaussian_window(4, 2, 0.5), rate.gaussian_window(10, 10, 10)):
+			for block_volume in (1, 8, 1000, 1 << 20):
+				x, dense_x = random_sparse(bins, 15, random_state)
+				x[0.5, 0.5, 29.5] = 1.
+				x[59.5, 4.5, 0.5] = 2.
+				dense_x = x.to_dense()
+				rate.filter_sparse_binned_array(x, window, block_volume = block_volume)
+				rate.filter_array(dense_x.array, window)
+				self.assertTrue(numpy.allclose(x.to_dense().array, dense_x.array, rtol = 1e-12, atol = 1e-13 * dense_x.array.max()))
+		# nothing to do
+		x = rate.SparseBinnedArray(bins)
+		rate.filter_sparse_binned_array(x, rate.gaussian_window(1, 1, 1))
+		self.assertEqual(x.cells, {})
+
+	def test_xml(self):
+		x, dense_x = random_sparse(self.bins, 6, numpy.random.RandomState(3))
+		xml = ligolw.LIGO_LW()
+		xml.appendChild(x.to_xml(u"x"))
+		xml.appendChild(rate.SparseBinnedArray(self.bins).to_xml(u"empty"))
+		assertSparseEqual(self, rate.SparseBinnedArray.from_xml(xml, u"x"), x)
+		assertSparseEqual(self, rate.SparseBinnedArray.from_xml(xml, u"empty"), rate.SparseBinnedArray(self.bins))
+		self.assertRaises(ValueError, rate.SparseBinnedArray.from_xml, xml, u"y")
+
+class test_binary(unittest.TestCase):
+	def setUp(self):
+		self.tmpdir = tempfile.mkdtemp()
+		self.filename = os.path.join(self.tmpdir, "test.bin")
+		self.bins = rate.NDBins((rate.LinearBins(0, 10, 5), rate.LogarithmicBins(1, 1000, 3)))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmpdir)
+
+	def test_sparse(self):
+		x, dense_x = random_sparse(self.bins, 6, numpy.random.RandomState(4))
+		x.to_binary(self.filename, u"x")
+		assertSparseEqual(self, rate.SparseBinnedArray.from_binary(self.filename, u"x"), x)
+		self.assertRaises(ValueError, rate.SparseBinnedArray.from_binary, self.filename, u"y")
+
+	def test_save_load(self):
+		x, dense_x = random_sparse(self.bins, 6, numpy.random.RandomState(5))
+		ratios = rate.BinnedRatios(self.bins)
+		ratios.numerator.array[:] = numpy.arange(15.).reshape((5, 3))
+		ratios.denominator.array[:] = 1.
+		empty = rate.SparseBinnedArray(self.bins)
+		rate.save_binary(self.filename, {u"x": x, u"dense": dense_x, u"ratios": ratios, u"empty": empty}, metadata = {u"comment": u"test"})
+		for mmap_mode in ("r", None):
+			objects, metadata = rate.load_binary(self.filename, mmap_mode = mmap_mode)
+			self.assertEqual(sorted(objects), [u"dense", u"empty", u"ratios", u"x"])
+			self.assertEqual(metadata, {u"comment": u"test"})
+			assertSparseEqual(self, objects[u"x"], x)
+			assertSparseEqual(self, objects[u"empty"], empty)
+			self.assertEqual(objects[u"dense"].bins, self.bins)
+			self.assertTrue((objects[u"dense"].array == dense_x.array).all())
+			self.assertTrue((objects[u"ratios"].numerator.array == ratios.numerator.array).all())
+			self.assertTrue((objects[u"ratios"].denominator.array == ratios.denominator.array).all())
+
+
 if __name__ == '__main__':
 	doctest.testmod(rate)
+
+	# construct and run the test suite
+	suite = unittest.TestSuite()
+	suite.addTest(unittest.makeSuite(test_Bins))
+	suite.addTest(unittest.makeSuite(test_bins_spanned))
+	suite.addTest(unittest.makeSuite(test_BinnedArray))
+	suite.addTest(unittest.makeSuite(test_filter_array))
+	suite.addTest(unittest.makeSuite(test_InterpBinnedArray))
+	suite.addTest(unittest.makeSuite(test_SparseBinnedArray))
+	suite.addTest(unittest.makeSuite(test_binary))
+	unittest.TextTestRunner(verbosity=2).run(suite)
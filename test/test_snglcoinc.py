@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from glue import offsetvector
+from glue import segments
+from glue.ligolw import ilwd
+from glue.ligolw import ligolw
+from glue.ligolw import utils as ligolw_utils
+from pylal import rate
+from pylal import snglcoinc
+
+n_files = 7
+
+class Distributions(snglcoinc.CoincParamsDistributions):
+    binnings = {
+        "snr_chi": rate.NDBins((rate.LinearBins(0., 10., 50), rate.LinearBins(-1., 1., 20))),
+        "dt": rate.NDBins((rate.LinearBins(-0.1, 0.1, 40),))
+    }
+    filters = {
+        "snr_chi": rate.gaussian_window(5, 5)
+    }
+
+#
+# Utility functions
+#
+
+def random_distributions(i, cls = Distributions):
+    distributions = cls(process_id = ilwd.ilwdchar(u"process:process_id:%d" % i))
+    for rates in (distributions.zero_lag_rates, distributions.background_rates, distributions.injection_rates):
+        for binnedarray in rates.values():
+            binnedarray.array[:] = np.random.random(binnedarray.array.shape) * (i + 1)
+    distributions.finish()
+    return distributions
+
+class Event(object):
+    def __init__(self, ifo, t):
+        self.ifo = ifo
+        self.t = t
+
+class EventList(snglcoinc.EventList):
+    def get_coincs(self, event_a, offset_a, light_travel_time, threshold, comparefunc):
+        return [event for event in self if not comparefunc(event_a, offset_a, event, self.offset, light_travel_time, threshold)]
+
+def comparefunc(a, offseta, b, offsetb, light_travel_time, threshold):
+    return abs((a.t + float(offseta)) - (b.t + float(offsetb))) > threshold
+
+def make_events(instruments, nevents = 40, nclusters = 20, window = 0.01, seed = 0):
+    """
+    Return a list of random events, and clusters of events coincident
+    at zero lag in random subsets of the instruments.
+    """
+    rng = random.Random(seed)
+    events = [Event(instrument, rng.uniform(0., 60.)) for instrument in instruments for i in range(nevents)]
+    for i in range(nclusters):
+        t = rng.uniform(0., 60.)
+        for instrument in rng.sample(instruments, rng.randint(2, len(instruments))):
+            events.append(Event(instrument, t + rng.uniform(-window / 2., window / 2.)))
+    rng.shuffle(events)
+    for n, event in enumerate(events):
+        event.event_id = ilwd.ilwdchar(u"sngl_burst:event_id:%d" % n)
+    return events
+
+def expected_coincs(events, offset_vector, window, include_small_coincs = True):
+    """
+    Brute-force construction of the coincs for an offset vector:  the
+    tuples of mutually coincident events, ordered by instrument, that
+    involve all the instruments or, if include_small_coincs is True,
+    that cannot be extended to more instruments.  Returns a set of
+    event ID tuples.
+    """
+    instruments = sorted(offset_vector)
+    by_instrument = dict((instrument, [event for event in events if event.ifo == instrument]) for instrument in instruments)
+    coincident = lambda a, b: not comparefunc(a, offset_vector[a.ifo], b, offset_vector[b.ifo], 0., window)
+    cliques = [set((a, b) for a, b in itertools.product(by_instrument[x], by_instrument[y]) if coincident(a, b)) for x, y in itertools.combinations(instruments, 2)]
+    cliques = set.union(*cliques)
+    result = set()
+    while cliques:
+        bigger = set(clique + (event,) for clique in cliques for instrument in instruments if instrument > clique[-1].ifo for event in by_instrument[instrument] if all(coincident(e, event) for e in clique))
+        smaller = set(subset for clique in bigger for subset in itertools.combinations(clique, len(clique) - 1))
+        result |= set(clique for clique in cliques if len(clique) == len(instruments) or (include_small_coincs and clique not in smaller))
+        cliques = bigger
+    return set(tuple(event.event_id for event in coinc) for coinc in result)
+
+#
+# Unit tests
+#
+
+class test_from_filenames(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filenames = []
+        for i in range(n_files):
+            distributions = random_distributions(i)
+            if i % 2:
+                filename = os.path.join(self.tmpdir, "%d.bin" % i)
+                distributions.to_binary(filename, u"test")
+            else:
+                filename = os.path.join(self.tmpdir, "%d.xml" % i)
+                xmldoc = ligolw.Document()
+                xmldoc.appendChild(ligolw.LIGO_LW()).appendChild(distributions.to_xml(u"test"))
+                ligolw_utils.write_filename(xmldoc, filename)
+                xmldoc.unlink()
+            self.filenames.append(filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, filename):
+        if filename.endswith(".bin"):
+            return Distributions.from_binary(filename, u"test")
+        xmldoc = ligolw_utils.load_filename(filename, contenthandler = Distributions.LIGOLWContentHandler)
+        return Distributions.from_xml(xmldoc, u"test")
+
+    def assertDistributionsEqual(self, a, b):
+        self.assertEqual(a.process_id, b.process_id)
+        for attr in ("zero_lag_rates", "background_rates", "injection_rates", "zero_lag_pdf", "background_pdf", "injection_pdf"):
+            self.assertEqual(sorted(getattr(a, attr)), sorted(getattr(b, attr)))
+            for name, binnedarray in getattr(a, attr).items():
+                self.assertTrue(np.allclose(binnedarray.array, getattr(b, attr)[name].array, rtol = 1e-12, atol = 0.))
+
+    def test_matches_sequential_sum(self):
+        expected = self.load(self.filenames[0])
+        for filename in self.filenames[1:]:
+            expected += self.load(filename)
+        for nproc in (1, 3):
+            self.assertDistributionsEqual(Distributions.from_filenames(self.filenames, u"test", nproc = nproc), expected)
+
+    def test_single_file(self):
+        self.assertDistributionsEqual(Distributions.from_filenames(self.filenames[1:2], u"test"), self.load(self.filenames[1]))
+
+    def test_no_files(self):
+        self.assertRaises(ValueError, Distributions.from_filenames, [], u"test")
+
+class test_binary(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "test.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_round_trip(self):
+        distributions = random_distributions(3)
+        distributions.to_binary(self.filename, u"test")
+        loaded = Distributions.from_binary(self.filename, u"test")
+        self.assertEqual(loaded.process_id, distributions.process_id)
+        for attr in ("zero_lag_rates", "background_rates", "injection_rates", "zero_lag_pdf", "background_pdf", "injection_pdf"):
+            self.assertEqual(sorted(getattr(loaded, attr)), sorted(getattr(distributions, attr)))
+            for name, binnedarray in getattr(distributions, attr).items():
+                self.assertEqual(getattr(loaded, attr)[name].bins, binnedarray.bins)
+                self.assertTrue((getattr(loaded, attr)[name].array == binnedarray.array).all())
+        # the interpolators are rebuilt
+        self.assertEqual(loaded.lnP_noise({"dt": (0.01,)}), distributions.lnP_noise({"dt": (0.01,)}))
+        # copy-on-write:  modifying the loaded arrays does not alter
+        # the file
+        loaded.background_rates["dt"].array[:] = 0.
+        reloaded = Distributions.from_binary(self.filename, u"test")
+        self.assertTrue((reloaded.background_rates["dt"].array == distributions.background_rates["dt"].array).all())
+        self.assertRaises(ValueError, Distributions.from_binary, self.filename, u"other")
+
+class test_TimeSlideGraph(unittest.TestCase):
+    instruments = ("H1", "H2", "L1", "V1")
+    window = 0.01
+
+    def setUp(self):
+        self.events = make_events(self.instruments, window = self.window)
+        self.offset_vectors = dict((ilwd.ilwdchar(u"time_slide:time_slide_id:%d" % n), offsetvector.offsetvector((instrument, 0.5 * n * k) for k, instrument in enumerate(self.instruments))) for n in range(3))
+        self.offset_vectors[ilwd.ilwdchar(u"time_slide:time_slide_id:3")] = offsetvector.offsetvector({"H1": 0., "L1": 0., "V1": 0.})
+        self.thresholds = dict(((a, b), self.window) for a, b in itertools.permutations(self.instruments, 2))
+
+    def get_coincs(self, graph = None, **kwargs):
+        eventlists = snglcoinc.EventListDict(EventList, self.events)
+        if graph is None:
+            graph = snglcoinc.TimeSlideGraph(self.offset_vectors)
+        coincs = dict((time_slide_id, []) for time_slide_id in self.offset_vectors)
+        for node, coinc in graph.get_coincs(eventlists, comparefunc, self.thresholds, **kwargs):
+            coincs[node.time_slide_id].append(coinc)
+        return coincs
+
+    def assertCoincsEqual(self, coincs, include_small_coincs = True):
+        for time_slide_id, offset_vector in self.offset_vectors.items():
+            expected = expected_coincs(self.events, offset_vector, self.window, include_small_coincs = include_small_coincs)
+            self.assertEqual(len(coincs[time_slide_id]), len(set(coincs[time_slide_id])))
+            self.assertEqual(set(coincs[time_slide_id]), expected)
+
+    def test_coincs(self):
+        coincs = self.get_coincs()
+        # the test should involve coincs of all sizes
+        self.assertEqual(set(len(coinc) for coinc in itertools.chain(*coincs.values())), set((2, 3, 4)))
+        self.assertCoincsEqual(coincs)
+
+    def test_no_small_coincs(self):
+        self.assertCoincsEqual(self.get_coincs(include_small_coincs = False), include_small_coincs = False)
+
+    def test_nproc(self):
+        """
+        Constructing the leaf nodes in a pool of processes gives
+        the same coincs, in the same order.
+        """
+        coincs = self.get_coincs(nproc = 3)
+        self.assertCoincsEqual(coincs)
+        self.assertEqual(coincs, self.get_coincs())
+
+    def test_stream(self):
+        """
+        Streaming mode gives the same coincs, in the same order,
+        while retaining fewer, and releases every node.  The graph
+        can be used again after .reset().
+        """
+        graph = snglcoinc.TimeSlideGraph(self.offset_vectors)
+        coincs = self.get_coincs(graph)
+        peak = graph.peak_retained_coincs
+        graph.reset()
+        self.assertEqual(self.get_coincs(graph, stream = True), coincs)
+        self.assertTrue(0 < graph.peak_retained_coincs < peak)
+        for node in itertools.chain(graph.head, *graph.generations.values()):
+            self.assertTrue(node.released)
+            self.assertEqual(node.coincs, None)
+        self.assertEqual(graph.retention.count, 0)
+        self.assertRaises(AssertionError, self.get_coincs, graph)
+        graph.reset()
+        self.assertEqual(self.get_coincs(graph, stream = True, nproc = 2), coincs)
+
+class test_lnP_array(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.RandomState(10)
+        self.params_seq = []
+        for i in range(50):
+            params = {"snr_chi": (random_state.uniform(0., 10.), random_state.uniform(-1., 1.)), "dt": (random_state.uniform(-0.1, 0.1),)}
+            if i % 5 == 1:
+                del params["dt"]
+            elif i % 5 == 2:
+                del params["snr_chi"]
+            elif i % 5 == 3:
+                params = None
+            self.params_seq.append(params)
+
+    def assertArrayMatchesScalar(self, array, scalar):
+        expected = [scalar(params) if params is not None else float("nan") for params in self.params_seq]
+        self.assertEqual(array.shape, (len(self.params_seq),))
+        self.assertTrue(np.allclose(array, expected, rtol = 1e-12, atol = 0., equal_nan = True))
+
+    def test_lnP_array(self):
+        """
+        .lnP_noise_array() and .lnP_signal_array() agree with
+        .lnP_noise() and .lnP_signal(), with NaN for None.
+        """
+        distributions = random_distributions(0)
+        self.assertArrayMatchesScalar(distributions.lnP_noise_array(self.params_seq), distributions.lnP_noise)
+        self.assertArrayMatchesScalar(distributions.lnP_signal_array(self.params_seq), distributions.lnP_signal)
+        self.assertEqual(distributions.lnP_noise_array([]).shape, (0,))
+
+    def test_override(self):
+        """
+        The array methods call a sub-class' scalar methods.
+        """
+        class Override(Distributions):
+            def lnP_noise(self, params, offset = 0.):
+                return super(Override, self).lnP_noise(params) + 1. + offset
+        np.random.seed(1)
+        distributions = random_distributions(1)
+        np.random.seed(1)
+        override = random_distributions(1, cls = Override)
+        self.assertArrayMatchesScalar(override.lnP_noise_array(self.params_seq, offset = 2.), lambda params: distributions.lnP_noise(params) + 3.)
+        self.assertArrayMatchesScalar(override.lnP_signal_array(self.params_seq), distributions.lnP_signal)
+
+class test_lazy_finish(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(3)
+        self.distributions = random_distributions(3)
+        random_state = np.random.RandomState(11)
+        self.params_seq = [{"snr_chi": (random_state.uniform(0., 10.), random_state.uniform(-1., 1.)), "dt": (random_state.uniform(-0.1, 0.1),)} for i in range(20)]
+
+    def assertDistributionsAgree(self, lazy, eager):
+        for name in Distributions.binnings:
+            for pdf_attr in ("zero_lag_pdf", "background_pdf", "injection_pdf"):
+                self.assertTrue(np.allclose(getattr(lazy, pdf_attr)[name].array, getattr(eager, pdf_attr)[name].array, rtol = 1e-14, atol = 0.), (pdf_attr, name))
+        for params in self.params_seq:
+            self.assertAlmostEqual(lazy.lnP_noise(params), eager.lnP_noise(params), places = 12)
+            self.assertAlmostEqual(lazy.lnP_signal(params), eager.lnP_signal(params), places = 12)
+
+    def test_finish(self):
+        """
+        .finish(lazy = True) gives the same PDFs as .finish(), and
+        computes each only when it is used.
+        """
+        lazy = self.distributions.copy()
+        lazy.finish(lazy = True)
+        for pdf_attr in ("zero_lag_pdf", "background_pdf", "injection_pdf", "zero_lag_lnpdf_interp", "background_lnpdf_interp", "injection_lnpdf_interp"):
+            self.assertEqual(len(getattr(lazy, pdf_attr)), 0)
+        lazy.lnP_noise({"dt": (0.,)})
+        self.assertEqual(sorted(lazy.background_pdf), ["dt"])
+        self.assertEqual(sorted(lazy.background_lnpdf_interp), ["dt"])
+        self.assertEqual(len(lazy.injection_pdf), 0)
+        self.assertDistributionsAgree(lazy, self.distributions)
+        self.assertDistributionsAgree(lazy.copy(), self.distributions)
+
+    def test_add(self):
+        """
+        After .finish(lazy = True), the .add_*() methods discard
+        the PDFs and interpolators of the histograms they
+        increment, and only those, so that they are recomputed from
+        the new counts.
+        """
+        for method, pdf_attr, interp_attr in (("add_zero_lag", "zero_lag_pdf", "zero_lag_lnpdf_interp"), ("add_background", "background_pdf", "background_lnpdf_interp"), ("add_injection", "injection_pdf", "injection_lnpdf_interp")):
+            lazy = self.distributions.copy()
+            lazy.finish(lazy = True)
+            eager = self.distributions.copy()
+            for name in Distributions.binnings:
+                getattr(lazy, interp_attr)[name]
+            pdf = getattr(lazy, pdf_attr)["snr_chi"]
+            interp = getattr(lazy, interp_attr)["snr_chi"]
+            getattr(lazy, method)({"dt": (0.05,)}, weight = 100.)
+            getattr(eager, method)({"dt": (0.05,)}, weight = 100.)
+            self.assertTrue("dt" not in getattr(lazy, pdf_attr))
+            self.assertTrue("dt" not in getattr(lazy, interp_attr))
+            self.assertTrue(getattr(lazy, pdf_attr)["snr_chi"] is pdf)
+            self.assertTrue(getattr(lazy, interp_attr)["snr_chi"] is interp)
+            eager.finish()
+            self.assertDistributionsAgree(lazy, eager)
+
+    def test_iadd(self):
+        """
+        Adding to a lazily-finished object discards its PDFs, so
+        they are recomputed from the summed counts.
+        """
+        np.random.seed(4)
+        other = random_distributions(4)
+        lazy = self.distributions.copy()
+        lazy.finish(lazy = True)
+        lazy.lnP_noise(self.params_seq[0])
+        lazy += other
+        eager = self.distributions.copy()
+        eager += other
+        eager.finish()
+        self.assertDistributionsAgree(lazy, eager)
+
+class test_CoincSynthesizer(unittest.TestCase):
+    def make_synthesizer(self, random_state):
+        eventlists = {"H1": [0., 1., 2., 3.], "L1": [10., 11., 12., 13.], "V1": [20., 21., 22., 23.]}
+        seglists = segments.segmentlistdict({"H1": segments.segmentlist([segments.segment(0, 30)]), "L1": segments.segmentlist([segments.segment(10, 50)]), "V1": segments.segmentlist([segments.segment(20, 70)])})
+        return snglcoinc.CoincSynthesizer(eventlists, seglists, 0.001, abundance_rel_accuracy = 1e-2, random_state = random_state)
+
+    def test_random_state(self):
+        """
+        The draws depend only on the random_state argument, not on
+        Python's random module.
+        """
+        random.seed(0)
+        a = self.make_synthesizer(1).coinc_index_array(100, (lambda x: x))
+        random.seed(1)
+        b = self.make_synthesizer(np.random.RandomState(1)).coinc_index_array(100, (lambda x: x))
+        self.assertTrue((a == b).all())
+        c = self.make_synthesizer(2).coinc_index_array(100, (lambda x: x))
+        self.assertFalse((a == c).all())
+
+    def test_coinc_index_array(self):
+        coinc_synth = self.make_synthesizer(3)
+        instruments = coinc_synth.coinc_instruments
+        indexes = coinc_synth.coinc_index_array(500, (lambda x: x))
+        self.assertEqual(indexes.shape, (500, len(instruments)))
+        # at least two instruments participate, and no pair of
+        # events is coincident at zero lag
+        self.assertTrue(((indexes >= 0).sum(axis = 1) >= 2).all())
+        for row in indexes.tolist():
+            for i, j in itertools.combinations([k for k, index in enumerate(row) if index >= 0], 2):
+                a = coinc_synth.eventlists[instruments[i]][row[i]]
+                b = coinc_synth.eventlists[instruments[j]][row[j]]
+                self.assertTrue(abs(a - b) >= coinc_synth.tau[frozenset((instruments[i], instruments[j]))])
+        # no draws
+        self.assertEqual(coinc_synth.coinc_index_array(0, (lambda x: x)).shape, (0, len(instruments)))
+        self.assertEqual(coinc_synth.plausible_toas_array(instruments, 0).shape, (0, len(instruments)))
+        self.assertTrue(len(coinc_synth.coincs((lambda x: x)).next()) >= 2)
+
+class test_TOATriangulator(unittest.TestCase):
+    rs = [
+        np.array([-2161414.92636, -3834695.17889, 4600350.22664]),
+        np.array([-74276.0447238, -5496283.71971, 3224257.01744]),
+        np.array([4546374.099, 842989.697626, 4378576.96241]),
+        np.array([-3.5e6, 3.6e6, 3.9e6])
+    ]
+
+    def test_triangulate_many(self):
+        """
+        .triangulate_many() gives the same answers as calling the
+        triangulator for each set of arrival times, for networks of
+        2, 3 and 4 locations.
+        """
+        random_state = np.random.RandomState(9)
+        for n in (2, 3, 4):
+            for sigmas in ([0.005] * n, random_state.uniform(0.001, 0.01, n).tolist()):
+                triangulator = snglcoinc.TOATriangulator(self.rs[:n], sigmas)
+                # arrival times from random directions, with noise,
+                # and some that are not consistent with any
+                # direction
+                directions = random_state.normal(size = (100, 3))
+                directions /= np.sqrt((directions**2).sum(axis = 1))[:, np.newaxis]
+                ts = 100. * random_state.uniform(size = (100, 1)) - np.dot(directions, np.array(self.rs[:n]).T) / snglcoinc.speed_of_light + random_state.normal(0., 0.002, (100, n))
+                ts[::10] += random_state.uniform(-0.05, 0.05, (10, n))
+                results = triangulator.triangulate_many(ts)
+                self.assertEqual([result.shape for result in results], [(100, 3), (100,), (100,), (100,)])
+                expected = [triangulator(t) for t in ts]
+                for result, expected, atol in zip(results, zip(*expected), (1e-8, 1e-10, 1e-8, 1e-10)):
+                    self.assertTrue(np.allclose(result, np.array(expected), rtol = 1e-8, atol = atol))
+
+
+# construct and run the test suite
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(test_from_filenames))
+suite.addTest(unittest.makeSuite(test_binary))
+suite.addTest(unittest.makeSuite(test_lnP_array))
+suite.addTest(unittest.makeSuite(test_lazy_finish))
+suite.addTest(unittest.makeSuite(test_CoincSynthesizer))
+suite.addTest(unittest.makeSuite(test_TOATriangulator))
+suite.addTest(unittest.makeSuite(test_TimeSlideGraph))
+unittest.TextTestRunner(verbosity=2).run(suite)